@@ -0,0 +1,201 @@
+"""
+Check that a v2 snapshot holds everything CrunchyBridge had for the backup.
+
+For each of ``CrunchyCopy._get_copy_paths`` the source listing, made with
+the backup token credentials, and the destination listing under
+``S3_BACKUP_DEST_PREFIX`` are fetched at the same time by background
+threads. S3 lists keys in sorted order, so the two streams are merge-joined
+on the key relative to their prefix, holding only a few pages of each in
+memory however large the snapshot is.
+
+The audit is only meaningful shortly after the copy, since CrunchyBridge
+keeps adding to ``backup.history/``.
+"""
+import argparse
+import os
+import queue
+import threading
+from typing import Iterable, Iterator, Optional
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+from src.crunchy_copy import AU_BACKENDS, CrunchyCopy
+
+# ENV Variables
+load_dotenv()
+
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+# The number of pages of each listing to fetch ahead of the merge.
+PREFETCH_PAGES = 8
+
+MISSING = "missing"
+EXTRA = "extra"
+SIZE_MISMATCH = "size-mismatch"
+
+
+def relative_listing(s3, bucket: str, prefix: str, relative_path: str) -> Iterator[list]:
+    """
+    List the objects under one copy path, yielding a page at a time of
+    ``(relative key, size)`` pairs.
+
+    :param relative_path: A path from ``CrunchyCopy._get_copy_paths``. A path
+                          ending with ``/`` is a directory.
+    """
+    key = f"{prefix}{relative_path}"
+    paginator = s3.get_paginator("list_objects")
+    page_iterator = paginator.paginate(
+        Bucket=bucket, PaginationConfig={"PageSize": 1000}, Prefix=key
+    )
+    for page in page_iterator:
+        yield [
+            (obj["Key"].removeprefix(prefix), obj["Size"])
+            for obj in page.get("Contents", [])
+            # A file's prefix also matches files that start with its name.
+            if relative_path.endswith("/") or obj["Key"] == key
+        ]
+
+
+_DONE = object()
+
+
+def prefetch(pages: Iterable[list], max_pages: int = PREFETCH_PAGES) -> Iterator:
+    """
+    Fetch the pages in a background thread, keeping up to ``max_pages``
+    ahead of the consumer, and yield their items.
+    """
+    buffer = queue.Queue(max_pages)
+
+    def produce():
+        try:
+            for page in pages:
+                buffer.put(page)
+        except Exception as e:
+            buffer.put(e)
+        else:
+            buffer.put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (page := buffer.get()) is not _DONE:
+        if isinstance(page, Exception):
+            raise page
+        yield from page
+
+
+def merge_join(source: Iterable[tuple], destination: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    Join two streams of ``(key, size)`` pairs, both sorted by key.
+
+    :return: ``(key, source size, destination size)`` for every key in either
+             stream, with ``None`` for the side that doesn't have it.
+    """
+    source = iter(source)
+    destination = iter(destination)
+    src = next(source, None)
+    dest = next(destination, None)
+    while src or dest:
+        if dest is None or (src and src[0] < dest[0]):
+            yield src[0], src[1], None
+            src = next(source, None)
+        elif src is None or dest[0] < src[0]:
+            yield dest[0], None, dest[1]
+            dest = next(destination, None)
+        else:
+            yield src[0], src[1], dest[1]
+            src = next(source, None)
+            dest = next(destination, None)
+
+
+def audit_snapshot(
+    source_s3,
+    source_bucket: str,
+    source_prefix: str,
+    dest_s3,
+    dest_bucket: str,
+    dest_prefix: str,
+    relative_paths: Iterable[str],
+    counts: Optional[dict] = None,
+) -> Iterator[tuple]:
+    """
+    Compare the copy paths in the source and destination.
+
+    :param counts: (Optional) A dict that's updated with the number of
+                   objects compared and of each problem.
+    :return: ``(problem, relative key, source size, destination size)`` for
+             each missing, extra or size-mismatched object.
+    """
+    counts = {} if counts is None else counts
+    counts.setdefault("objects", 0)
+    for problem in (MISSING, EXTRA, SIZE_MISMATCH):
+        counts.setdefault(problem, 0)
+    for relative_path in relative_paths:
+        source = prefetch(relative_listing(source_s3, source_bucket, source_prefix, relative_path))
+        destination = prefetch(relative_listing(dest_s3, dest_bucket, dest_prefix, relative_path))
+        for key, source_size, dest_size in merge_join(source, destination):
+            counts["objects"] += 1
+            if dest_size is None:
+                problem = MISSING
+            elif source_size is None:
+                problem = EXTRA
+            elif source_size != dest_size:
+                problem = SIZE_MISMATCH
+            else:
+                continue
+            counts[problem] += 1
+            yield problem, key, source_size, dest_size
+
+
+def audit(cluster: str, target: str) -> dict:
+    """
+    Audit the cluster's snapshot and print each problem found.
+
+    :return dict: The number of objects compared and of each problem.
+    """
+    bucket_name = "aspiredu-pgbackups" if cluster not in AU_BACKENDS else "aspiredu-pgbackups-au"
+    with CrunchyCopy(bucket_name, cluster, backup_target=target, dry_run=True) as crunchy_copy:
+        source_s3_resource, source_s3 = crunchy_copy.get_source_s3()
+        counts = {}
+        for problem, key, source_size, dest_size in audit_snapshot(
+            source_s3,
+            crunchy_copy.backup_info["aws"]["s3_bucket"],
+            crunchy_copy.source_prefix,
+            crunchy_copy.s3,
+            bucket_name,
+            crunchy_copy.dest_prefix,
+            crunchy_copy._get_copy_paths(),
+            counts=counts,
+        ):
+            print(f"{problem}: {key} (source {source_size} bytes, destination {dest_size} bytes)")
+    print(
+        f"Compared {counts['objects']} objects: {counts[MISSING]} missing, "
+        f"{counts[EXTRA]} extra, {counts[SIZE_MISMATCH]} with mismatched sizes"
+    )
+    return counts
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="CrunchyBridge Backup Audit",
+        description="Compares a snapshot in AspirEDU's S3 Bucket with CrunchyBridge's backup",
+    )
+    parser.add_argument("-c", "--cluster", required=True, help="The name of the database cluster.")
+    parser.add_argument("-t", "--target", required=True, help="The snapshot to audit (YYYYMMDD).")
+    args = parser.parse_args()
+    counts = audit(args.cluster, args.target)
+    exit(1 if counts[MISSING] or counts[EXTRA] or counts[SIZE_MISMATCH] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import pytest
+
+from src.audit import (
+    EXTRA,
+    MISSING,
+    SIZE_MISMATCH,
+    audit_snapshot,
+    merge_join,
+    prefetch,
+)
+
+
+def fake_s3(mocker, keys: dict):
+    """An s3 client whose list_objects pages, of two objects each, hold the keys in order."""
+    s3 = mocker.Mock()
+
+    def paginate(Bucket, PaginationConfig, Prefix):
+        contents = [
+            {"Key": key, "Size": size}
+            for key, size in sorted(keys.items())
+            if key.startswith(Prefix)
+        ]
+        return [{"Contents": contents[slice(i, i + 2)]} for i in range(0, len(contents), 2)]
+
+    s3.get_paginator.return_value.paginate.side_effect = paginate
+    return s3
+
+
+def test_merge_join():
+    source = [("a", 1), ("b", 2), ("d", 4)]
+    destination = [("b", 2), ("c", 3), ("d", 5)]
+    assert list(merge_join(source, destination)) == [
+        ("a", 1, None),
+        ("b", 2, 2),
+        ("c", None, 3),
+        ("d", 4, 5),
+    ]
+    assert list(merge_join([], [("a", 1)])) == [("a", None, 1)]
+
+
+def test_prefetch_raises_listing_errors():
+    def pages():
+        yield [1, 2]
+        raise ValueError("Listing failed")
+
+    items = prefetch(pages())
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_audit_snapshot(mocker):
+    source = fake_s3(
+        mocker,
+        {
+            "c1/s1/archive/s1/archive.info": 1,
+            "c1/s1/archive/s1/archive.info.copy": 1,
+            "c1/s1/backup/s1/backup.info": 2,
+            "c1/s1/backup/s1/20230107-010000F/pg_data/base/1": 10,
+            "c1/s1/backup/s1/20230107-010000F/pg_data/base/2": 20,
+            "c1/s1/backup/s1/20230107-010000F/pg_data/base/3": 30,
+        },
+    )
+    prefix = "crunchybridge/v2/c1/20230107"
+    destination = fake_s3(
+        mocker,
+        {
+            f"{prefix}/archive/s1/archive.info": 1,
+            f"{prefix}/backup/s1/backup.info": 2,
+            f"{prefix}/backup/s1/20230107-010000F/pg_data/base/1": 10,
+            f"{prefix}/backup/s1/20230107-010000F/pg_data/base/3": 31,
+            f"{prefix}/backup/s1/20230107-010000F/pg_data/base/4": 40,
+        },
+    )
+    counts = {}
+    problems = list(
+        audit_snapshot(
+            source,
+            "crunchy",
+            "c1/s1",
+            destination,
+            "aspire",
+            prefix,
+            [
+                "/archive/s1/archive.info",
+                "/backup/s1/backup.info",
+                "/backup/s1/20230107-010000F/",
+            ],
+            counts=counts,
+        )
+    )
+
+    assert problems == [
+        (MISSING, "/backup/s1/20230107-010000F/pg_data/base/2", 20, None),
+        (SIZE_MISMATCH, "/backup/s1/20230107-010000F/pg_data/base/3", 30, 31),
+        (EXTRA, "/backup/s1/20230107-010000F/pg_data/base/4", None, 40),
+    ]
+    assert counts == {"objects": 6, MISSING: 1, EXTRA: 1, SIZE_MISMATCH: 1}
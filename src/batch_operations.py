@@ -0,0 +1,166 @@
+"""
+Write S3 Batch Operations manifests and job specs for bulk copies and expiry.
+
+For a full-history migration or clean up, making millions of requests from a
+single client is slow. Instead the plan can be written out as a CSV manifest
+that S3 Batch Operations works through at its own scale.
+
+Each manifest is streamed to disk as the plan is computed, alongside a job
+spec for ``aws s3control create-job --cli-input-json file://job.json``. The
+manifest must be uploaded as a single part to the location in the job spec so
+that its ETag is the MD5 recorded there:
+
+    aws s3api put-object --bucket {bucket} --key {key} --body {manifest}.csv
+
+Batch Operations can't rename keys or delete objects, so:
+
+- Copies use ``LambdaInvoke``. The function (BATCH_COPY_LAMBDA_ARN) receives
+  the source and destination prefixes and the copy arguments as user
+  arguments and copies each key to its v2 location.
+- Deletes tag the objects with ``EXPIRE_TAG`` so that the bucket's lifecycle
+  rule for that tag expires them.
+
+Neither the function nor the lifecycle rule is deployed by this repo, whose
+Terraform doesn't manage the buckets. Before running a job, check that the
+function exists and that the bucket has a rule like:
+
+    {"ID": "aspiredu-expire", "Status": "Enabled",
+     "Filter": {"Tag": {"Key": "aspiredu-expire", "Value": "true"}},
+     "Expiration": {"Days": 1}}
+
+Without the rule, tagged objects are kept. The account, role and function are
+read from the env variables below, and writing a manifest fails up front when
+the ones it needs aren't set.
+"""
+import csv
+import hashlib
+import json
+import os
+from typing import Optional
+from urllib.parse import quote
+
+from dotenv import load_dotenv
+
+# ENV Variables
+load_dotenv()
+
+BATCH_OPERATIONS_ACCOUNT_ID = os.getenv("BATCH_OPERATIONS_ACCOUNT_ID", "")
+BATCH_OPERATIONS_ROLE_ARN = os.getenv("BATCH_OPERATIONS_ROLE_ARN", "")
+BATCH_COPY_LAMBDA_ARN = os.getenv("BATCH_COPY_LAMBDA_ARN", "")
+BATCH_MANIFEST_PREFIX = os.getenv("BATCH_MANIFEST_PREFIX", "batch-operations/")
+
+EXPIRE_TAG = "aspiredu-expire"
+
+
+class BatchOperationsNotConfigured(ValueError):
+    pass
+
+
+def check_settings(copy: bool = False):
+    """
+    Raise if the env variables the job specs need aren't set, so a run fails
+    before it streams a manifest rather than writing an unusable job spec.
+
+    :param copy: Also require the copy function, BATCH_COPY_LAMBDA_ARN.
+    """
+    settings = {
+        "BATCH_OPERATIONS_ACCOUNT_ID": BATCH_OPERATIONS_ACCOUNT_ID,
+        "BATCH_OPERATIONS_ROLE_ARN": BATCH_OPERATIONS_ROLE_ARN,
+    }
+    if copy:
+        settings["BATCH_COPY_LAMBDA_ARN"] = BATCH_COPY_LAMBDA_ARN
+    if missing := [name for name, value in settings.items() if not value]:
+        raise BatchOperationsNotConfigured(f"Set {', '.join(missing)} to write batch jobs.")
+
+
+class BatchManifest:
+    def __init__(self, directory: str, name: str, bucket: str):
+        """
+        :param directory: The local directory to write the manifest and job spec to.
+        :param name: The name of the job, used for the file names.
+        :param bucket: The bucket the manifest will be uploaded to.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.bucket = bucket
+        self.path = os.path.join(directory, f"{name}.csv")
+        self.job_path = os.path.join(directory, f"{name}.job.json")
+        self.key = f"{BATCH_MANIFEST_PREFIX}{name}.csv"
+        self.count = 0
+        self._md5 = hashlib.md5()
+        self._file = open(self.path, "w", newline="")
+        self._writer = csv.writer(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, line: str):
+        # The csv writer writes through here so the MD5 is computed as the file is streamed.
+        self._md5.update(line.encode("utf-8"))
+        self._file.write(line)
+
+    def add(self, bucket: str, key: str):
+        # Batch Operations requires the keys to be URL encoded.
+        self._writer.writerow([bucket, quote(key)])
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def write_job_spec(self, operation: dict, description: str) -> Optional[str]:
+        """
+        Write the job spec for the manifest. Nothing is written for an empty manifest.
+
+        :return str: The path to the job spec.
+        """
+        if not self.count:
+            return None
+        check_settings()
+        spec = {
+            "AccountId": BATCH_OPERATIONS_ACCOUNT_ID,
+            "ConfirmationRequired": True,
+            "Description": description,
+            "Operation": operation,
+            "Manifest": {
+                "Spec": {"Format": "S3BatchOperations_CSV_20180820", "Fields": ["Bucket", "Key"]},
+                "Location": {
+                    "ObjectArn": f"arn:aws:s3:::{self.bucket}/{self.key}",
+                    "ETag": self._md5.hexdigest(),
+                },
+            },
+            "Report": {
+                "Bucket": f"arn:aws:s3:::{self.bucket}",
+                "Format": "Report_CSV_20180820",
+                "Enabled": True,
+                "Prefix": f"{BATCH_MANIFEST_PREFIX}reports/{self.name}",
+                "ReportScope": "FailedTasksOnly",
+            },
+            "Priority": 10,
+            "RoleArn": BATCH_OPERATIONS_ROLE_ARN,
+        }
+        with open(self.job_path, "w") as job:
+            json.dump(spec, job, indent=2)
+        print(f"Wrote {self.count} keys to {self.path} and the job spec to {self.job_path}")
+        return self.job_path
+
+
+def copy_operation(source_prefix: str, destination_prefix: str, extra_args: dict) -> dict:
+    check_settings(copy=True)
+    return {
+        "LambdaInvoke": {
+            "FunctionArn": BATCH_COPY_LAMBDA_ARN,
+            "InvocationSchemaVersion": "2.0",
+            "UserArguments": {
+                "SourcePrefix": source_prefix,
+                "DestinationPrefix": destination_prefix,
+                **extra_args,
+            },
+        }
+    }
+
+
+def expire_operation() -> dict:
+    return {"S3PutObjectTagging": {"TagSet": [{"Key": EXPIRE_TAG, "Value": "true"}]}}
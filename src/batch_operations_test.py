@@ -0,0 +1,69 @@
+import hashlib
+import json
+
+import pytest
+
+from src.batch_operations import (
+    BatchManifest,
+    BatchOperationsNotConfigured,
+    check_settings,
+    copy_operation,
+    expire_operation,
+)
+
+
+@pytest.fixture
+def settings(mocker):
+    mocker.patch("src.batch_operations.BATCH_OPERATIONS_ACCOUNT_ID", "123")
+    mocker.patch("src.batch_operations.BATCH_OPERATIONS_ROLE_ARN", "arn:aws:iam::123:role/batch")
+    mocker.patch("src.batch_operations.BATCH_COPY_LAMBDA_ARN", "arn:aws:lambda:copy")
+
+
+def test_batch_manifest(tmp_path, settings):
+    with BatchManifest(str(tmp_path), "migrate-c1-20230101", "b") as manifest:
+        manifest.add("b", "crunchybridge/c1/backup/s1/backup.info")
+        manifest.add("b", "crunchybridge/c1/backup/s1/20230101-010000F/a file,1")
+
+    contents = (tmp_path / "migrate-c1-20230101.csv").read_bytes()
+    assert contents == (
+        b"b,crunchybridge/c1/backup/s1/backup.info\r\n"
+        b"b,crunchybridge/c1/backup/s1/20230101-010000F/a%20file%2C1\r\n"
+    )
+
+    job_path = manifest.write_job_spec(
+        copy_operation("crunchybridge/c1/", "crunchybridge/v2/c1/20230101/", {"Expires": "x"}),
+        description="Migrate c1 20230101",
+    )
+    with open(job_path) as job:
+        spec = json.load(job)
+    assert spec["Manifest"]["Location"] == {
+        "ObjectArn": "arn:aws:s3:::b/batch-operations/migrate-c1-20230101.csv",
+        "ETag": hashlib.md5(contents).hexdigest(),
+    }
+    assert spec["Operation"]["LambdaInvoke"] == {
+        "FunctionArn": "arn:aws:lambda:copy",
+        "InvocationSchemaVersion": "2.0",
+        "UserArguments": {
+            "SourcePrefix": "crunchybridge/c1/",
+            "DestinationPrefix": "crunchybridge/v2/c1/20230101/",
+            "Expires": "x",
+        },
+    }
+
+
+def test_check_settings(mocker, settings):
+    check_settings(copy=True)
+    mocker.patch("src.batch_operations.BATCH_COPY_LAMBDA_ARN", "")
+    check_settings()
+    with pytest.raises(BatchOperationsNotConfigured, match="BATCH_COPY_LAMBDA_ARN"):
+        check_settings(copy=True)
+    mocker.patch("src.batch_operations.BATCH_OPERATIONS_ROLE_ARN", "")
+    with pytest.raises(BatchOperationsNotConfigured, match="BATCH_OPERATIONS_ROLE_ARN"):
+        check_settings()
+
+
+def test_empty_manifest_has_no_job(tmp_path):
+    with BatchManifest(str(tmp_path), "delete-b", "b") as manifest:
+        pass
+    assert manifest.write_job_spec(expire_operation(), description="Expire") is None
+    assert not (tmp_path / "delete-b.job.json").exists()
@@ -0,0 +1,219 @@
+"""
+Micro-benchmarks of the functions run once per backup folder or WAL segment.
+
+At our scale these run hundreds of thousands of times per run, so each case
+drives a function over a realistic volume: three years of daily backup
+folders, a wide range of LSNs and a manifest with 100,000 files. Each case
+reports its operations per second and the peak memory allocated by one
+batch, measured with ``tracemalloc``.
+
+Save the results on a machine as the baseline, then compare later runs on
+the same machine against it. A case more than ``--tolerance`` slower, or
+allocating that much more, is a regression and fails the run:
+
+    python -m src.benchmark --save benchmarks.json
+    python -m src.benchmark --baseline benchmarks.json
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, NamedTuple, Optional
+
+from src.create_test_backups import MANIFEST_TEMPLATE
+from src.delete_backups import (
+    CRUNCHYBRIDGE_BACKUP_PATTERN,
+    meets_retention_policy,
+    saturdays_for_the_past_three_years,
+)
+from src.migrate_backups import lsn_in_range, parse_manifest
+from src.schedule import is_valid_saturday
+
+# Allocations can vary by a few blocks between runs, so small peaks aren't compared.
+MIN_COMPARED_PEAK_BYTES = 64 * 1024
+
+
+class Case(NamedTuple):
+    name: str
+    # Runs one batch and returns the number of operations in it.
+    run: Callable[[], int]
+
+
+def cases(scale: float = 1.0) -> list[Case]:
+    """
+    :param scale: Multiplies the volume of each case, to make a quick run for tests.
+    """
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(max(1, int(3 * 365 * scale)))]
+    folders = [f"{day:%Y%m%d}-010000F" for day in days]
+    manifest = MANIFEST_TEMPLATE.format(
+        start="00000001000008210000001D",
+        stop="00000001000008210000001F",
+        label=folders[0],
+        files="\n".join(
+            f'pg_data/base/16384/{relfilenode}={{"size":{relfilenode}}}'
+            for relfilenode in range(16385, 16385 + max(1, int(100_000 * scale)))
+        ),
+    ).encode("utf-8")
+    lsn_count = max(1, int(2**16 * scale))
+
+    def uncached_saturdays():
+        # Clear the cache to measure the rrule, one day per operation.
+        for day in days[:30]:
+            saturdays_for_the_past_three_years.cache_clear()
+            saturdays_for_the_past_three_years(day)
+        return len(days[:30])
+
+    def retention_policy():
+        for day in days:
+            meets_retention_policy(day)
+        return len(days)
+
+    def valid_saturdays():
+        for day in days:
+            is_valid_saturday(day)
+        return len(days)
+
+    def lsns():
+        count = 0
+        for _ in lsn_in_range("0000000100000821", f"{0x100000821 + lsn_count - 1:016X}"):
+            count += 1
+        return count
+
+    def manifests():
+        parse_manifest(io.BytesIO(manifest))
+        return 1
+
+    def backup_pattern():
+        for folder in folders:
+            CRUNCHYBRIDGE_BACKUP_PATTERN.match(folder)
+        return len(folders)
+
+    return [
+        Case("saturdays_for_the_past_three_years", uncached_saturdays),
+        Case("meets_retention_policy", retention_policy),
+        Case("is_valid_saturday", valid_saturdays),
+        Case("lsn_in_range", lsns),
+        Case("parse_manifest", manifests),
+        Case("CRUNCHYBRIDGE_BACKUP_PATTERN", backup_pattern),
+    ]
+
+
+def measure(case: Case, min_seconds: float = 1.0, repeat: int = 5) -> dict:
+    """
+    Time the case's batches over ``repeat`` rounds of at least ``min_seconds / repeat``
+    each, keeping the fastest since slower rounds are noise from the rest of
+    the machine. Then run one batch under tracemalloc.
+    """
+    ops_per_second = 0
+    for _ in range(repeat):
+        operations = 0
+        start = time.perf_counter()
+        while True:
+            operations += case.run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds / repeat:
+                break
+        ops_per_second = max(ops_per_second, operations / elapsed)
+
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_second": ops_per_second, "peak_bytes": peak_bytes}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the results with the baseline.
+
+    :return list[str]: A description of each regression.
+    """
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result["ops_per_second"] < before["ops_per_second"] * (1 - tolerance):
+            found.append(
+                f"{name} ran at {result['ops_per_second']:,.0f} ops/sec, "
+                f"down from {before['ops_per_second']:,.0f}"
+            )
+        if result["peak_bytes"] > max(
+            before["peak_bytes"] * (1 + tolerance), MIN_COMPARED_PEAK_BYTES
+        ):
+            found.append(
+                f"{name} allocated {result['peak_bytes']:,} bytes at its peak, "
+                f"up from {before['peak_bytes']:,}"
+            )
+    return found
+
+
+def run(
+    baseline_path: Optional[str] = None,
+    save_path: Optional[str] = None,
+    tolerance: float = 0.2,
+    min_seconds: float = 1.0,
+) -> int:
+    """
+    :return int: The exit code, 1 if there were regressions.
+    """
+    results = {}
+    for case in cases():
+        results[case.name] = measure(case, min_seconds=min_seconds)
+        print(
+            f"{case.name:40} {results[case.name]['ops_per_second']:>16,.0f} ops/sec "
+            f"{results[case.name]['peak_bytes']:>14,} peak bytes"
+        )
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            found = regressions(results, json.load(f), tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="S3 Database Backup Benchmarks",
+        description="Measures the functions run once per backup folder or WAL segment",
+    )
+    parser.add_argument(
+        "--baseline", help="(Optional) The path to earlier results to check for regressions."
+    )
+    parser.add_argument("--save", help="(Optional) The path to save the results to.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="(Optional) The fraction slower, or more memory, that counts as a regression.",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=1.0,
+        help="(Optional) The minimum seconds to run each case for.",
+    )
+    args = parser.parse_args()
+    sys.exit(
+        run(
+            baseline_path=args.baseline,
+            save_path=args.save,
+            tolerance=args.tolerance,
+            min_seconds=args.seconds,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from src.benchmark import cases, measure, regressions
+
+
+def test_cases_run():
+    for case in cases(scale=0.01):
+        result = measure(case, min_seconds=0)
+        assert result["ops_per_second"] > 0, case.name
+        assert result["peak_bytes"] >= 0, case.name
+
+
+def test_regressions():
+    baseline = {
+        "fast": {"ops_per_second": 1000, "peak_bytes": 1_000_000},
+        "small": {"ops_per_second": 1000, "peak_bytes": 100},
+    }
+    results = {
+        "fast": {"ops_per_second": 700, "peak_bytes": 1_300_000},
+        # Within the noise of small allocations.
+        "small": {"ops_per_second": 900, "peak_bytes": 1000},
+        "new": {"ops_per_second": 1, "peak_bytes": 1},
+    }
+    assert regressions(results, baseline, tolerance=0.2) == [
+        "fast ran at 700 ops/sec, down from 1,000",
+        "fast allocated 1,300,000 bytes at its peak, up from 1,000,000",
+    ]
@@ -0,0 +1,281 @@
+"""
+A local SQLite catalog of every backup object in our S3 buckets.
+
+``delete_backups``, ``migrate_backups`` and ``crunchy_copy`` each need to know
+what is stored under ``crunchybridge/``. Rather than re-crawling the buckets
+with LIST calls on every run, they can query this catalog and keep it up to
+date as they copy and delete objects.
+
+The catalog stores one row per object:
+
+    bucket, key, size, etag, storage_class, cluster, stanza, backup_date
+
+``cluster``, ``stanza`` and ``backup_date`` are parsed from the key for both of
+the layouts we store:
+
+    crunchybridge/{cluster}/{archive|backup}/{stanza}/20230101-010000F/...
+    crunchybridge/v2/{cluster}/20230101/{archive|backup}/{stanza}/...
+
+The catalog can drift from S3 (manual deletes, lifecycle expiry, failed runs),
+so ``python -m src.catalog --bucket ...`` re-syncs it against the bucket.
+"""
+
+import argparse
+import os
+import sqlite3
+from typing import Iterable, Iterator, Optional
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+from src.s3 import get_s3
+
+# ENV Variables
+load_dotenv()
+
+ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
+ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+# When set, the tools use the catalog at this path instead of listing S3.
+CATALOG_PATH = os.getenv("CATALOG_PATH")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    storage_class TEXT,
+    cluster TEXT,
+    stanza TEXT,
+    backup_date TEXT,
+    PRIMARY KEY (bucket, key)
+);
+CREATE INDEX IF NOT EXISTS objects_by_backup ON objects (bucket, cluster, backup_date);
+"""
+
+# The highest code point, used as an exclusive upper bound for prefix queries.
+_PREFIX_END = "\U0010ffff"
+
+
+def parse_key(key: str) -> (Optional[str], Optional[str], Optional[str]):
+    """
+    Parse the cluster, stanza and backup date (YYYYMMDD) out of a key.
+
+    Any part that can't be determined from the key is returned as None.
+    """
+    segments = key.split("/")
+    if segments[0] != "crunchybridge" or len(segments) < 3:
+        return None, None, None
+    if segments[1] == "v2":
+        # crunchybridge/v2/{cluster}/{YYYYMMDD}/{archive|backup}/{stanza}/...
+        cluster = segments[2]
+        backup_date = segments[3] if len(segments) > 4 else None
+        stanza = segments[5] if len(segments) > 6 else None
+        return cluster, stanza, backup_date
+    # crunchybridge/{cluster}/{archive|backup}/{stanza}/{YYYYMMDD-HHMMSSF}/...
+    cluster = segments[1]
+    stanza = segments[3] if len(segments) > 4 else None
+    backup_date = None
+    if segments[2] == "backup" and len(segments) > 5 and segments[4][:8].isdigit():
+        backup_date = segments[4][:8]
+    return cluster, stanza, backup_date
+
+
+class Catalog:
+    def __init__(self, path: str):
+        """
+        :param path: The path to the SQLite database. It's created if it doesn't exist.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, bucket: str, objects: Iterable[dict]):
+        """
+        Add or update objects in the catalog.
+
+        :param bucket: The name of the bucket the objects are stored in.
+        :param objects: Dictionaries in the shape returned by ``list_objects``,
+                        using the ``Key``, ``Size``, ``ETag`` and ``StorageClass`` keys.
+        """
+        rows = (
+            (
+                bucket,
+                obj["Key"],
+                obj["Size"],
+                obj.get("ETag"),
+                obj.get("StorageClass"),
+                *parse_key(obj["Key"]),
+            )
+            for obj in objects
+        )
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def remove(self, bucket: str, keys: Iterable[str]):
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM objects WHERE bucket = ? AND key = ?",
+                ((bucket, key) for key in keys),
+            )
+
+    def remove_prefix(self, bucket: str, prefix: str):
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM objects WHERE bucket = ? AND key >= ? AND key < ?",
+                (bucket, prefix, prefix + _PREFIX_END),
+            )
+
+    def get(self, bucket: str, key: str) -> Optional[dict]:
+        for obj in self._query(
+            "SELECT key, size, etag, storage_class FROM objects WHERE bucket = ? AND key = ?",
+            (bucket, key),
+        ):
+            return obj
+        return None
+
+    def objects(self, bucket: str, prefix: str) -> Iterator[dict]:
+        """Yield the objects under the prefix in key order, shaped like ``list_objects``."""
+        return self._query(
+            "SELECT key, size, etag, storage_class FROM objects "
+            "WHERE bucket = ? AND key >= ? AND key < ? ORDER BY key",
+            (bucket, prefix, prefix + _PREFIX_END),
+        )
+
+    def backup_directories(self, bucket: str, cluster: str = None) -> Iterator[tuple[str, str]]:
+        """
+        Find the daily backup folders of the CrunchyBridge clusters.
+
+        This mirrors ``delete_backups.backup_directories`` and yields the
+        ``crunchybridge/{cluster}/backup/`` prefix with each backup folder prefix.
+        """
+        # The folder follows crunchybridge/{cluster}/backup/{stanza}/ in the key, so
+        # each row is cut down to its folder's prefix and the prefixes are deduplicated
+        # by SQLite, returning one row per folder rather than one per object.
+        query = (
+            "WITH folders AS ("
+            "SELECT cluster, 'crunchybridge/' || cluster || '/backup/' || stanza || '/' AS parent, "
+            "substr(key, length(cluster) + length(stanza) + 24) AS rest FROM objects "
+            "WHERE bucket = ? AND key >= 'crunchybridge/' AND key < 'crunchybridge0' "
+            "AND key NOT LIKE 'crunchybridge/v2/%' AND backup_date IS NOT NULL"
+        )
+        params = [bucket]
+        if cluster:
+            query += " AND cluster = ?"
+            params.append(cluster)
+        query += (
+            ") SELECT DISTINCT cluster, parent || substr(rest, 1, instr(rest, '/')) AS prefix "
+            "FROM folders ORDER BY prefix"
+        )
+        for row_cluster, backup_folder_prefix in self.connection.execute(query, params):
+            yield f"crunchybridge/{row_cluster}/backup/", backup_folder_prefix
+
+    def reconcile(self, s3, bucket: str, prefix: str = "crunchybridge/") -> int:
+        """
+        Re-sync the catalog with the objects stored in S3 under the prefix.
+
+        The listing is streamed a page at a time, so memory use doesn't grow
+        with the size of the bucket. Rows for objects that no longer exist
+        are removed.
+
+        :return int: The number of objects found in S3.
+        """
+        count = 0
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM seen")
+        paginator = s3.get_paginator("list_objects")
+        page_iterator = paginator.paginate(
+            Bucket=bucket, PaginationConfig={"PageSize": 1000}, Prefix=prefix
+        )
+        for page in page_iterator:
+            contents = page.get("Contents", [])
+            self.record(bucket, contents)
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO seen VALUES (?)", ((obj["Key"],) for obj in contents)
+                )
+            count += len(contents)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM objects WHERE bucket = ? AND key >= ? AND key < ? "
+                "AND key NOT IN (SELECT key FROM seen)",
+                (bucket, prefix, prefix + _PREFIX_END),
+            )
+            self.connection.execute("DROP TABLE seen")
+        return count
+
+    def _query(self, query, params) -> Iterator[dict]:
+        for key, size, etag, storage_class in self.connection.execute(query, params):
+            yield {"Key": key, "Size": size, "ETag": etag, "StorageClass": storage_class}
+
+
+def open_catalog(path: Optional[str] = None) -> Optional[Catalog]:
+    """Open the catalog at the path, or the CATALOG_PATH if set, otherwise return None."""
+    path = path or CATALOG_PATH
+    return Catalog(path) if path else None
+
+
+def list_objects(s3, bucket: str, prefix: str, catalog: Optional[Catalog] = None) -> Iterator[dict]:
+    """
+    Yield every object under the prefix from the catalog if available, otherwise from S3.
+    """
+    if catalog:
+        yield from catalog.objects(bucket, prefix)
+        return
+    paginator = s3.get_paginator("list_objects")
+    page_iterator = paginator.paginate(
+        Bucket=bucket, PaginationConfig={"PageSize": 1000}, Prefix=prefix
+    )
+    for page in page_iterator:
+        yield from page.get("Contents", [])
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="S3 Database Backup Catalog",
+        description="Re-syncs the local backup catalog against the S3 bucket",
+    )
+
+    parser.add_argument(
+        "--bucket", dest="bucket_name", required=True, help="The name of the bucket."
+    )
+    parser.add_argument(
+        "--catalog",
+        required=not CATALOG_PATH,
+        default=CATALOG_PATH,
+        help="The path to the SQLite catalog. Defaults to CATALOG_PATH.",
+    )
+    parser.add_argument(
+        "--prefix",
+        default="crunchybridge/",
+        help="(Optional) Only reconcile the objects under this prefix.",
+    )
+    args = parser.parse_args()
+    s3_resource, s3 = get_s3(ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY)
+    catalog = Catalog(args.catalog)
+    count = catalog.reconcile(s3, args.bucket_name, prefix=args.prefix)
+    catalog.close()
+    print(f"Reconciled {count} objects in {args.bucket_name}/{args.prefix}")
+
+
+if __name__ == "__main__":
+    main()
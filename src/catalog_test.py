@@ -0,0 +1,91 @@
+import pytest
+
+from src.catalog import Catalog, list_objects, parse_key
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.sqlite3"))
+    yield catalog
+    catalog.close()
+
+
+def obj(key, size=1, etag='"abc"', storage_class="STANDARD"):
+    return {"Key": key, "Size": size, "ETag": etag, "StorageClass": storage_class}
+
+
+def test_parse_key():
+    assert parse_key("crunchybridge/c1/backup/s1/20230101-010000F/pg_data/PG_VERSION") == (
+        "c1",
+        "s1",
+        "20230101",
+    )
+    assert parse_key("crunchybridge/c1/backup/s1/backup.history/2023/x.gz") == ("c1", "s1", None)
+    assert parse_key("crunchybridge/c1/archive/s1/archive.info") == ("c1", "s1", None)
+    assert parse_key("crunchybridge/v2/c1/20230101/backup/s1/backup.info") == (
+        "c1",
+        "s1",
+        "20230101",
+    )
+    assert parse_key("heroku/file.dump") == (None, None, None)
+
+
+def test_record_and_query(catalog):
+    catalog.record(
+        "b",
+        [
+            obj("crunchybridge/c1/backup/s1/20230102-010000F/b.txt", size=2),
+            obj("crunchybridge/c1/backup/s1/20230102-010000F/pg_data/c.txt"),
+            obj("crunchybridge/c1/backup/s1/20230101-010000F/a.txt"),
+            obj("crunchybridge/c1/backup/s1/backup.info"),
+            obj("crunchybridge/c2/backup/s2/20230101-010000F/a.txt"),
+        ],
+    )
+    assert [o["Key"] for o in catalog.objects("b", "crunchybridge/c1/")] == [
+        "crunchybridge/c1/backup/s1/20230101-010000F/a.txt",
+        "crunchybridge/c1/backup/s1/20230102-010000F/b.txt",
+        "crunchybridge/c1/backup/s1/20230102-010000F/pg_data/c.txt",
+        "crunchybridge/c1/backup/s1/backup.info",
+    ]
+    assert catalog.get("b", "crunchybridge/c1/backup/s1/20230102-010000F/b.txt")["Size"] == 2
+    assert catalog.get("other", "crunchybridge/c1/backup/s1/20230102-010000F/b.txt") is None
+    assert list(catalog.backup_directories("b", cluster="c1")) == [
+        ("crunchybridge/c1/backup/", "crunchybridge/c1/backup/s1/20230101-010000F/"),
+        ("crunchybridge/c1/backup/", "crunchybridge/c1/backup/s1/20230102-010000F/"),
+    ]
+    assert list(catalog.backup_directories("b"))[-1] == (
+        "crunchybridge/c2/backup/",
+        "crunchybridge/c2/backup/s2/20230101-010000F/",
+    )
+
+    catalog.remove_prefix("b", "crunchybridge/c1/backup/s1/20230101-010000F/")
+    catalog.remove("b", ["crunchybridge/c1/backup/s1/backup.info"])
+    assert [o["Key"] for o in catalog.objects("b", "crunchybridge/c1/")] == [
+        "crunchybridge/c1/backup/s1/20230102-010000F/b.txt",
+        "crunchybridge/c1/backup/s1/20230102-010000F/pg_data/c.txt",
+    ]
+
+
+def test_reconcile(mocker, catalog):
+    catalog.record("b", [obj("crunchybridge/c1/gone.txt"), obj("heroku/untouched.txt")])
+    s3 = mocker.Mock()
+    s3.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [obj("crunchybridge/c1/a.txt", size=5)]},
+        {"Contents": [obj("crunchybridge/c1/b.txt")]},
+    ]
+    assert catalog.reconcile(s3, "b") == 2
+    assert [o["Key"] for o in catalog.objects("b", "")] == [
+        "crunchybridge/c1/a.txt",
+        "crunchybridge/c1/b.txt",
+        "heroku/untouched.txt",
+    ]
+    assert catalog.get("b", "crunchybridge/c1/a.txt")["Size"] == 5
+
+
+def test_list_objects_prefers_catalog(mocker, catalog):
+    catalog.record("b", [obj("crunchybridge/c1/a.txt")])
+    s3 = mocker.Mock()
+    assert [o["Key"] for o in list_objects(s3, "b", "crunchybridge/", catalog)] == [
+        "crunchybridge/c1/a.txt"
+    ]
+    assert not s3.get_paginator.called
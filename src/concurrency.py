@@ -0,0 +1,175 @@
+"""
+Adaptive concurrency for parallel S3 requests.
+
+S3 answers too many requests to a prefix with ``503 SlowDown``, and an
+overloaded host or network shows up as connection resets. Rather than a fixed
+number of workers per cluster, the copy, migrate and delete executors share
+an ``AdaptiveConcurrency`` that limits how many requests are in flight using
+additive increase, multiplicative decrease (AIMD):
+
+- Each successful request raises the limit by ``1 / limit``, so about one
+  more request per round of ``limit`` requests, while the average latency
+  stays within ``latency_tolerance`` times the best seen.
+- A throttling or connection error cuts the limit by ``decrease_factor``, at
+  most once per ``cooldown`` so a burst of errors from the requests already
+  in flight only counts once.
+
+``watch`` hooks into a client's retry handling so the errors botocore retries
+by itself are still seen. The current limit is included in telemetry by
+``report``.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import sentry_sdk
+from botocore.exceptions import ClientError, ConnectionClosedError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import ReadTimeoutError
+
+THROTTLING_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "ServiceUnavailable",
+    "503",
+}
+CONNECTION_ERRORS = (BotocoreConnectionError, ConnectionClosedError, ReadTimeoutError)
+# The weight of each request's latency in the moving average.
+LATENCY_SMOOTHING = 0.1
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLING_CODES
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class AdaptiveConcurrency:
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = None,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        cooldown: float = 1.0,
+    ):
+        """
+        :param initial: The number of requests allowed in flight to start with.
+        :param max_limit: The most requests allowed in flight. Defaults to 4 times ``initial``.
+        :param decrease_factor: The limit is multiplied by this on a throttling error.
+        :param latency_tolerance: The limit isn't raised while the average latency
+                                  is more than this times the lowest average seen.
+        :param cooldown: The minimum seconds between decreases.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial * 4
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self._limit = float(max(min_limit, min(initial, self.max_limit)))
+        self._in_flight = 0
+        self._last_decrease = float("-inf")
+        self.requests = 0
+        self.throttles = 0
+        self.latency = None
+        self.best_latency = None
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the in-flight requests while making a request."""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_throttling_error(e):
+                self.on_throttle()
+            raise
+        else:
+            self.on_success(time.monotonic() - start)
+        finally:
+            self.release()
+
+    def call(self, func, *args, **kwargs):
+        with self.slot():
+            return func(*args, **kwargs)
+
+    def on_success(self, latency: float):
+        with self._condition:
+            self.requests += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+            if self.latency <= self.best_latency * self.latency_tolerance:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+
+    def watch(self, client):
+        """
+        Count the throttling and connection errors of every attempt the
+        client makes, including those that botocore retries.
+        """
+        # Registered first, since the retry handler's response ends the event.
+        # The unique id makes watching the same client again, such as for each
+        # of the worker service's jobs, a no-op.
+        client.meta.events.register_first(
+            "needs-retry.s3", self._on_attempt, unique_id=f"adaptive-concurrency-{id(self)}"
+        )
+
+    def _on_attempt(self, response=None, caught_exception=None, **kwargs):
+        if caught_exception is not None:
+            if isinstance(caught_exception, CONNECTION_ERRORS):
+                self.on_throttle()
+        elif response is not None:
+            http_response, parsed = response
+            code = parsed.get("Error", {}).get("Code")
+            if http_response.status_code == 503 or code in THROTTLING_CODES:
+                self.on_throttle()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "max_limit": self.max_limit,
+                "in_flight": self._in_flight,
+                "requests": self.requests,
+                "throttles": self.throttles,
+                "latency_seconds": self.latency,
+            }
+
+    def report(self, name: str):
+        """Print the current limits and add them to the Sentry scope."""
+        stats = self.stats()
+        print(f"{name} concurrency: {stats}")
+        sentry_sdk.set_context(f"{name}_concurrency", stats)
+        sentry_sdk.set_tag(f"{name}_concurrency_limit", stats["limit"])
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.concurrency import AdaptiveConcurrency
+
+
+def slow_down():
+    return ClientError({"Error": {"Code": "SlowDown"}}, "CopyObject")
+
+
+def test_additive_increase():
+    concurrency = AdaptiveConcurrency(2, max_limit=3)
+    # About one more per round of ``limit`` successes: 2 + 1/2 + 1/2.5 + 1/2.9.
+    for _ in range(3):
+        concurrency.on_success(0.1)
+    assert concurrency.limit == 3
+    for _ in range(10):
+        concurrency.on_success(0.1)
+    assert concurrency.limit == 3
+
+
+def test_increase_is_held_while_latency_is_high():
+    concurrency = AdaptiveConcurrency(2, latency_tolerance=2.0)
+    concurrency.on_success(0.1)
+    for _ in range(20):
+        concurrency.on_success(10)
+    assert concurrency.limit == 2
+
+
+def test_multiplicative_decrease(mocker):
+    mocker.patch("src.concurrency.time.monotonic", side_effect=[100, 100.5, 102])
+    concurrency = AdaptiveConcurrency(16, cooldown=1.0)
+    concurrency.on_throttle()
+    assert concurrency.limit == 8
+    # Within the cooldown, from requests that were already in flight.
+    concurrency.on_throttle()
+    assert concurrency.limit == 8
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+    assert concurrency.throttles == 3
+
+
+def test_call_decreases_on_throttling_errors():
+    concurrency = AdaptiveConcurrency(4)
+
+    def throttled():
+        raise slow_down()
+
+    with pytest.raises(ClientError):
+        concurrency.call(throttled)
+    assert concurrency.limit == 2
+    assert concurrency.stats()["in_flight"] == 0
+
+
+def test_limit_bounds_requests_in_flight():
+    concurrency = AdaptiveConcurrency(2, max_limit=2)
+    release = threading.Event()
+    peak = []
+
+    def request():
+        peak.append(concurrency.stats()["in_flight"])
+        release.wait(1)
+
+    threads = [threading.Thread(target=concurrency.call, args=(request,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+
+
+def test_watch_sees_retried_errors(mocker):
+    concurrency = AdaptiveConcurrency(4)
+    client = mocker.Mock()
+    concurrency.watch(client)
+    handler = client.meta.events.register_first.call_args.args[1]
+    handler(response=(mocker.Mock(status_code=503), {"Error": {"Code": "SlowDown"}}))
+    assert concurrency.limit == 2
+    handler(response=(mocker.Mock(status_code=200), {}))
+    assert concurrency.throttles == 1
@@ -2,17 +2,45 @@
 This creates mock of our crunchy bridge backups in a S3 bucket.
 This bucket can then be used by ``delete_backups`` for testing
 to confirm that the correct backups are deleted.
+
+With ``--realistic`` it instead builds a pgBackRest layout that
+``migrate_backups`` and ``crunchy_copy`` can be load tested against:
+
+    crunchybridge/{cluster}/
+    ├─ archive/{stanza}/
+    │  ├─ archive.info
+    │  ├─ archive.info.copy
+    │  └─ 15-1/0000000100000000/000000010000000000000001-{sha}.lz4
+    └─ backup/{stanza}/
+       ├─ backup.history/2023/20230101-010000F.manifest.gz
+       ├─ backup.info
+       ├─ backup.info.copy
+       └─ 20230101-010000F/
+          ├─ backup.manifest
+          ├─ backup.manifest.copy
+          └─ pg_data/base/16384/{relfilenode}.lz4
+
+Each day's WAL is archived, and the backup.manifest's archive start and
+stop are the last segments of the day. The objects are uploaded in
+parallel, so point S3_ENDPOINT_URL at a local S3 stand-in to generate
+millions of keys quickly.
 """
 import argparse
+import hashlib
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from typing import Iterator
 
 import sentry_sdk
 from dateutil import rrule
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 
+from src.profiling import phase, profile_argument, profiling
 from src.s3 import get_s3
+from src.transfer import run_concurrently
 
 # ENV Variables
 load_dotenv()
@@ -21,6 +49,26 @@ ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
 ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
 SENTRY_DSN = os.getenv("SENTRY_DSN")
 
+MANIFEST_TEMPLATE = """[backrest]
+backrest-format=5
+backrest-version="2.45"
+
+[backup]
+backup-archive-start="{start}"
+backup-archive-stop="{stop}"
+backup-label="{label}"
+backup-type="full"
+
+[target:file]
+{files}
+"""
+INFO_BODY = b"""[backrest]
+backrest-format=5
+backrest-version="2.45"
+"""
+# The number of 16 MB WAL segments in each 16 digit WAL directory.
+SEGMENTS_PER_LOG = 256
+
 
 def get_test_dates():
     today = date.today()
@@ -67,6 +115,96 @@ def create_s3_test_data(bucket_name, cluster):
     )
 
 
+def wal_segment_name(number: int, timeline: int = 1) -> str:
+    """The 24 hex digit name of the nth WAL segment, such as 00000001000008210000001D."""
+    log, segment = divmod(number, SEGMENTS_PER_LOG)
+    return f"{timeline:08X}{log:08X}{segment:08X}"
+
+
+def file_sizes(count: int, median_size: int, max_size: int, rng: random.Random) -> list[int]:
+    """
+    Pick the sizes of a backup's files.
+
+    Relation file sizes are heavily skewed, most are small with a long tail
+    of large ones, so they're drawn from a log-normal distribution.
+    """
+    return [
+        min(max_size, max(1, int(rng.lognormvariate(0, 1.5) * median_size))) for _ in range(count)
+    ]
+
+
+def realistic_objects(
+    cluster: str,
+    stanza: str,
+    files_per_backup: int,
+    wal_per_day: int,
+    median_file_size: int,
+    max_file_size: int,
+    seed: int = 0,
+) -> Iterator[tuple[str, int, bytes]]:
+    """
+    Yield the key, size and body of every object in a realistic backup tree.
+
+    Bodies are only built for the small metadata files. Larger files are
+    yielded with a None body and filled with zeros when uploaded, so the
+    generator's memory use doesn't depend on the sizes.
+    """
+    rng = random.Random(seed)
+    archive_prefix = f"crunchybridge/{cluster}/archive/{stanza}/"
+    backup_prefix = f"crunchybridge/{cluster}/backup/{stanza}/"
+    for suffix in ["", ".copy"]:
+        yield f"{archive_prefix}archive.info{suffix}", len(INFO_BODY), INFO_BODY
+        yield f"{backup_prefix}backup.info{suffix}", len(INFO_BODY), INFO_BODY
+
+    segment = 1
+    for d in get_test_dates():
+        # The day's WAL, the backup runs while the last few segments are written.
+        for _ in range(wal_per_day):
+            name = wal_segment_name(segment)
+            sha = hashlib.sha1(name.encode()).hexdigest()
+            size = rng.randint(1, 16 * 1024**2) // 4
+            yield f"{archive_prefix}15-1/{name[:16]}/{name}-{sha}.lz4", size, None
+            segment += 1
+        start = wal_segment_name(segment - min(3, wal_per_day))
+        stop = wal_segment_name(segment - 1)
+
+        label = f"{d.strftime('%Y%m%d')}-010000F"
+        sizes = file_sizes(files_per_backup, median_file_size, max_file_size, rng)
+        files = []
+        for relfilenode, size in enumerate(sizes, start=16385):
+            path = f"pg_data/base/16384/{relfilenode}"
+            files.append(f'{path}={{"size":{size}}}')
+            yield f"{backup_prefix}{label}/{path}.lz4", size, None
+        manifest = MANIFEST_TEMPLATE.format(
+            start=start, stop=stop, label=label, files="\n".join(files)
+        ).encode("utf-8")
+        yield f"{backup_prefix}{label}/backup.manifest", len(manifest), manifest
+        yield f"{backup_prefix}{label}/backup.manifest.copy", len(manifest), manifest
+        yield f"{backup_prefix}backup.history/{d.year}/{label}.manifest.gz", len(manifest), manifest
+
+
+def create_realistic_s3_test_data(bucket_name, cluster, workers=32, **options):
+    """
+    Create a realistic pgBackRest backup tree, see ``realistic_objects`` for the options.
+    """
+    s3_resource, s3 = get_s3(
+        ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY, max_connections=workers
+    )
+
+    def _put(obj):
+        key, size, body = obj
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body if body is not None else bytes(size))
+
+    count = 0
+    with ThreadPoolExecutor(workers) as pool:
+        objects = realistic_objects(cluster, "abc123", **options)
+        for _ in run_concurrently(pool, _put, objects, max_in_flight=workers * 2):
+            count += 1
+            if count % 10000 == 0:
+                print(f"Created {count} objects...")
+    print(f"Created {count} objects")
+
+
 def main():
     # Optionally set up Sentry Integration
     if SENTRY_DSN:
@@ -90,8 +228,57 @@ def main():
     parser.add_argument(
         "--cluster", required=True, help="The name of the database cluster to pretend to create"
     )
+    parser.add_argument(
+        "--realistic",
+        action="store_true",
+        help="(Optional) Create a realistic pgBackRest backup tree for load testing.",
+        default=False,
+    )
+    parser.add_argument(
+        "--files-per-backup",
+        type=int,
+        default=1000,
+        help="(Optional) The number of pg_data files in each realistic backup.",
+    )
+    parser.add_argument(
+        "--wal-per-day",
+        type=int,
+        default=16,
+        help="(Optional) The number of WAL segments archived each day.",
+    )
+    parser.add_argument(
+        "--median-file-size",
+        type=int,
+        default=8192,
+        help="(Optional) The median size in bytes of the pg_data files.",
+    )
+    parser.add_argument(
+        "--max-file-size",
+        type=int,
+        default=1024**2,
+        help="(Optional) The largest size in bytes of the pg_data files.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="(Optional) The number of objects to upload at the same time.",
+    )
+    profile_argument(parser)
     args = parser.parse_args()
-    create_s3_test_data(args.bucket_name, cluster=args.cluster)
+    with profiling("create_test_backups", enabled=args.profile), phase("create"):
+        if args.realistic:
+            create_realistic_s3_test_data(
+                args.bucket_name,
+                cluster=args.cluster,
+                workers=args.workers,
+                files_per_backup=args.files_per_backup,
+                wal_per_day=args.wal_per_day,
+                median_file_size=args.median_file_size,
+                max_file_size=args.max_file_size,
+            )
+        else:
+            create_s3_test_data(args.bucket_name, cluster=args.cluster)
 
 
 if __name__ == "__main__":
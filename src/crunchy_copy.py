@@ -2,10 +2,11 @@ import argparse
 import json
 import os
 import shutil
-import subprocess
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
 from http import HTTPStatus
-from typing import Optional
+from typing import Iterator, Optional
 from zoneinfo import ZoneInfo
 
 import requests
@@ -13,8 +14,26 @@ import sentry_sdk
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 
+from src.catalog import CATALOG_PATH, list_objects, open_catalog
+from src.download import DOWNLOAD_WORKERS, Download, Downloader
+from src.planner import (
+    estimate,
+    load_run_history,
+    record_run,
+    run_history_key,
+    source_usage,
+)
+from src.profiling import phase, profile_argument, profiling
 from src.s3 import get_s3
 from src.schedule import is_saturday, is_valid_saturday
+from src.snapshot_catalog import (
+    SnapshotCatalogWriter,
+    UploadDigests,
+    catalog_key,
+    file_digests,
+    index_key,
+    record_snapshot,
+)
 
 # ENV Variables
 load_dotenv()
@@ -40,10 +59,21 @@ SENTRY_DSN = os.getenv("SENTRY_DSN")
 # production: "DEEP_ARCHIVE"
 STORAGE_CLASS = os.getenv("S3_STORAGE_CLASS", "DEEP_ARCHIVE")
 
+# The files Downloader keeps beside an interrupted download to resume it.
+PARTIAL_DOWNLOAD_SUFFIXES = (".part", ".progress")
+# The most snapshots a backfill copies at the same time.
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "3"))
+
 STAGING_BACKENDS = ["aspirestaging", "aspiredu-stg"]
 AU_BACKENDS = ["aspiredu-au"]
 TZ = ZoneInfo("US/Eastern")
 
+# One session per thread, since a Session isn't thread-safe. Repeated API calls
+# from a thread, such as the worker service's jobs, reuse its connections.
+_api_sessions = threading.local()
+# Held while updating a cluster's snapshot index, which concurrent copies share.
+snapshot_index_lock = threading.Lock()
+
 
 class CantFindCrunchyBridgeCluster(ValueError):
     pass
@@ -57,11 +87,25 @@ class InvalidDay(ValueError):
     """The day is not a Saturday"""
 
 
+class CantFindCrunchyBridgeBackup(ValueError):
+    """The cluster has no backup for the target"""
+
+
+class BackfillFailed(RuntimeError):
+    """Some of the backfill's snapshots couldn't be copied"""
+
+
+def api_session() -> requests.Session:
+    if not hasattr(_api_sessions, "session"):
+        _api_sessions.session = requests.Session()
+    return _api_sessions.session
+
+
 def get_crunchy_clusters():
     headers = {
         "Authorization": f"Bearer {CRUNCHY_API_KEY}",
     }
-    response = requests.get(
+    response = api_session().get(
         f"https://api.crunchybridge.com/clusters?team_id={CRUNCHY_TEAM_ID}",
         headers=headers,
     )
@@ -80,15 +124,30 @@ def get_cluster_backup_info(cluster_id: str, backup_target: str) -> dict:
     This combines the backup-token information with the backup
     token into a single dictionary.
     """
+    backup_infos = get_cluster_backup_infos(cluster_id, [backup_target])
+    if backup_target not in backup_infos:
+        raise CantFindCrunchyBridgeBackup(f"Could not find a backup for {backup_target}")
+    return backup_infos[backup_target]
+
+
+def get_cluster_backup_infos(cluster_id: str, backup_targets: list[str]) -> dict:
+    """Fetch the cluster's backup information for each of the targets.
+
+    This mints a single backup token and lists the backups once, however
+    many targets there are.
+
+    :return dict: The backup information of each target, see ``get_cluster_backup_info``.
+                  Targets the cluster has no backup for are left out.
+    """
     headers = {
         "Authorization": f"Bearer {CRUNCHY_API_KEY}",
     }
-    backup_tokens = requests.post(
+    backup_tokens = api_session().post(
         f"https://api.crunchybridge.com/clusters/{cluster_id}/backup-tokens",
         headers=headers,
     )
     backup_tokens.raise_for_status()
-    backup_info = requests.get(
+    backup_info = api_session().get(
         f"https://api.crunchybridge.com/clusters/{cluster_id}/backups"
         "?order=desc&order_field=name",
         headers=headers,
@@ -96,43 +155,103 @@ def get_cluster_backup_info(cluster_id: str, backup_target: str) -> dict:
     backup_info.raise_for_status()
     response = json.loads(backup_tokens.content.decode("utf-8"))
     backup_info = json.loads(backup_info.content.decode("utf-8"))
-    # Look up the specific backup for the given target.
-    response["backup"] = [
-        backup for backup in backup_info["backups"] if backup["name"].startswith(backup_target)
-    ][0]
-    return response
-
-
-def watch_process_logs(process):
-    while True:
-        output = process.stdout.readline()
-        print(output.strip())
-        return_code = process.poll()
-        if return_code is not None:
-            if not return_code == 0:
-                print("RETURN CODE", return_code)
-            # Process has finished, read rest of the output
-            for output in process.stdout.readlines():
-                print(output.strip())
-            return
-
-
-def upload_all_files_in_dir(source_dir, bucket, prefix):
+    # Look up the specific backup for each target.
+    backup_infos = {}
+    for backup_target in backup_targets:
+        backups = [
+            backup for backup in backup_info["backups"] if backup["name"].startswith(backup_target)
+        ]
+        if backups:
+            backup_infos[backup_target] = {**response, "backup": backups[0]}
+    return backup_infos
+
+
+def upload_all_files_in_dir(
+    source_dir, s3, bucket_name, prefix, catalog=None, snapshot_catalog=None
+) -> (int, int):
+    """
+    Upload every downloaded file in the directory, skipping the partial
+    downloads that a re-run resumes from.
+
+    :return (int, int): The number of files and bytes uploaded.
+    """
+    paths = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(source_dir)
+        for file in files
+        if not file.endswith(PARTIAL_DOWNLOAD_SUFFIXES)
+    ]
+    return upload_files(
+        paths,
+        source_dir,
+        s3,
+        bucket_name,
+        prefix,
+        catalog=catalog,
+        snapshot_catalog=snapshot_catalog,
+    )
+
+
+def upload_files(
+    paths: list[str],
+    source_dir,
+    s3,
+    bucket_name,
+    prefix,
+    catalog=None,
+    snapshot_catalog=None,
+    digests: Optional[dict] = None,
+) -> (int, int):
+    """
+    :param paths: The files to upload, each under ``source_dir``.
+    :param s3: The s3 client. Unlike a resource, it can be shared between threads.
+    :param snapshot_catalog: (Optional) The SnapshotCatalogWriter to add each file to.
+    :param digests: (Optional) The UploadDigests computed as each path was
+                    downloaded. Other files are read again to catalog them.
+    :return (int, int): The number of files and bytes uploaded.
+    """
     print("Uploading files...")
     expiration = three_years_from_now()
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            full_path = os.path.join(root, file)
-
-            # Set up the file structure for S3
-            new_file_key = f"{prefix}{full_path[len(source_dir):]}"
-            print(f"Uploading... {new_file_key}")
-            bucket.upload_file(
-                os.path.join(root, file),
-                new_file_key,
-                ExtraArgs={"Expires": expiration, "StorageClass": STORAGE_CLASS},
+    uploaded_files = uploaded_bytes = 0
+    for full_path in paths:
+        size = os.path.getsize(full_path)
+
+        # Set up the file structure for S3
+        new_file_key = f"{prefix}{full_path[len(source_dir):]}"
+        print(f"Uploading... {new_file_key}")
+        s3.upload_file(
+            full_path,
+            bucket_name,
+            new_file_key,
+            ExtraArgs={"Expires": expiration, "StorageClass": STORAGE_CLASS},
+        )
+        uploaded_files += 1
+        uploaded_bytes += size
+        if snapshot_catalog:
+            if digests and digests.get(full_path):
+                etag, sha256 = digests[full_path].digests()
+            else:
+                etag, sha256 = file_digests(full_path, size)
+            snapshot_catalog.add(
+                full_path.removeprefix(source_dir).lstrip("/"),
+                size,
+                etag,
+                sha256,
+                STORAGE_CLASS,
+            )
+        if catalog:
+            # upload_file doesn't return the ETag, a reconcile will fill it in.
+            catalog.record(
+                bucket_name,
+                [
+                    {
+                        "Key": new_file_key,
+                        "Size": size,
+                        "StorageClass": STORAGE_CLASS,
+                    }
+                ],
             )
-    return
+    return uploaded_files, uploaded_bytes
 
 
 def delete_all_files_in_dir(source_dir):
@@ -159,7 +278,7 @@ def signal_dead_mans_snitch(cluster: str):
     if cluster not in STAGING_BACKENDS:
         with open("./src/backend-snitch-map.json") as json_map:
             backend_snitch_map = json.load(json_map)
-        res = requests.post(backend_snitch_map[cluster], data={"m": "Completed"})
+        res = api_session().post(backend_snitch_map[cluster], data={"m": "Completed"})
         return res
     else:
         return
@@ -167,22 +286,56 @@ def signal_dead_mans_snitch(cluster: str):
 
 class CrunchyCopy:
     def __init__(
-        self, bucket_name: str, cluster_name: str, backup_target: str, dry_run: bool = False
+        self,
+        bucket_name: str,
+        cluster_name: str,
+        backup_target: str,
+        dry_run: bool = False,
+        catalog_path: Optional[str] = None,
+        s3=None,
+        cluster: Optional[dict] = None,
+        backup_info: Optional[dict] = None,
+        source_s3=None,
+        download_path: Optional[str] = None,
     ):
         """
 
         :param bucket_name: The name of the bucket to copy to.
         :param cluster_name: The name of the CrunchyBridge cluster that the backup is from.
         :param backup_target: The date prefix for the backup we're targeting, such as `20200101`
+        :param catalog_path: (Optional) The SQLite catalog to record uploaded objects in.
+        :param s3: (Optional) The (resource, client) pair from ``get_s3`` to reuse.
+                   Only its thread-safe client is used.
+        :param cluster: (Optional) The cluster from the CrunchyBridge API, if already fetched.
+        :param backup_info: (Optional) The ``get_cluster_backup_info`` of the target,
+                            if already fetched.
+        :param source_s3: (Optional) The (resource, client) pair from ``get_source_s3``
+                          to reuse.
+        :param download_path: (Optional) The local directory to download to. Defaults
+                              to the cluster's directory in LOCAL_TEMP_DOWNLOADS_PATH.
         """
-        self.s3_resource, self.s3 = get_s3(ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY)
-        self.bucket = self.s3_resource.Bucket(bucket_name)
+        # Only the client is used, so the pair can be shared by copies in other threads.
+        _, self.s3 = s3 or get_s3(ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY)
+        self.bucket_name = bucket_name
         self.backup_target = backup_target
-        self.cluster = self.get_cluster(cluster_name)
-        self.backup_info = get_cluster_backup_info(
+        self.cluster = cluster or self.get_cluster(cluster_name)
+        self.backup_info = backup_info or get_cluster_backup_info(
             self.cluster["id"], backup_target=self.backup_target
         )
         self.dry_run = dry_run
+        self.catalog = open_catalog(catalog_path)
+        self.source_s3 = source_s3
+        self.download_path = download_path or f"{LOCAL_TEMP_DOWNLOADS_PATH}{cluster_name}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.catalog:
+            self.catalog.close()
 
     @staticmethod
     def get_cluster(cluster_name: str) -> dict:
@@ -200,7 +353,7 @@ class CrunchyCopy:
             command += " --recursive"
         return command
 
-    def _copy_paths(self, file_paths: list[str]):
+    def _copy_paths(self, file_paths: list[str], snapshot_catalog=None) -> (int, int):
         """
         This downloads the files from the CrunchyBridge S3 to a local directory,
         then uploads them to our S3 bucket.
@@ -208,52 +361,89 @@ class CrunchyCopy:
         :param file_paths: A list of relative file paths. If the path ends with
                            a `/`, it will be treated as a directory and its
                            contents will be copied recursively.
+        :param snapshot_catalog: (Optional) The SnapshotCatalogWriter to add the files to.
+        :return (int, int): The number of files and bytes copied.
         """
-        crunchy_s3_path = (
-            f's3://{self.backup_info["aws"]["s3_bucket"]}/'
-            f'{self.backup_info["cluster_id"]}/{self.backup_info["stanza"]}'
-        )
-        download_path = f"{LOCAL_TEMP_DOWNLOADS_PATH}{self.cluster['name']}"
-        dest_s3_path = f"{S3_BACKUP_DEST_PREFIX}{self.cluster['name']}/{self.backup_target}"
-
-        download_env = {
-            "AWS_ACCESS_KEY_ID": self.backup_info["aws"]["s3_key"],
-            "AWS_SECRET_ACCESS_KEY": self.backup_info["aws"]["s3_key_secret"],
-            "AWS_SESSION_TOKEN": self.backup_info["aws"]["s3_token"],
-        }
+        copied_files = copied_bytes = 0
+        crunchy_s3_path = f's3://{self.backup_info["aws"]["s3_bucket"]}/{self.source_prefix}'
+        download_path = self.download_path
+        dest_s3_path = self.dest_prefix
 
         if self.dry_run:
             print("Dry run only.")
             print(f"Downloading from: {crunchy_s3_path}")
             print(f"Downloading to: {download_path}")
             print(f"Uploading to: {dest_s3_path}")
-            print("Commands: \n")
+            print("Equivalent commands: \n")
+            for filepath in file_paths:
+                print(self.s3_copy_command(crunchy_s3_path, download_path, filepath))
+            return copied_files, copied_bytes
+
+        # Each worker downloading an object may also have a part download in flight.
+        source_s3_resource, source_s3 = self.source_s3 or self.get_source_s3(
+            max_connections=DOWNLOAD_WORKERS * 2
+        )
+        with Downloader(source_s3) as downloader:
+            for i, filepath in enumerate(file_paths):
+                # An interrupted download raises rather than uploading what's on
+                # disk, and the parts already downloaded are kept for a re-run.
+                with phase("download"):
+                    digests = {
+                        download.path: download.digests
+                        for download, _ in downloader.download_all(
+                            self._downloads(
+                                source_s3,
+                                filepath,
+                                download_path,
+                                digests=snapshot_catalog is not None,
+                            )
+                        )
+                    }
+                    downloaded = sorted(digests)
+                print(f"{i + 1} / {len(file_paths)} downloads complete! Proceeding to upload...")
 
-        for i, filepath in enumerate(file_paths):
-            command = self.s3_copy_command(
-                src=crunchy_s3_path,
-                dest=download_path,
-                relative_path=filepath,
-            )
+                # Only this path's files, not anything left on disk by an earlier run.
+                with phase("upload"):
+                    uploaded_files, uploaded_bytes = upload_files(
+                        downloaded,
+                        download_path,
+                        self.s3,
+                        self.bucket_name,
+                        prefix=dest_s3_path,
+                        catalog=self.catalog,
+                        snapshot_catalog=snapshot_catalog,
+                        digests=digests,
+                    )
+                copied_files += uploaded_files
+                copied_bytes += uploaded_bytes
+                for path in downloaded:
+                    os.remove(path)
+        delete_all_files_in_dir(download_path)
+        return copied_files, copied_bytes
+
+    def _downloads(
+        self, source_s3, relative_path: str, download_path: str, digests: bool = False
+    ) -> Iterator[Download]:
+        """
+        Find the objects under a copy path and where to download them to,
+        following ``s3_copy_command``.
 
-            if self.dry_run:
-                print(command)
-            else:
-                download_process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    env=download_env,
-                    shell=True,
+        :param digests: Compute each file's UploadDigests as it's downloaded.
+        """
+        bucket = self.backup_info["aws"]["s3_bucket"]
+        key = f"{self.source_prefix}{relative_path}"
+        for obj in list_objects(source_s3, bucket, key):
+            # A file's prefix also matches files that start with its name.
+            if relative_path.endswith("/") or obj["Key"] == key:
+                yield Download(
+                    bucket,
+                    obj["Key"],
+                    obj["Size"],
+                    f"{download_path}{obj['Key'].removeprefix(self.source_prefix)}",
+                    etag=obj.get("ETag"),
+                    digests=UploadDigests(obj["Size"]) if digests else None,
                 )
 
-                watch_process_logs(download_process)
-                print(f"{i + 1} / {len(file_paths)} downloads complete! Proceeding to upload...")
-
-                upload_all_files_in_dir(download_path, self.bucket, prefix=dest_s3_path)
-                delete_all_files_in_dir(download_path)
-
     def _get_copy_paths(self):
         """
         Get the relative paths of files we need to copy from CrunchyBridge to S3.
@@ -285,27 +475,277 @@ class CrunchyCopy:
         stanza = self.backup_info["stanza"]
         backup_slug = self.backup_info["backup"]["name"]
         files_to_copy = [
+            *self._get_shared_copy_paths(),
+            # recursive folders
+            f"/backup/{stanza}/{backup_slug}/",
+        ]
+        return files_to_copy
+
+    def _get_shared_copy_paths(self):
+        """
+        Get the relative paths from ``_get_copy_paths`` that are the same for
+        every backup of the cluster.
+        """
+        stanza = self.backup_info["stanza"]
+        return [
             f"/archive/{stanza}/archive.info",
             f"/backup/{stanza}/backup.info",
             f"/backup/{stanza}/backup.copy",
             # recursive folders
             f"/backup/{stanza}/backup.history/",
-            f"/backup/{stanza}/{backup_slug}/",
         ]
-        return files_to_copy
 
-    def process(self):
-        script_start = datetime.utcnow().replace(tzinfo=TZ)
+    @property
+    def source_prefix(self) -> str:
+        """The key prefix of the cluster's repository in CrunchyBridge's bucket."""
+        return f'{self.backup_info["cluster_id"]}/{self.backup_info["stanza"]}'
+
+    @property
+    def dest_prefix(self) -> str:
+        """The key prefix of the snapshot in our bucket."""
+        return f"{S3_BACKUP_DEST_PREFIX}{self.cluster['name']}/{self.backup_target}"
+
+    def get_source_s3(self, max_connections: Optional[int] = None):
+        """The s3 resource and client for CrunchyBridge's bucket, using the backup token."""
+        return get_s3(
+            self.backup_info["aws"]["s3_key"],
+            self.backup_info["aws"]["s3_key_secret"],
+            self.backup_info["aws"]["s3_token"],
+            max_connections=max_connections,
+        )
 
-        self._copy_paths(self._get_copy_paths())
+    @property
+    def snapshot_catalog_key(self) -> str:
+        return catalog_key(self.cluster["name"], self.backup_target)
 
-        summarize(
-            script_start,
-            datetime.utcnow().replace(tzinfo=TZ),
+    @property
+    def snapshot_index_key(self) -> str:
+        return index_key(self.cluster["name"])
+
+    def _upload_snapshot_catalog(self, snapshot_catalog: SnapshotCatalogWriter):
+        """
+        Upload the snapshot's catalog and add it to the cluster's index, see
+        ``src.snapshot_catalog``.
+        """
+        # STANDARD, so it can be read without being rehydrated.
+        self.s3.upload_file(
+            snapshot_catalog.path,
+            self.bucket_name,
+            self.snapshot_catalog_key,
+            ExtraArgs={"Expires": three_years_from_now(), "ContentType": "application/gzip"},
+        )
+        with snapshot_index_lock:
+            record_snapshot(
+                self.s3,
+                self.bucket_name,
+                self.snapshot_index_key,
+                {
+                    "target": self.backup_target,
+                    "backup": self.backup_info["backup"]["name"],
+                    "catalog": self.snapshot_catalog_key,
+                    "objects": snapshot_catalog.objects,
+                    "bytes": snapshot_catalog.bytes,
+                },
+            )
+        os.remove(snapshot_catalog.path)
+
+    @property
+    def run_history_key(self) -> str:
+        return run_history_key(self.cluster["name"])
+
+    def plan(self) -> dict:
+        """
+        Predict the size and duration of the copy, see ``src.planner``.
+        """
+        crunchy_s3_resource, crunchy_s3 = self.get_source_s3()
+        usage = source_usage(
+            crunchy_s3,
+            self.backup_info["aws"]["s3_bucket"],
+            self.source_prefix,
+            self._get_copy_paths(),
         )
+        history = load_run_history(self.s3, self.bucket_name, self.run_history_key)
+        return {
+            "cluster": self.cluster["name"],
+            "target": self.backup_target,
+            "backup": self.backup_info["backup"]["name"],
+            **estimate(usage, history),
+        }
+
+    def process(self, shared_download_path: Optional[str] = None):
+        """
+        :param shared_download_path: (Optional) Where a backfill already downloaded the
+                                     files shared by every backup, see
+                                     ``_get_shared_copy_paths``. They're uploaded from
+                                     there instead of being downloaded again.
+        """
+        script_start = datetime.utcnow().replace(tzinfo=TZ)
+        copy_paths = self._get_copy_paths()
+        if shared_download_path:
+            shared_paths = self._get_shared_copy_paths()
+            copy_paths = [path for path in copy_paths if path not in shared_paths]
+
+        if self.dry_run:
+            copied_files, copied_bytes = self._copy_paths(copy_paths)
+        else:
+            os.makedirs(LOCAL_TEMP_DOWNLOADS_PATH, exist_ok=True)
+            with SnapshotCatalogWriter(
+                f"{LOCAL_TEMP_DOWNLOADS_PATH}{self.cluster['name']}-{self.backup_target}.tsv.gz"
+            ) as snapshot_catalog:
+                copied_files, copied_bytes = self._copy_paths(
+                    copy_paths, snapshot_catalog=snapshot_catalog
+                )
+                if shared_download_path:
+                    with phase("upload"):
+                        shared_files, shared_bytes = upload_all_files_in_dir(
+                            shared_download_path,
+                            self.s3,
+                            self.bucket_name,
+                            prefix=self.dest_prefix,
+                            catalog=self.catalog,
+                            snapshot_catalog=snapshot_catalog,
+                        )
+                    copied_files += shared_files
+                    copied_bytes += shared_bytes
+            with phase("catalog"):
+                self._upload_snapshot_catalog(snapshot_catalog)
+
+        script_finish = datetime.utcnow().replace(tzinfo=TZ)
+        summarize(script_start, script_finish)
         if not self.dry_run:
-            # Signal Dead Man's Snitch and terminate
+            # Signal Dead Man's Snitch first, the backup exists whatever happens next.
             signal_dead_mans_snitch(self.cluster["name"])
+            # A backfill's copies share the bandwidth, so their durations would
+            # throw off the planner's predictions for a single copy.
+            if not shared_download_path:
+                self._record_run(
+                    copied_files, copied_bytes, (script_finish - script_start).total_seconds()
+                )
+
+    def _record_run(self, copied_files: int, copied_bytes: int, seconds: float):
+        """Record the throughput for planning future runs, see ``src.planner``."""
+        try:
+            record_run(
+                self.s3,
+                self.bucket_name,
+                self.run_history_key,
+                {
+                    "target": self.backup_target,
+                    "objects": copied_files,
+                    "bytes": copied_bytes,
+                    "seconds": seconds,
+                },
+            )
+        except Exception as e:
+            # Only the planner's predictions depend on it, so don't fail the copy.
+            print(f"Could not record the run: {e!r}")
+            sentry_sdk.capture_exception(e)
+
+
+def backfill(
+    bucket_name: str,
+    cluster_name: str,
+    backup_targets: list[str],
+    dry_run: bool = False,
+    catalog_path: Optional[str] = None,
+    max_workers: int = BACKFILL_WORKERS,
+):
+    """
+    Copy several missed backups of a cluster in one run, ``max_workers`` at a time.
+
+    The cluster is looked up, the backup token minted and the S3 clients
+    created once for every target. The files shared by every backup, such
+    as ``backup.history/``, are downloaded once and uploaded to each snapshot.
+
+    :param backup_targets: The dates of the backups, such as `20200101`. The
+                           targets that can't be copied, including those
+                           without a backup, are raised in a BackfillFailed
+                           once the rest are copied.
+    """
+    cluster = CrunchyCopy.get_cluster(cluster_name)
+    backup_infos = get_cluster_backup_infos(cluster["id"], backup_targets)
+    failed = [
+        backup_target for backup_target in backup_targets if backup_target not in backup_infos
+    ]
+    for backup_target in failed:
+        print(f"Copying {backup_target} failed: there's no backup for it")
+    backup_targets = [
+        backup_target for backup_target in backup_targets if backup_target in backup_infos
+    ]
+    if not backup_targets:
+        raise BackfillFailed(f"Could not copy {', '.join(sorted(failed))}")
+
+    # One at a time for a dry run, so the printed commands aren't interleaved.
+    max_workers = 1 if dry_run else max(1, min(max_workers, len(backup_targets)))
+    # Each target's uploads use up to 10 connections, boto3's default. The copies
+    # only upload through the client, which unlike the resource is thread-safe.
+    s3 = get_s3(
+        ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY, max_connections=10 * max_workers
+    )
+    shared_download_path = None
+    source_s3 = None
+    with CrunchyCopy(
+        bucket_name,
+        cluster_name,
+        backup_target=backup_targets[0],
+        dry_run=dry_run,
+        catalog_path=catalog_path,
+        s3=s3,
+        cluster=cluster,
+        backup_info=backup_infos[backup_targets[0]],
+    ) as first:
+        if not dry_run:
+            # The token is the same for every target, so they share one client.
+            source_s3 = first.get_source_s3(max_connections=DOWNLOAD_WORKERS * 2 * max_workers)
+            shared_download_path = f"{LOCAL_TEMP_DOWNLOADS_PATH}{cluster_name}-shared"
+            _, source_client = source_s3
+            with phase("download"), Downloader(source_client) as downloader:
+                for filepath in first._get_shared_copy_paths():
+                    for _ in downloader.download_all(
+                        first._downloads(source_client, filepath, shared_download_path)
+                    ):
+                        pass
+
+    def copy(backup_target):
+        # Created in the worker's thread, since the catalog's connection can't be shared.
+        with CrunchyCopy(
+            bucket_name,
+            cluster_name,
+            backup_target=backup_target,
+            dry_run=dry_run,
+            catalog_path=catalog_path,
+            s3=s3,
+            cluster=cluster,
+            backup_info=backup_infos[backup_target],
+            source_s3=source_s3,
+            download_path=f"{LOCAL_TEMP_DOWNLOADS_PATH}{cluster_name}-{backup_target}",
+        ) as crunchy_copy:
+            crunchy_copy.process(shared_download_path=shared_download_path)
+
+    with phase("copy"), ThreadPoolExecutor(max_workers) as pool:
+        futures = {
+            pool.submit(copy, backup_target): backup_target for backup_target in backup_targets
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Copying {futures[future]} failed: {e!r}")
+                sentry_sdk.capture_exception(e)
+                failed.append(futures[future])
+    if shared_download_path:
+        delete_all_files_in_dir(shared_download_path)
+    if failed:
+        raise BackfillFailed(f"Could not copy {', '.join(sorted(failed))}")
+
+
+def parse_target(target: str) -> datetime:
+    try:
+        return datetime.strptime(target, "%Y%m%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{target} is not a valid date. It must be in the format YYYYMMDD."
+        )
 
 
 def validate_target(target: Optional[str] = None):
@@ -321,12 +761,7 @@ def validate_target(target: Optional[str] = None):
     if not target:
         target_date = datetime.now()
     else:
-        try:
-            target_date = datetime.strptime(target, "%Y%m%d")
-        except ValueError:
-            raise argparse.ArgumentTypeError(
-                f"{target} is not a valid date. It must be in the format YYYYMMDD."
-            )
+        target_date = parse_target(target)
 
     if not is_valid_saturday(target_date):
         if is_saturday(target_date):
@@ -336,6 +771,22 @@ def validate_target(target: Optional[str] = None):
     return target_date.strftime("%Y%m%d")
 
 
+def valid_saturdays_between(since: str, until: Optional[str] = None) -> list[str]:
+    """
+    Find the backup targets from ``since`` through ``until``, or today.
+
+    :return list[str]: The valid Saturdays in the range, in the format YYYYMMDD.
+    """
+    day = parse_target(since).date()
+    last = parse_target(until).date() if until else date.today()
+    targets = []
+    while day <= last:
+        if is_valid_saturday(day):
+            targets.append(day.strftime("%Y%m%d"))
+        day += timedelta(days=1)
+    return targets
+
+
 def main():
     # Optionally set up Sentry Integration
     if SENTRY_DSN:
@@ -359,35 +810,107 @@ def main():
         required=True,
         help="The name of the database cluster to pretend to create",
     )
-    parser.add_argument(
+    targets = parser.add_mutually_exclusive_group()
+    targets.add_argument(
         "-t",
         "--target",
         required=False,
         help="(Optional) The name of a specific backup to target. Defaults to today's backups.",
     )
+    targets.add_argument(
+        "--targets",
+        nargs="+",
+        help="(Optional) Backfill several backups (YYYYMMDD) in one run. Each must be a "
+        "valid Saturday.",
+    )
+    targets.add_argument(
+        "--since",
+        help="(Optional) Backfill the backups of every valid Saturday from this date "
+        "(YYYYMMDD) through --until.",
+    )
+    parser.add_argument(
+        "--until",
+        help="(Optional) The last date (YYYYMMDD) to backfill with --since. Defaults to today.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="(Optional) The number of backups a backfill copies at the same time. "
+        f"Defaults to {BACKFILL_WORKERS}.",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="(Optional) This won't download or upload the files, instead it will print the paths.",
     )
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to record uploaded objects in.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="(Optional) Print the predicted size and duration of the copy, and the "
+        "recommended staging size, instead of copying.",
+    )
+    profile_argument(parser)
     args = parser.parse_args()
     bucket_name = (
         "aspiredu-pgbackups" if args.cluster not in AU_BACKENDS else "aspiredu-pgbackups-au"
     )
+    if args.until and not args.since:
+        parser.error("--until can only be used with --since")
+    if args.workers is not None and not (args.targets or args.since):
+        parser.error("--workers can only be used with --targets or --since")
+    if args.targets or args.since:
+        if args.plan:
+            parser.error("--plan can only be used with a single --target")
+        try:
+            if args.targets:
+                backup_targets = sorted({validate_target(target) for target in args.targets})
+            else:
+                backup_targets = valid_saturdays_between(args.since, args.until)
+        except (argparse.ArgumentTypeError, InvalidSaturday, InvalidDay) as e:
+            parser.error(str(e))
+        if not backup_targets:
+            parser.error("There are no valid Saturdays to backfill in the range")
+        with profiling("crunchy_copy", enabled=args.profile):
+            backfill(
+                bucket_name,
+                args.cluster,
+                backup_targets,
+                dry_run=args.dry_run,
+                catalog_path=args.catalog,
+                max_workers=args.workers or BACKFILL_WORKERS,
+            )
+        exit(0)
     try:
         backup_target = validate_target(args.target)
     except InvalidSaturday:
         # Deadmans snitch has either a weekly or monthly check-in. If it's a
         # Saturday, we should signal it so that we don't get an alert.
-        if not args.dry_run:
+        if not args.dry_run and not args.plan:
             signal_dead_mans_snitch(args.cluster)
     except InvalidDay:
         pass
     else:
         # If we have a valid Saturday, process the data.
-        CrunchyCopy(
-            bucket_name, args.cluster, backup_target=backup_target, dry_run=args.dry_run
-        ).process()
+        with profiling("crunchy_copy", enabled=args.profile):
+            with phase("setup"):
+                crunchy_copy = CrunchyCopy(
+                    bucket_name,
+                    args.cluster,
+                    backup_target=backup_target,
+                    dry_run=args.dry_run or args.plan,
+                    catalog_path=args.catalog,
+                )
+            with crunchy_copy:
+                if args.plan:
+                    with phase("plan"):
+                        print(json.dumps(crunchy_copy.plan(), indent=2))
+                else:
+                    crunchy_copy.process()
     exit(0)
 
 
@@ -1,3 +1,6 @@
+import functools
+import hashlib
+import io
 import os
 import shutil
 from datetime import datetime
@@ -6,10 +9,16 @@ from zoneinfo import ZoneInfo
 import pytest
 import time_machine
 
+from src.download import Downloader
+
 from .crunchy_copy import (
+    BackfillFailed,
     CantFindCrunchyBridgeCluster,
     CrunchyCopy,
+    backfill,
+    get_cluster_backup_infos,
     upload_all_files_in_dir,
+    valid_saturdays_between,
 )
 
 utc_tz = ZoneInfo("UTC")
@@ -28,17 +37,18 @@ def patch_storage_class(mocker):
 
 @time_machine.travel(datetime(2020, 1, 1, tzinfo=utc_tz))
 def test_upload_all_files_in_dir(mocker, patch_storage_class):
-    mock_bucket = mocker.Mock()
+    s3 = mocker.Mock()
     # create temp dir
     shutil.rmtree("tmp", ignore_errors=True)
     os.makedirs("tmp/sub1")
     touch("tmp/file.txt")
     touch("tmp/sub1/file.txt")
-    upload_all_files_in_dir("tmp", mock_bucket, prefix="pre-")
+    upload_all_files_in_dir("tmp", s3, "bucket", prefix="pre-")
 
-    assert mock_bucket.upload_file.call_args_list == [
+    assert s3.upload_file.call_args_list == [
         mocker.call(
             "tmp/file.txt",
+            "bucket",
             "pre-/file.txt",
             ExtraArgs={
                 "Expires": datetime(2022, 12, 31, 19, 0, tzinfo=edt_tz),
@@ -47,6 +57,7 @@ def test_upload_all_files_in_dir(mocker, patch_storage_class):
         ),
         mocker.call(
             "tmp/sub1/file.txt",
+            "bucket",
             "pre-/sub1/file.txt",
             ExtraArgs={
                 "Expires": datetime(2022, 12, 31, 19, 0, tzinfo=edt_tz),
@@ -74,3 +85,210 @@ class TestCrunchyCopy:
         assert CrunchyCopy.s3_copy_command("s3://b/p", "tmp", "/dir/") == (
             "aws s3 cp s3://b/p/dir/ tmp/dir/ --recursive"
         )
+
+
+def backup_info(name):
+    return {
+        "cluster_id": "cb-1",
+        "stanza": "stanza",
+        "aws": {"s3_bucket": "crunchy", "s3_key": "k", "s3_key_secret": "s", "s3_token": "t"},
+        "backup": {"name": name},
+    }
+
+
+def test_valid_saturdays_between():
+    assert valid_saturdays_between("20230101", "20230131") == ["20230107", "20230121"]
+    assert valid_saturdays_between("20230108", "20230120") == []
+
+
+def test_get_cluster_backup_infos_mints_one_token(mocker):
+    session = mocker.patch("src.crunchy_copy.api_session").return_value
+    session.post.return_value.content = b'{"stanza": "stanza"}'
+    session.get.return_value.content = (
+        b'{"backups": [{"name": "20230121-010000F"}, {"name": "20230107-010000F"}]}'
+    )
+    infos = get_cluster_backup_infos("cb-1", ["20230107", "20230121"])
+    assert infos == {
+        "20230107": {"stanza": "stanza", "backup": {"name": "20230107-010000F"}},
+        "20230121": {"stanza": "stanza", "backup": {"name": "20230121-010000F"}},
+    }
+    assert session.post.call_count == 1
+    assert session.get.call_count == 1
+    # A target without a backup is left out.
+    assert set(get_cluster_backup_infos("cb-1", ["20230107", "20230204"])) == {"20230107"}
+
+
+class TestBackfill:
+    @pytest.fixture
+    def crunchy(self, mocker):
+        mocker.patch("src.crunchy_copy.get_s3", return_value=(mocker.Mock(), mocker.Mock()))
+        mocker.patch("src.crunchy_copy.open_catalog", return_value=None)
+        mocker.patch.object(CrunchyCopy, "get_cluster", return_value={"id": "cb-1", "name": "c"})
+        mocker.patch(
+            "src.crunchy_copy.get_cluster_backup_infos",
+            return_value={
+                "20230107": backup_info("20230107-010000F"),
+                "20230121": backup_info("20230121-010000F"),
+            },
+        )
+        downloader = mocker.patch("src.crunchy_copy.Downloader").return_value.__enter__
+        downloader.return_value.download_all.return_value = []
+        mocker.patch.object(CrunchyCopy, "_downloads", side_effect=lambda s3, path, dest: path)
+        return downloader.return_value
+
+    def test_shared_files_are_downloaded_once(self, mocker, crunchy):
+        process = mocker.patch.object(CrunchyCopy, "process", autospec=True)
+        delete = mocker.patch("src.crunchy_copy.delete_all_files_in_dir")
+        backfill("bucket", "c", ["20230107", "20230121"])
+
+        assert [call.args[0] for call in crunchy.download_all.call_args_list] == [
+            "/archive/stanza/archive.info",
+            "/backup/stanza/backup.info",
+            "/backup/stanza/backup.copy",
+            "/backup/stanza/backup.history/",
+        ]
+        copies = {call.args[0].backup_target: call.args[0] for call in process.call_args_list}
+        assert set(copies) == {"20230107", "20230121"}
+        assert copies["20230107"].download_path != copies["20230121"].download_path
+        # Both share the source client made with the one backup token.
+        assert copies["20230107"].source_s3 is copies["20230121"].source_s3
+        # And upload through one client, with no resource shared between threads.
+        assert copies["20230107"].s3 is copies["20230121"].s3
+        assert not hasattr(copies["20230107"], "s3_resource")
+        for call in process.call_args_list:
+            assert call.kwargs == {"shared_download_path": "tmp/c-shared"}
+        delete.assert_called_once_with("tmp/c-shared")
+
+    def test_targets_without_a_backup_fail_after_the_rest(self, mocker, crunchy):
+        process = mocker.patch.object(CrunchyCopy, "process", autospec=True)
+        mocker.patch("src.crunchy_copy.delete_all_files_in_dir")
+        with pytest.raises(BackfillFailed, match="20230204"):
+            backfill("bucket", "c", ["20230107", "20230121", "20230204"])
+        assert sorted(call.args[0].backup_target for call in process.call_args_list) == [
+            "20230107",
+            "20230121",
+        ]
+
+    def test_failures_are_raised_after_every_target(self, mocker, crunchy):
+        def process(copy, shared_download_path):
+            if copy.backup_target == "20230107":
+                raise RuntimeError("boom")
+
+        mocker.patch.object(CrunchyCopy, "process", autospec=True, side_effect=process)
+        mocker.patch("src.crunchy_copy.delete_all_files_in_dir")
+        with pytest.raises(BackfillFailed, match="20230107"):
+            backfill("bucket", "c", ["20230107", "20230121"])
+        assert CrunchyCopy.process.call_count == 2
+
+    def test_process_skips_the_shared_paths(self, mocker, crunchy):
+        copy = CrunchyCopy(
+            "bucket",
+            "c",
+            backup_target="20230107",
+            dry_run=True,
+            cluster={"id": "cb-1", "name": "c"},
+            backup_info=backup_info("20230107-010000F"),
+        )
+        copy_paths = mocker.patch.object(CrunchyCopy, "_copy_paths", return_value=(0, 0))
+        copy.process(shared_download_path="tmp/c-shared")
+        copy_paths.assert_called_once_with(["/backup/stanza/20230107-010000F/"])
+
+
+def test_copy_resumes_a_failed_download(mocker, tmp_path):
+    mocker.patch("src.crunchy_copy.open_catalog", return_value=None)
+    # Parts of S3's 5 MB minimum.
+    mocker.patch(
+        "src.crunchy_copy.Downloader",
+        functools.partial(Downloader, max_workers=2, ranged_threshold=10, part_size=1),
+    )
+    data = bytes(range(256)) * 30_000
+    objects = {
+        "cb-1/stanza/archive/stanza/archive.info": b"info",
+        "cb-1/stanza/backup/stanza/20230107-010000F/large": data,
+    }
+    mocker.patch(
+        "src.crunchy_copy.list_objects",
+        side_effect=lambda s3, bucket, prefix: [
+            {"Key": key, "Size": len(body)}
+            for key, body in objects.items()
+            if key.startswith(prefix)
+        ],
+    )
+    fail = [True]
+    ranges = []
+
+    def get_object(Bucket, Key, Range=None):
+        ranges.append((Key, Range))
+        if Range == "bytes=5242880-7679999" and fail[0]:
+            raise ValueError("Interrupted")
+        first, last = map(int, Range.removeprefix("bytes=").split("-")) if Range else (0, None)
+        return {"Body": io.BytesIO(objects[Key][slice(first, last + 1 if last else None)])}
+
+    source_s3 = mocker.Mock()
+    source_s3.get_object.side_effect = get_object
+    s3 = mocker.Mock()
+    crunchy_copy = CrunchyCopy(
+        "bucket",
+        "c",
+        backup_target="20230107",
+        s3=(None, s3),
+        cluster={"id": "cb-1", "name": "c"},
+        backup_info=backup_info("20230107-010000F"),
+        source_s3=(None, source_s3),
+        download_path=str(tmp_path / "c"),
+    )
+    copy_paths = ["/archive/stanza/archive.info", "/backup/stanza/20230107-010000F/"]
+    with pytest.raises(ValueError):
+        crunchy_copy._copy_paths(copy_paths)
+    assert [call.args[2] for call in s3.upload_file.call_args_list] == [
+        "crunchybridge/v2/c/20230107/archive/stanza/archive.info"
+    ]
+    large = tmp_path / "c" / "backup" / "stanza" / "20230107-010000F" / "large"
+    assert os.path.exists(f"{large}.part")
+    assert os.path.exists(f"{large}.progress")
+
+    fail[0] = False
+    ranges.clear()
+    s3.upload_file.reset_mock()
+    snapshot_catalog = mocker.Mock()
+    file_digests = mocker.patch("src.crunchy_copy.file_digests")
+    assert crunchy_copy._copy_paths(copy_paths, snapshot_catalog=snapshot_catalog) == (
+        2,
+        len(data) + 4,
+    )
+    # The files were digested as they were downloaded rather than read again.
+    file_digests.assert_not_called()
+    assert snapshot_catalog.add.call_args_list[0].args[:3] == (
+        "archive/stanza/archive.info",
+        4,
+        f'"{hashlib.md5(b"info").hexdigest()}"',
+    )
+    # Only the part that failed is fetched again, and no partial files are uploaded.
+    assert [key_range for key_range in ranges if key_range[0].endswith("large")] == [
+        ("cb-1/stanza/backup/stanza/20230107-010000F/large", "bytes=5242880-7679999")
+    ]
+    assert [call.args[2] for call in s3.upload_file.call_args_list] == [
+        "crunchybridge/v2/c/20230107/archive/stanza/archive.info",
+        "crunchybridge/v2/c/20230107/backup/stanza/20230107-010000F/large",
+    ]
+    assert not os.path.exists(tmp_path / "c")
+
+
+def test_process_signals_the_snitch_when_the_run_cant_be_recorded(mocker, tmp_path):
+    mocker.patch("src.crunchy_copy.LOCAL_TEMP_DOWNLOADS_PATH", f"{tmp_path}/")
+    mocker.patch("src.crunchy_copy.open_catalog", return_value=None)
+    mocker.patch.object(CrunchyCopy, "_copy_paths", return_value=(1, 10))
+    mocker.patch.object(CrunchyCopy, "_upload_snapshot_catalog")
+    mocker.patch("src.crunchy_copy.record_run", side_effect=ValueError("Bad JSON"))
+    snitch = mocker.patch("src.crunchy_copy.signal_dead_mans_snitch")
+    crunchy_copy = CrunchyCopy(
+        "bucket",
+        "c",
+        backup_target="20230107",
+        s3=(mocker.Mock(), mocker.Mock()),
+        cluster={"id": "cb-1", "name": "c"},
+        backup_info=backup_info("20230107-010000F"),
+    )
+    assert crunchy_copy.run_history_key == "run-history/c.json"
+    crunchy_copy.process()
+    snitch.assert_called_once_with("c")
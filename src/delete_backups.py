@@ -2,20 +2,29 @@
 Delete backups in S3 bucket according to our Data Retention Policy:
 https://github.com/aspiredu/aspiredu/issues/7421
 """
+
 import argparse
 import os
+import random
 import re
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from functools import lru_cache
-from itertools import chain
+from itertools import chain, islice
 
 import sentry_sdk
 from dateutil import rrule
 from dateutil.relativedelta import SA, relativedelta
 from dotenv import load_dotenv
 
+from src.batch_operations import BatchManifest, check_settings, expire_operation
+from src.catalog import CATALOG_PATH, list_objects, open_catalog
+from src.concurrency import THROTTLING_CODES, AdaptiveConcurrency
+from src.profiling import phase, profile_argument, profiling
 from src.s3 import get_s3
+from src.transfer import run_concurrently
 
 # ENV Variables
 load_dotenv()
@@ -23,6 +32,10 @@ load_dotenv()
 ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
 ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
 SENTRY_DSN = os.getenv("SENTRY_DSN")
+DELETE_WORKERS = int(os.getenv("S3_DELETE_WORKERS", "4"))
+
+# The number of times to try deleting keys S3 was too busy to delete.
+DELETE_ATTEMPTS = 5
 
 CRUNCHYBRIDGE_BACKUP_PATTERN = re.compile(r"(\d{8})-\w*")
 
@@ -31,6 +44,10 @@ class TooManyDirectoriesForDeletion(Exception):
     pass
 
 
+class DeleteFailed(Exception):
+    """S3 couldn't delete some of the objects"""
+
+
 @lru_cache(maxsize=None)
 def saturdays_for_the_past_three_years(value: date) -> set[date]:
     """Find all Saturdays between from value to 3 years ago"""
@@ -49,16 +66,87 @@ def meets_retention_policy(value: date):
     return value in saturdays_for_the_past_three_years(date.today())
 
 
-def delete_files(s3, bucket, prefix: str):
-    paginator = s3.get_paginator("list_objects")
-    page_iterator = paginator.paginate(
-        Bucket=bucket.name, PaginationConfig={"PageSize": 1000}, Prefix=prefix
-    )
-    for page in page_iterator:
-        s3.delete_objects(
-            Bucket=bucket.name,
-            Delete={"Objects": [{"Key": obj["Key"]} for obj in page["Contents"]]},
+def delete_batch(
+    s3, bucket_name: str, batch: list[dict], concurrency: AdaptiveConcurrency
+) -> list[dict]:
+    """
+    Delete up to 1000 keys, retrying any that S3 reports it was too busy to delete.
+
+    The retries back off exponentially with jitter, outside the concurrency
+    slot, so the throttled batches don't retry in lockstep.
+
+    :return list[dict]: The ``Errors`` of the keys that couldn't be deleted.
+    """
+    failed = []
+    for attempt in range(DELETE_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, 2**attempt))
+        response = concurrency.call(
+            s3.delete_objects, Bucket=bucket_name, Delete={"Objects": batch}
         )
+        throttled = []
+        for error in response.get("Errors", []):
+            if error["Code"] in THROTTLING_CODES:
+                throttled.append(error)
+            else:
+                failed.append(error)
+        if not throttled:
+            return failed
+        batch = [{"Key": error["Key"]} for error in throttled]
+        concurrency.on_throttle()
+    return failed + throttled
+
+
+def delete_files(s3, bucket, prefix: str, catalog=None, concurrency=None):
+    """
+    Delete the objects under the prefix, a batch at a time with the batches
+    deleted concurrently.
+
+    The prefix is always listed from S3, since objects missing from a stale
+    catalog would otherwise be left behind. The catalog's rows for the prefix
+    are only removed once everything under it is deleted.
+
+    :param catalog: (Optional) The Catalog to remove the deleted objects from.
+    :param concurrency: (Optional) The AdaptiveConcurrency to share between prefixes.
+    """
+    concurrency = concurrency or AdaptiveConcurrency(DELETE_WORKERS)
+    objects = list_objects(s3, bucket.name, prefix)
+
+    def _batches():
+        # delete_objects accepts at most 1000 keys per request.
+        while batch := [{"Key": obj["Key"]} for obj in islice(objects, 1000)]:
+            yield batch
+
+    def _delete(batch):
+        return delete_batch(s3, bucket.name, batch, concurrency)
+
+    failed = []
+    with ThreadPoolExecutor(concurrency.max_limit, thread_name_prefix="delete") as pool:
+        for _, errors in run_concurrently(pool, _delete, _batches(), concurrency.max_limit):
+            failed.extend(errors)
+    if failed:
+        # The catalog keeps the prefix's objects, since some of them still exist.
+        raise DeleteFailed(
+            f"Failed to delete {len(failed)} keys under {prefix}, such as "
+            f"{failed[0]['Key']} ({failed[0]['Code']}: {failed[0].get('Message', '')})"
+        )
+    if catalog:
+        catalog.remove_prefix(bucket.name, prefix)
+
+
+def write_expire_manifest(directory, s3, bucket, to_delete):
+    """
+    Write the objects in the directories as an S3 Batch Operations job
+    that tags them for expiry rather than deleting them. Like ``delete_files``,
+    the directories are listed from S3 so that none of their objects are missed.
+    """
+    with BatchManifest(directory, f"delete-{bucket.name}", bucket.name) as manifest:
+        for directory_prefix in chain.from_iterable(to_delete.values()):
+            for obj in list_objects(s3, bucket.name, directory_prefix):
+                manifest.add(bucket.name, obj["Key"])
+    manifest.write_job_spec(
+        expire_operation(), description="Expire backups outside the retention policy"
+    )
 
 
 def backup_directories(s3, bucket, cluster=None):
@@ -121,15 +209,37 @@ def backup_directories(s3, bucket, cluster=None):
 
 
 def enforce_retention_policy(
-    bucket_name: str, cluster: str = None, clean_up_bucket: bool = False, dry_run: bool = False
+    bucket_name: str,
+    cluster: str = None,
+    clean_up_bucket: bool = False,
+    dry_run: bool = False,
+    catalog_path: str = None,
+    batch_manifest_dir: str = None,
+    s3=None,
+    concurrency: AdaptiveConcurrency = None,
 ):
+    if batch_manifest_dir and not dry_run:
+        check_settings()
+    concurrency = concurrency or AdaptiveConcurrency(DELETE_WORKERS)
     # Establish connection to AspirEDU's S3 Resource
-    s3_resource, s3 = get_s3(ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY)
+    s3_resource, s3 = s3 or get_s3(
+        ASPIRE_AWS_ACCESS_KEY_ID,
+        ASPIRE_AWS_SECRET_ACCESS_KEY,
+        max_connections=concurrency.max_limit,
+    )
+    concurrency.watch(s3)
+    catalog = open_catalog(catalog_path)
 
     # Connect to AspirEDU backup Bucket
     bucket = s3_resource.Bucket(bucket_name)
+    # Both are lazy, so they're read here for the phase to include the listing.
+    with phase("list"):
+        if catalog:
+            directories = list(catalog.backup_directories(bucket.name, cluster=cluster))
+        else:
+            directories = list(backup_directories(s3, bucket, cluster=cluster))
     to_delete = defaultdict(list)
-    for backup_cluster, backup_directory_prefix in backup_directories(s3, bucket, cluster=cluster):
+    for backup_cluster, backup_directory_prefix in directories:
         directory = backup_directory_prefix.split("/")[-2]
         if match := CRUNCHYBRIDGE_BACKUP_PATTERN.match(directory):
             backup_date = datetime.strptime(match.groups()[0], "%Y%m%d").date()
@@ -145,11 +255,21 @@ def enforce_retention_policy(
         # everything.
         raise TooManyDirectoriesForDeletion()
 
+    if batch_manifest_dir and not dry_run:
+        with phase("manifest"):
+            write_expire_manifest(batch_manifest_dir, s3, bucket, to_delete)
+        return
+
     for directory_prefix in chain.from_iterable(to_delete.values()):
         if dry_run:
             print(directory_prefix)
         else:
-            delete_files(s3, bucket, prefix=directory_prefix)
+            with phase("delete"):
+                delete_files(
+                    s3, bucket, prefix=directory_prefix, catalog=catalog, concurrency=concurrency
+                )
+    if not dry_run:
+        concurrency.report("delete")
 
 
 def main():
@@ -193,10 +313,28 @@ def main():
         help="(Optional) Don't delete any data, but print out key paths.",
         default=False,
     )
-    args = parser.parse_args()
-    enforce_retention_policy(
-        args.bucket_name, cluster=args.cluster, clean_up_bucket=args.clean_up, dry_run=args.dry_run
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to find the backups to delete in "
+        "instead of listing S3. Each backup's objects are still listed from S3.",
     )
+    parser.add_argument(
+        "--batch-manifest-dir",
+        help="(Optional) Write an S3 Batch Operations manifest and job spec that tags "
+        "the files for expiry to this directory instead of deleting them.",
+    )
+    profile_argument(parser)
+    args = parser.parse_args()
+    with profiling("delete_backups", enabled=args.profile):
+        enforce_retention_policy(
+            args.bucket_name,
+            cluster=args.cluster,
+            clean_up_bucket=args.clean_up,
+            dry_run=args.dry_run,
+            catalog_path=args.catalog,
+            batch_manifest_dir=args.batch_manifest_dir,
+        )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
 from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
+import pytest
 import time_machine
 
+from src.catalog import Catalog
+from src.concurrency import AdaptiveConcurrency
 from src.create_test_backups import get_test_dates
 from src.delete_backups import (
+    DELETE_ATTEMPTS,
+    DeleteFailed,
+    delete_batch,
+    delete_files,
     meets_retention_policy,
     saturdays_for_the_past_three_years,
 )
@@ -40,3 +47,57 @@ def test_meets_retention_policy():
     assert retain_dates[1] == date(2019, 12, 7)
     assert retain_dates[-2] == date(2017, 1, 21)
     assert retain_dates[-1] == date(2017, 1, 7)
+
+
+def test_delete_files_keeps_the_catalog_rows_of_keys_it_could_not_delete(mocker):
+    mocker.patch("src.delete_backups.time.sleep")
+    mocker.patch("src.delete_backups.list_objects", return_value=iter([{"Key": "a"}, {"Key": "b"}]))
+    s3 = mocker.Mock()
+    s3.delete_objects.side_effect = [
+        {"Errors": [{"Key": "a", "Code": "SlowDown"}, {"Key": "b", "Code": "AccessDenied"}]},
+        {},
+    ]
+    bucket = mocker.Mock()
+    bucket.name = "bucket"
+    catalog = mocker.Mock()
+    concurrency = AdaptiveConcurrency(1, cooldown=0)
+    with pytest.raises(DeleteFailed, match="1 keys under prefix/, such as b .AccessDenied"):
+        delete_files(s3, bucket, "prefix/", catalog=catalog, concurrency=concurrency)
+    # The throttled key was retried on its own.
+    assert s3.delete_objects.call_args.kwargs["Delete"] == {"Objects": [{"Key": "a"}]}
+    catalog.remove_prefix.assert_not_called()
+
+
+def test_delete_files_lists_the_prefix_from_s3_even_with_a_catalog(tmp_path, mocker):
+    s3 = mocker.Mock()
+    s3.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": "prefix/a"}, {"Key": "prefix/b"}]}
+    ]
+    s3.delete_objects.return_value = {}
+    bucket = mocker.Mock()
+    bucket.name = "bucket"
+    catalog = Catalog(str(tmp_path / "catalog.sqlite3"))
+    try:
+        # The catalog is stale, it never recorded prefix/b.
+        catalog.record("bucket", [{"Key": "prefix/a", "Size": 1}])
+        delete_files(s3, bucket, "prefix/", catalog=catalog)
+        assert list(catalog.objects("bucket", "prefix/")) == []
+    finally:
+        catalog.close()
+    assert s3.delete_objects.call_args.kwargs["Delete"] == {
+        "Objects": [{"Key": "prefix/a"}, {"Key": "prefix/b"}]
+    }
+
+
+def test_delete_batch_gives_up_on_keys_that_stay_throttled(mocker):
+    sleep = mocker.patch("src.delete_backups.time.sleep")
+    s3 = mocker.Mock()
+    s3.delete_objects.return_value = {"Errors": [{"Key": "a", "Code": "SlowDown"}]}
+    errors = delete_batch(s3, "bucket", [{"Key": "a"}], AdaptiveConcurrency(1, cooldown=0))
+    assert errors == [{"Key": "a", "Code": "SlowDown"}]
+    assert s3.delete_objects.call_count == DELETE_ATTEMPTS
+    # Each retry waits up to twice as long as the last.
+    assert sleep.call_count == DELETE_ATTEMPTS - 1
+    assert all(
+        0 <= call.args[0] <= 2**attempt for attempt, call in enumerate(sleep.call_args_list, 1)
+    )
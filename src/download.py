@@ -0,0 +1,291 @@
+"""
+Concurrent downloads from S3 to local files.
+
+Objects above ``RANGED_GET_THRESHOLD`` are fetched as ranged GETs in
+parallel, with each part written straight to its offset in the file.
+
+The parts of a ranged download that have been written are recorded in a
+``.progress`` file beside the partial download, with the object's ETag. When a
+part fails, the download is retried up to ``DOWNLOAD_ATTEMPTS`` times fetching
+only the missing parts, and a later run resumes from the parts already on disk
+rather than starting again, unless the object has changed since. Each part is
+fetched with ``IfMatch`` so the parts can't mix two versions of the object.
+An object fetched with a single GET is simply fetched again.
+
+A download can also be given digests to feed its bytes to in file order, such
+as ``snapshot_catalog.UploadDigests``, so the file isn't read again to hash it.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from botocore.exceptions import BotoCoreError
+
+from src.concurrency import is_throttling_error
+from src.transfer import part_ranges, run_concurrently
+
+# ENV Variables
+DOWNLOAD_WORKERS = int(os.getenv("S3_DOWNLOAD_WORKERS", "16"))
+RANGED_GET_THRESHOLD = int(os.getenv("S3_RANGED_GET_THRESHOLD", str(64 * 1024**2)))
+RANGED_GET_PART_SIZE = int(os.getenv("S3_RANGED_GET_PART_SIZE", str(32 * 1024**2)))
+DOWNLOAD_ATTEMPTS = int(os.getenv("S3_DOWNLOAD_ATTEMPTS", "5"))
+
+# Bodies are streamed to disk in chunks of this size.
+CHUNK_SIZE = 1024**2
+
+
+class IncompleteDownload(ValueError):
+    """The downloaded file isn't the size of the object"""
+
+
+class Download(NamedTuple):
+    bucket: str
+    key: str
+    size: int
+    path: str
+    # (Optional) The ETag from the listing, so a resumed download is of the same object.
+    etag: Optional[str] = None
+    # (Optional) Fed the file's bytes in order with ``update(data)``, counting them in
+    # ``bytes``, and ``reset()`` when they have to be fed again.
+    digests: Optional[object] = None
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, (BotoCoreError, IncompleteDownload)) or is_throttling_error(error)
+
+
+class PartProgress:
+    """
+    The parts of a download that have been written, recorded by their first byte.
+
+    Each completed part is appended to the file as it finishes, so the record
+    survives the process being interrupted. The file starts with the object's
+    ETag, and the parts recorded for any other ETag are discarded.
+    """
+
+    def __init__(self, path: Optional[str], etag: Optional[str] = None):
+        """
+        :param path: The file to record the parts in, or None to only track them in memory.
+        :param etag: The ETag of the object being downloaded.
+        """
+        self.path = path
+        self.completed = set()
+        self._file = None
+        self._lock = threading.Lock()
+        if not path:
+            return
+        header = f"etag={etag or ''}"
+        if os.path.exists(path):
+            with open(path) as progress:
+                lines = progress.read().splitlines()
+            if lines and lines[0] == header:
+                self.completed = {int(line) for line in lines[1:] if line.strip()}
+        if self.completed:
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+            self._file.write(f"{header}\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+    def record(self, first: int):
+        with self._lock:
+            self.completed.add(first)
+            if self._file:
+                self._file.write(f"{first}\n")
+                self._file.flush()
+
+
+class _Digester:
+    """
+    Feed a download's bytes to its digests in file order. The parts finish out
+    of order, so each is read back from the file once every part before it has
+    finished, while it's still in the page cache.
+    """
+
+    def __init__(self, download: Download, fd: int, ranges: list):
+        self.digests = download.digests
+        self.fd = fd
+        self._ranges = [part_range or (0, download.size - 1) for part_range in ranges]
+        self._next = 0
+        self._lock = threading.Lock()
+        self.digests.reset()
+
+    def advance(self, completed: set):
+        with self._lock:
+            while self._next < len(self._ranges) and self._ranges[self._next][0] in completed:
+                first, last = self._ranges[self._next]
+                offset = first
+                while offset <= last:
+                    chunk = os.pread(self.fd, min(CHUNK_SIZE, last + 1 - offset), offset)
+                    if not chunk:
+                        break
+                    self.digests.update(chunk)
+                    offset += len(chunk)
+                self._next += 1
+
+
+class Downloader:
+    def __init__(
+        self,
+        s3,
+        max_workers: int = DOWNLOAD_WORKERS,
+        ranged_threshold: int = RANGED_GET_THRESHOLD,
+        part_size: int = RANGED_GET_PART_SIZE,
+        attempts: int = DOWNLOAD_ATTEMPTS,
+    ):
+        """
+        :param s3: The s3 client.
+        :param max_workers: The number of objects, and separately the number of
+                            parts of large objects, downloaded at the same time.
+        :param ranged_threshold: Objects larger than this are downloaded in parts.
+        :param part_size: The size of each part of a ranged download.
+        :param attempts: The number of times to try fetching the parts of an object.
+        """
+        self.s3 = s3
+        self.max_workers = max_workers
+        self.ranged_threshold = ranged_threshold
+        self.part_size = part_size
+        self.attempts = attempts
+        self._object_pool = ThreadPoolExecutor(max_workers, thread_name_prefix="download")
+        # Parts get their own pool so an object waiting on its parts can't
+        # starve them of workers.
+        self._part_pool = ThreadPoolExecutor(max_workers, thread_name_prefix="download-part")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self):
+        self._object_pool.shutdown()
+        self._part_pool.shutdown()
+
+    def download(self, download: Download) -> int:
+        """
+        Download a single object. It's written to a ``.part`` file that's
+        renamed once complete, so a partial file is never mistaken for a
+        finished one.
+
+        :return int: The number of bytes downloaded.
+        """
+        os.makedirs(os.path.dirname(download.path) or ".", exist_ok=True)
+        partial_path = f"{download.path}.part"
+        progress_path = f"{download.path}.progress"
+        ranged = download.size > self.ranged_threshold
+        # A single GET without a Range header.
+        ranges = list(part_ranges(download.size, self.part_size)) if ranged else [None]
+        resumable = os.path.exists(partial_path) and os.path.getsize(partial_path) == download.size
+        if os.path.exists(progress_path) and not (ranged and resumable):
+            # The parts recorded aren't of this file.
+            os.remove(progress_path)
+        # A single GET is cheap to repeat, so it isn't worth two file operations
+        # per file to record, across the hundreds of thousands of small files.
+        progress = PartProgress(progress_path if ranged else None, download.etag)
+        fd = os.open(partial_path, os.O_RDWR | os.O_CREAT, 0o640)
+        try:
+            os.ftruncate(fd, download.size)
+            # A single GET streams its body to the digests as it's written.
+            digester = None
+            if download.digests is not None and ranges != [None]:
+                digester = _Digester(download, fd, ranges)
+                # Parts written by an earlier run.
+                digester.advance(progress.completed)
+            for attempt in range(1, self.attempts + 1):
+                pending = [
+                    part_range
+                    for part_range in ranges
+                    if _first_byte(part_range) not in progress.completed
+                ]
+                try:
+                    self._download_ranges(download, fd, pending, progress, digester)
+                    break
+                except Exception as e:
+                    if attempt == self.attempts or not is_retryable(e):
+                        raise
+                    print(f"Retrying {len(pending)} parts of {download.key} after {e!r}")
+                    time.sleep(2**attempt)
+            if download.digests is not None and download.digests.bytes != download.size:
+                # Finished by an earlier run, so there was nothing to stream.
+                _Digester(download, fd, ranges).advance(progress.completed)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+            progress.close()
+        missing = [r for r in ranges if _first_byte(r) not in progress.completed]
+        if missing or size != download.size:
+            raise IncompleteDownload(
+                f"{partial_path} is missing {len(missing)} parts or isn't {download.size} bytes"
+            )
+        os.replace(partial_path, download.path)
+        if ranged:
+            os.remove(progress_path)
+        return download.size
+
+    def download_all(self, downloads: Iterable[Download]) -> Iterator[tuple[Download, int]]:
+        """
+        Download the objects concurrently, yielding each download and its size as it completes.
+
+        ``downloads`` can be a lazy iterable of any length, see ``run_concurrently``.
+        """
+        return run_concurrently(self._object_pool, self.download, downloads, self.max_workers * 2)
+
+    def _download_ranges(self, download: Download, fd: int, ranges: list, progress, digester):
+        if len(ranges) == 1:
+            self._download_range(download, fd, ranges[0], progress, digester)
+            return
+        futures = [
+            self._part_pool.submit(
+                self._download_range, download, fd, part_range, progress, digester
+            )
+            for part_range in ranges
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            # Let the parts in flight finish, so they're recorded before a retry.
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+            raise
+
+    def _download_range(self, download: Download, fd: int, part_range, progress, digester):
+        kwargs = {}
+        first, last = 0, download.size - 1
+        if part_range:
+            first, last = part_range
+            kwargs["Range"] = f"bytes={first}-{last}"
+            if download.etag:
+                # Fails rather than mixing in the bytes of a newer version of the object.
+                kwargs["IfMatch"] = download.etag
+        body = self.s3.get_object(Bucket=download.bucket, Key=download.key, **kwargs)["Body"]
+        streamed = download.digests if part_range is None else None
+        if streamed is not None:
+            # Any bytes from a failed attempt are fetched again.
+            streamed.reset()
+        offset = first
+        while chunk := body.read(CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            if streamed is not None:
+                streamed.update(chunk)
+            offset += len(chunk)
+        if offset != last + 1:
+            raise IncompleteDownload(
+                f"Got {offset - first} of the {last + 1 - first} bytes from {first} of {download.key}"
+            )
+        progress.record(first)
+        if digester:
+            digester.advance(progress.completed)
+
+
+def _first_byte(part_range) -> int:
+    return part_range[0] if part_range else 0
@@ -0,0 +1,157 @@
+import io
+
+from botocore.exceptions import ReadTimeoutError
+
+from src import download as download_module
+from src.download import Download, Downloader, PartProgress
+from src.snapshot_catalog import UploadDigests, file_digests
+
+
+def fake_get_object(data):
+    def get_object(Bucket, Key, Range=None, IfMatch=None):
+        if Range:
+            first, last = map(int, Range.removeprefix("bytes=").split("-"))
+            return {"Body": io.BytesIO(data[slice(first, last + 1)])}
+        return {"Body": io.BytesIO(data)}
+
+    return get_object
+
+
+def test_download_all(mocker, tmp_path):
+    data = bytes(range(256)) * 50_000
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = lambda Bucket, Key, **kwargs: fake_get_object(
+        data if Key == "large" else data[:10]
+    )(Bucket, Key, **kwargs)
+    downloads = [
+        Download("b", "large", len(data), str(tmp_path / "a" / "large")),
+        Download("b", "small", 10, str(tmp_path / "small")),
+    ]
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        results = {download.key: size for download, size in downloader.download_all(downloads)}
+
+    assert results == {"large": len(data), "small": 10}
+    assert (tmp_path / "a" / "large").read_bytes() == data
+    assert (tmp_path / "small").read_bytes() == data[:10]
+    assert not list(tmp_path.glob("**/*.part"))
+    # 12.8 MB in parts of S3's 5 MB minimum, and a single GET for the small file.
+    assert sorted(str(call.kwargs.get("Range")) for call in s3.get_object.call_args_list) == [
+        "None",
+        "bytes=0-5242879",
+        "bytes=10485760-12799999",
+        "bytes=5242880-10485759",
+    ]
+
+
+def test_download_retries_only_missing_parts(mocker, tmp_path):
+    mocker.patch("src.download.time.sleep")
+    data = bytes(range(256)) * 50_000
+    get_object = fake_get_object(data)
+    failed = []
+
+    def flaky_get_object(Bucket, Key, Range=None):
+        if Range == "bytes=5242880-10485759" and not failed:
+            failed.append(Range)
+            raise ReadTimeoutError(endpoint_url="https://s3")
+        return get_object(Bucket, Key, Range)
+
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = flaky_get_object
+    path = tmp_path / "large"
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        assert downloader.download(Download("b", "large", len(data), str(path))) == len(data)
+
+    assert path.read_bytes() == data
+    assert sorted(call.kwargs["Range"] for call in s3.get_object.call_args_list) == [
+        "bytes=0-5242879",
+        "bytes=10485760-12799999",
+        "bytes=5242880-10485759",
+        "bytes=5242880-10485759",
+    ]
+    assert not list(tmp_path.glob("large.*"))
+
+
+def interrupted_download(tmp_path, data, etag):
+    """Write the first part of the file, as an earlier run that was interrupted would."""
+    (tmp_path / "large.part").write_bytes(data[:5242880] + bytes(len(data) - 5242880))
+    progress = PartProgress(str(tmp_path / "large.progress"), etag)
+    progress.record(0)
+    progress.close()
+
+
+def test_download_resumes_from_recorded_parts(mocker, tmp_path):
+    data = bytes(range(256)) * 50_000
+    path = tmp_path / "large"
+    interrupted_download(tmp_path, data, '"v1"')
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = fake_get_object(data)
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        downloader.download(Download("b", "large", len(data), str(path), etag='"v1"'))
+
+    assert path.read_bytes() == data
+    assert sorted(call.kwargs["Range"] for call in s3.get_object.call_args_list) == [
+        "bytes=10485760-12799999",
+        "bytes=5242880-10485759",
+    ]
+    # Each part is of the version the earlier run started on.
+    assert {call.kwargs["IfMatch"] for call in s3.get_object.call_args_list} == {'"v1"'}
+
+
+def test_download_restarts_when_the_object_has_changed(mocker, tmp_path):
+    data = bytes(range(256)) * 50_000
+    path = tmp_path / "large"
+    interrupted_download(tmp_path, bytes(len(data)), '"v1"')
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = fake_get_object(data)
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        downloader.download(Download("b", "large", len(data), str(path), etag='"v2"'))
+
+    assert path.read_bytes() == data
+    assert len(s3.get_object.call_args_list) == 3
+
+
+def test_single_get_downloads_keep_no_progress(mocker, tmp_path):
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = fake_get_object(b"small")
+    # Left by an earlier run, and not trusted.
+    (tmp_path / "small.part").write_bytes(b"stale")
+    (tmp_path / "small.progress").write_text("etag=\n0\n")
+    part_progress = mocker.spy(download_module, "PartProgress")
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        downloader.download(Download("b", "small", 5, str(tmp_path / "small")))
+
+    assert (tmp_path / "small").read_bytes() == b"small"
+    assert part_progress.call_args.args[0] is None
+    assert not list(tmp_path.glob("small.*"))
+
+
+def test_download_digests_the_file_as_it_is_written(mocker, tmp_path):
+    mocker.patch("src.download.time.sleep")
+    data = bytes(range(256)) * 50_000
+    failed = []
+
+    def flaky_get_object(Bucket, Key, Range=None):
+        body = fake_get_object(data if Key == "large" else data[:10])(Bucket, Key, Range)["Body"]
+        if Key == "small" and not failed:
+            # Half of the body is streamed before the connection drops.
+            failed.append(Key)
+            body = mocker.Mock()
+            body.read.side_effect = [data[:5], ReadTimeoutError(endpoint_url="https://s3")]
+        return {"Body": body}
+
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = flaky_get_object
+    # An earlier run wrote the first part of the large file.
+    interrupted_download(tmp_path, data, None)
+    downloads = [
+        Download(
+            "b", "large", len(data), str(tmp_path / "large"), digests=UploadDigests(len(data))
+        ),
+        Download("b", "small", 10, str(tmp_path / "small"), digests=UploadDigests(10)),
+    ]
+    with Downloader(s3, max_workers=2, ranged_threshold=10, part_size=1) as downloader:
+        for download in downloads:
+            downloader.download(download)
+
+    for download in downloads:
+        assert download.digests.digests() == file_digests(download.path, download.size)
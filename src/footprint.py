@@ -0,0 +1,169 @@
+"""
+Report the storage footprint of each cluster and snapshot in a backup bucket.
+
+One streaming pass over the listing under ``crunchybridge/`` (or over the
+catalog, see ``src.catalog``) totals the objects, bytes and bytes in each
+storage class per cluster and snapshot. Only the totals are held in memory,
+so the pass costs the same however many objects there are.
+
+Snapshots are the ``YYYYMMDD`` parsed from the key by ``catalog.parse_key``.
+Objects shared by every backup of a cluster, such as the WAL archive and
+``backup.history/`` of the original layout, are totalled under an empty
+snapshot, and each cluster also gets a ``total`` row.
+
+Passing the JSON report from a previous run, such as last week's, with
+``--compare`` adds the growth since then to each row.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Iterable, Optional, TextIO
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+from src.catalog import CATALOG_PATH, list_objects, open_catalog, parse_key
+from src.s3 import get_s3
+
+# ENV Variables
+load_dotenv()
+
+ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
+ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+TOTAL = "total"
+
+
+def aggregate(objects: Iterable[dict]) -> dict:
+    """
+    Total the objects by cluster and snapshot.
+
+    :return dict: ``{(cluster, snapshot): {"objects", "bytes", "storage_classes"}}``,
+                  where ``storage_classes`` maps each storage class to its bytes.
+    """
+    totals = defaultdict(lambda: {"objects": 0, "bytes": 0, "storage_classes": defaultdict(int)})
+    for obj in objects:
+        cluster, _, backup_date = parse_key(obj["Key"])
+        if not cluster:
+            continue
+        for group in ((cluster, backup_date or ""), (cluster, TOTAL)):
+            total = totals[group]
+            total["objects"] += 1
+            total["bytes"] += obj["Size"]
+            total["storage_classes"][obj.get("StorageClass") or "STANDARD"] += obj["Size"]
+    return totals
+
+
+def report_rows(totals: dict, previous: Optional[list[dict]] = None) -> list[dict]:
+    """
+    Turn the totals from ``aggregate`` into report rows, sorted by cluster and snapshot.
+
+    :param previous: (Optional) The rows of an earlier report to compute the growth from.
+    """
+    previous_bytes = {(row["cluster"], row["snapshot"]): row["bytes"] for row in previous or []}
+    rows = []
+    for (cluster, snapshot), total in sorted(totals.items()):
+        row = {
+            "cluster": cluster,
+            "snapshot": snapshot,
+            "objects": total["objects"],
+            "bytes": total["bytes"],
+            "average_bytes": total["bytes"] // total["objects"],
+            "storage_classes": dict(sorted(total["storage_classes"].items())),
+        }
+        if previous is not None:
+            before = previous_bytes.get((cluster, snapshot), 0)
+            row["previous_bytes"] = before
+            row["bytes_growth"] = total["bytes"] - before
+        rows.append(row)
+    return rows
+
+
+def write_json(rows: list[dict], output: TextIO):
+    json.dump(rows, output, indent=2)
+    output.write("\n")
+
+
+def write_csv(rows: list[dict], output: TextIO):
+    """Write the rows with a ``{storage class}_bytes`` column for each storage class."""
+    storage_classes = sorted({name for row in rows for name in row["storage_classes"]})
+    fields = [field for field in (rows[0] if rows else {}) if field != "storage_classes"]
+    writer = csv.writer(output)
+    writer.writerow(fields + [f"{name.lower()}_bytes" for name in storage_classes])
+    for row in rows:
+        classes = [row["storage_classes"].get(name, 0) for name in storage_classes]
+        writer.writerow([row[field] for field in fields] + classes)
+
+
+def footprint(
+    bucket_name: str,
+    prefix: str = "crunchybridge/",
+    catalog_path: Optional[str] = None,
+    previous: Optional[list[dict]] = None,
+) -> list[dict]:
+    s3_resource, s3 = get_s3(ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY)
+    catalog = open_catalog(catalog_path)
+    return report_rows(aggregate(list_objects(s3, bucket_name, prefix, catalog=catalog)), previous)
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="S3 Database Backup Footprint",
+        description="Reports the objects, bytes and storage classes of each cluster and snapshot",
+    )
+    parser.add_argument(
+        "--bucket", dest="bucket_name", required=True, help="The name of the bucket."
+    )
+    parser.add_argument(
+        "--prefix",
+        default="crunchybridge/",
+        help="(Optional) The prefix to report on. Defaults to crunchybridge/.",
+    )
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to report from instead of listing S3.",
+    )
+    parser.add_argument(
+        "--format", choices=["json", "csv"], default="json", help="(Optional) The report format."
+    )
+    parser.add_argument(
+        "--output", help="(Optional) The path to write the report to. Defaults to stdout."
+    )
+    parser.add_argument(
+        "--compare",
+        help="(Optional) The path to a previous JSON report to compute the growth since.",
+    )
+    args = parser.parse_args()
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    rows = footprint(
+        args.bucket_name, prefix=args.prefix, catalog_path=args.catalog, previous=previous
+    )
+    write = write_csv if args.format == "csv" else write_json
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write(rows, output)
+    else:
+        write(rows, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import io
+
+from src.footprint import aggregate, report_rows, write_csv
+
+OBJECTS = [
+    {"Key": "crunchybridge/v2/c1/20230107/backup/s1/backup.info", "Size": 10},
+    {
+        "Key": "crunchybridge/v2/c1/20230107/backup/s1/20230107-010000F/pg_data/1",
+        "Size": 30,
+        "StorageClass": "DEEP_ARCHIVE",
+    },
+    {
+        "Key": "crunchybridge/c2/backup/s2/20230101-010000F/pg_data/1",
+        "Size": 5,
+        "StorageClass": "ONEZONE_IA",
+    },
+    {"Key": "crunchybridge/c2/archive/s2/archive.info", "Size": 1},
+    {"Key": "heroku/backup", "Size": 100},
+]
+
+
+def test_report_rows():
+    rows = report_rows(
+        aggregate(OBJECTS),
+        previous=[{"cluster": "c1", "snapshot": "total", "bytes": 30}],
+    )
+    assert [(row["cluster"], row["snapshot"]) for row in rows] == [
+        ("c1", "20230107"),
+        ("c1", "total"),
+        ("c2", ""),
+        ("c2", "20230101"),
+        ("c2", "total"),
+    ]
+    assert rows[1] == {
+        "cluster": "c1",
+        "snapshot": "total",
+        "objects": 2,
+        "bytes": 40,
+        "average_bytes": 20,
+        "storage_classes": {"DEEP_ARCHIVE": 30, "STANDARD": 10},
+        "previous_bytes": 30,
+        "bytes_growth": 10,
+    }
+    assert rows[2]["previous_bytes"] == 0
+    assert rows[2]["bytes_growth"] == 1
+
+
+def test_write_csv():
+    output = io.StringIO()
+    write_csv(report_rows(aggregate(OBJECTS[2:])), output)
+    assert output.getvalue().splitlines() == [
+        "cluster,snapshot,objects,bytes,average_bytes,onezone_ia_bytes,standard_bytes",
+        "c2,,1,1,1,0,1",
+        "c2,20230101,1,5,5,5,0",
+        "c2,total,2,6,3,5,1",
+    ]
@@ -28,17 +28,26 @@ backup-archive-start and backup-archive-stop
 Find all files between these two values.
 
 """
+
 import argparse
 import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional
+from itertools import chain
+from typing import Iterable, Iterator, Optional
 
 import sentry_sdk
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 
+from src.batch_operations import BatchManifest, check_settings, copy_operation
+from src.catalog import CATALOG_PATH, list_objects, open_catalog
+from src.concurrency import AdaptiveConcurrency
 from src.delete_backups import CRUNCHYBRIDGE_BACKUP_PATTERN
+from src.profiling import phase, profile_argument, profiling
 from src.s3 import get_s3
+from src.transfer import COPY_WORKERS, Copy, CopyExecutor
 
 # ENV Variables
 load_dotenv()
@@ -46,6 +55,8 @@ load_dotenv()
 ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
 ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
 SENTRY_DSN = os.getenv("SENTRY_DSN")
+# The most listed objects the ListingCache holds at once, roughly 1 KB each.
+LISTING_CACHE_MAX_OBJECTS = int(os.getenv("LISTING_CACHE_MAX_OBJECTS", "1000000"))
 
 
 def lsn_in_range(start_hex, end_hex):
@@ -86,7 +97,11 @@ def parse_manifest(body) -> (str, str):
     return start, stop
 
 
-def get_backups_to_migrate(s3, bucket, cluster):
+def get_backups_to_migrate(s3, bucket, cluster, catalog=None):
+    if catalog:
+        for _, backup_folder_prefix in catalog.backup_directories(bucket, cluster=cluster):
+            yield backup_folder_prefix.rsplit("/", 2)[0] + "/", backup_folder_prefix
+        return
     cluster_prefixes = [
         f'{common_prefix["Prefix"]}'
         for common_prefix in s3.list_objects(Bucket=bucket, Prefix="crunchybridge/", Delimiter="/")[
@@ -110,82 +125,276 @@ def get_backups_to_migrate(s3, bucket, cluster):
                 yield stanza_prefix, backup_folder_prefix["Prefix"]
 
 
-def archive_files_to_copy(s3, bucket, stanza_prefix, backup_folder_prefix):
-    files_to_copy = [
-        f"{stanza_prefix}archive.info",
-        f"{stanza_prefix}archive.info.copy",
-    ]
+class WalIndex:
+    """
+    The WAL segments of an archive stanza, sorted by their LSN.
+
+    This is built from a single paginated listing of ``archive/{stanza}/``, so
+    finding the segments between a backup's ``backup-archive-start`` and
+    ``backup-archive-stop`` is a bisect rather than a LIST call per 16 digit
+    WAL directory.
+    """
+
+    def __init__(self, objects: Iterable[dict]):
+        segments = []
+        for obj in objects:
+            filename = obj["Key"].split("/")[-1]
+            # Only compressed WAL segments, not archive.info or *.history files.
+            if len(filename) < 24 or not filename.endswith(".lz4"):
+                continue
+            try:
+                segments.append((int(filename[:24], 16), obj["Key"], obj))
+            except ValueError:
+                continue
+        segments.sort(key=lambda segment: segment[:2])
+        self.lsns = [lsn for lsn, _, _ in segments]
+        self.objects = [obj for _, _, obj in segments]
+
+    def __len__(self):
+        return len(self.objects)
+
+    @classmethod
+    def from_listing(cls, s3, bucket, stanza_prefix, catalog=None) -> "WalIndex":
+        return cls(list_objects(s3, bucket, stanza_prefix, catalog=catalog))
+
+    def between(self, start: str, stop: str) -> list[dict]:
+        """Find the segments from start to stop (24 hex digits) inclusive."""
+        lower = bisect_left(self.lsns, int(start, 16))
+        upper = bisect_right(self.lsns, int(stop, 16))
+        return self.objects[lower:upper]
+
+
+class ListingCache:
+    """
+    A per-run cache of the listings shared by the backups of a cluster.
+
+    Every backup folder of a stanza needs the same ``backup.history/`` listing
+    and a slice of the same WAL archive. Caching them means each is listed
+    once per run rather than once per backup folder.
+
+    The cache is bounded by the number of objects it holds. When it's full
+    the least recently used listing is evicted. A listing larger than the
+    bound is returned but not kept.
+    """
+
+    def __init__(self, s3, catalog=None, max_objects: int = LISTING_CACHE_MAX_OBJECTS):
+        self.s3 = s3
+        self.catalog = catalog
+        self.max_objects = max_objects
+        self.size = 0
+        self._listings = OrderedDict()
+
+    def objects(self, bucket: str, prefix: str) -> list[dict]:
+        return self._get(
+            ("objects", bucket, prefix),
+            lambda: list(list_objects(self.s3, bucket, prefix, catalog=self.catalog)),
+        )
+
+    def wal_index(self, bucket: str, stanza_prefix: str) -> WalIndex:
+        return self._get(
+            ("wal_index", bucket, stanza_prefix),
+            lambda: WalIndex.from_listing(self.s3, bucket, stanza_prefix, catalog=self.catalog),
+        )
+
+    def _get(self, key, load):
+        if key in self._listings:
+            self._listings.move_to_end(key)
+            return self._listings[key]
+        listing = load()
+        if len(listing) <= self.max_objects:
+            while self._listings and self.size + len(listing) > self.max_objects:
+                _, evicted = self._listings.popitem(last=False)
+                self.size -= len(evicted)
+            self._listings[key] = listing
+            self.size += len(listing)
+        return listing
+
+
+def archive_files_to_copy(
+    s3, bucket, stanza_prefix, backup_folder_prefix, catalog=None, cache=None
+) -> Iterator[dict]:
+    """
+    Find the archive files needed to restore the backup.
+
+    This is a generator, so the manifest isn't read until the files are needed.
+
+    :param cache: (Optional) The ListingCache for the run. Pass this when
+                  processing several backups of the same stanza so the
+                  archive is only listed once.
+    """
+    yield {"Key": f"{stanza_prefix}archive.info"}
+    yield {"Key": f"{stanza_prefix}archive.info.copy"}
     response = s3.get_object(Bucket=bucket, Key=backup_folder_prefix + "backup.manifest")
     start, stop = parse_manifest(response["Body"])
-    start_lsn = int(start, 16)
-    stop_lsn = int(stop, 16)
+    if cache:
+        wal_index = cache.wal_index(bucket, stanza_prefix)
+    else:
+        wal_index = WalIndex.from_listing(s3, bucket, stanza_prefix, catalog=catalog)
+    yield from wal_index.between(start, stop)
 
-    archive_prefixes = s3.list_objects(Bucket=bucket, Prefix=f"{stanza_prefix}", Delimiter="/")[
-        "CommonPrefixes"
-    ]
-    for obj in archive_prefixes:
-        archive_prefix = obj["Prefix"]
-        # Iterate over 16 digit hex number.
-        for shortened_lsn in lsn_in_range(start[:16], stop[:16]):
-            paginator = s3.get_paginator("list_objects")
-            page_iterator = paginator.paginate(
-                Bucket=bucket,
-                PaginationConfig={"PageSize": 1000},
-                Prefix=f"{archive_prefix}{shortened_lsn}/",
-            )
-            for page in page_iterator:
-                for obj in page["Contents"]:
-                    filename = obj["Key"].split("/")[-1]
-                    file_lsn = int(filename[:24], 16)
-                    # Check is LSN is in the start/stop range
-                    if start_lsn <= file_lsn <= stop_lsn and filename.endswith(".lz4"):
-                        files_to_copy.append(obj["Key"])
-    return files_to_copy
-
-
-def backup_files_to_copy(s3, bucket, stanza_prefix, backup_folder_prefix):
-    def _find_all_keys(prefix):
-        keys = []
-        paginator = s3.get_paginator("list_objects")
-        page_iterator = paginator.paginate(
-            Bucket=bucket, PaginationConfig={"PageSize": 1000}, Prefix=prefix
-        )
-        for page in page_iterator:
-            for obj in page["Contents"]:
-                keys.append(obj["Key"])
-        return keys
-
-    return (
-        [
-            f"{stanza_prefix}backup.info",
-            f"{stanza_prefix}backup.info.copy",
-        ]
-        + _find_all_keys(f"{stanza_prefix}backup.history/")  # noqa: W503
-        + _find_all_keys(backup_folder_prefix)  # noqa: W503
-    )
 
+def backup_files_to_copy(
+    s3, bucket, stanza_prefix, backup_folder_prefix, catalog=None, cache=None
+) -> Iterator[dict]:
+    """
+    Find the backup files needed to restore the backup.
+
+    The backup folder's listing is streamed a page at a time rather than
+    collected, since a large ``pg_data`` holds hundreds of thousands of files.
+    """
+    yield {"Key": f"{stanza_prefix}backup.info"}
+    yield {"Key": f"{stanza_prefix}backup.info.copy"}
+    history_prefix = f"{stanza_prefix}backup.history/"
+    if cache:
+        yield from cache.objects(bucket, history_prefix)
+    else:
+        yield from list_objects(s3, bucket, history_prefix, catalog=catalog)
+    yield from list_objects(s3, bucket, backup_folder_prefix, catalog=catalog)
+
+
+class MigrationJournal:
+    """
+    An append-only record of the copies a migration has completed.
+
+    Each line holds the destination key and the ETag of the copy. Objects
+    copied in parts get a different ETag from their source, so the journal
+    is how a resumed run knows those copies already finished.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    dest, _, etag = line.rstrip("\n").rpartition("\t")
+                    if dest:
+                        self.completed[dest] = etag
+        self._file = open(path, "a")
+
+    def close(self):
+        self._file.close()
 
-def copy_files(s3, bucket, files_to_copy, backup_folder, storage_class, dry_run=False):
+    def record(self, dest: str, etag: str):
+        self.completed[dest] = etag
+        self._file.write(f"{dest}\t{etag}\n")
+        self._file.flush()
+
+
+def already_copied(obj: dict, existing: Optional[dict], journal=None) -> bool:
+    """
+    Determine if the destination already holds an identical copy of the object.
+
+    :param obj: The source object.
+    :param existing: The destination object, if there is one.
+    :param journal: (Optional) The MigrationJournal of previous runs.
+    """
+    if not existing or obj.get("Size") is None or obj["Size"] != existing["Size"]:
+        return False
+    if obj.get("ETag") == existing["ETag"]:
+        return True
+    return bool(journal) and journal.completed.get(existing["Key"]) == existing["ETag"]
+
+
+def copy_arguments(backup_folder: str, storage_class: str) -> dict:
     backup_date = datetime.strptime(backup_folder, "%Y%m%d").date()
     expiration = backup_date + relativedelta(years=3)
-    for src in files_to_copy:
-        cb, cluster, *segments = src.split("/")
-        relative = "/".join(segments)
-        src = f"{cb}/{cluster}/{relative}"
-        dest = f"{cb}/v2/{cluster}/{backup_folder}/{relative}"
-        if not dry_run:
-            s3.copy_object(
-                Bucket=bucket,
-                CopySource={"Bucket": bucket, "Key": src},
-                Key=dest,
-                Expires=expiration.isoformat(),
-                StorageClass=storage_class,
-            )
-        else:
+    return {"Expires": expiration.isoformat(), "StorageClass": storage_class}
+
+
+def write_copy_manifest(
+    directory, bucket, cluster, files_to_copy, backup_folder, backup_slug, storage_class
+):
+    """
+    Write the copies for the backup folder as an S3 Batch Operations job
+    rather than copying the files.
+
+    :param backup_slug: The pgBackRest backup's folder, such as ``20230107-010000F``.
+                        A day can have more than one backup, so this names the job.
+    """
+    with BatchManifest(directory, f"migrate-{cluster}-{backup_slug}", bucket) as manifest:
+        for obj in files_to_copy:
+            manifest.add(bucket, obj["Key"])
+    manifest.write_job_spec(
+        copy_operation(
+            f"crunchybridge/{cluster}/",
+            f"crunchybridge/v2/{cluster}/{backup_folder}/",
+            copy_arguments(backup_folder, storage_class),
+        ),
+        description=f"Migrate {cluster} {backup_folder}",
+    )
+
+
+def copy_files(
+    s3,
+    bucket,
+    files_to_copy,
+    backup_folder,
+    storage_class,
+    dry_run=False,
+    catalog=None,
+    max_workers=COPY_WORKERS,
+    resume=False,
+    journal=None,
+    concurrency=None,
+):
+    """
+    Copy the objects into the v2 snapshot for the backup folder.
+
+    :param files_to_copy: Objects in the shape returned by ``list_objects``. The
+                          ``Size`` is used to copy large objects in parts and
+                          may be left out for small files.
+    :param resume: Skip objects the destination already holds an identical
+                   copy of. The destination is listed once per snapshot.
+    :param journal: (Optional) The MigrationJournal to record completed copies in.
+    :param concurrency: (Optional) The AdaptiveConcurrency to share between snapshots.
+    """
+    extra_args = copy_arguments(backup_folder, storage_class)
+
+    def _copies():
+        for obj in files_to_copy:
+            cb, cluster, *segments = obj["Key"].split("/")
+            relative = "/".join(segments)
+            src = f"{cb}/{cluster}/{relative}"
+            dest = f"{cb}/v2/{cluster}/{backup_folder}/{relative}"
+            if resume:
+                dest_prefix = f"{cb}/v2/{cluster}/{backup_folder}/"
+                if dest_prefix not in destinations:
+                    destinations[dest_prefix] = {
+                        existing["Key"]: existing
+                        for existing in list_objects(s3, bucket, dest_prefix)
+                    }
+                if already_copied(obj, destinations[dest_prefix].get(dest), journal):
+                    continue
+            yield Copy(bucket, src, dest, obj.get("Size"), extra_args)
+
+    destinations = {}
+
+    if dry_run:
+        for copy in _copies():
             # Dry run, print the copy commands
             print(
-                f"s3 copy {src} {dest} StorageClass={storage_class} Expires={expiration.isoformat()}"
+                f"s3 copy {copy.src} {copy.dest} "
+                f"StorageClass={storage_class} Expires={extra_args['Expires']}"
             )
+        return
+
+    with CopyExecutor(s3, max_workers=max_workers, concurrency=concurrency) as executor:
+        for copy, etag in executor.copy_all(_copies()):
+            if journal:
+                journal.record(copy.dest, etag)
+            if catalog and copy.size is not None:
+                catalog.record(
+                    bucket,
+                    [
+                        {
+                            "Key": copy.dest,
+                            "Size": copy.size,
+                            "ETag": etag,
+                            "StorageClass": storage_class,
+                        }
+                    ],
+                )
 
 
 def migrate_backups(
@@ -194,30 +403,89 @@ def migrate_backups(
     target: Optional[str],
     storage_class: Optional[str],
     dry_run: bool = False,
+    catalog_path: Optional[str] = None,
+    max_workers: int = COPY_WORKERS,
+    resume: bool = False,
+    journal_path: Optional[str] = None,
+    batch_manifest_dir: Optional[str] = None,
+    s3=None,
+    concurrency: Optional[AdaptiveConcurrency] = None,
 ):
-    s3_resource, s3 = get_s3(None, None)
-    for bucket in ["aspiredu-pgbackups", "aspiredu-pgbackups-au"]:
-        for stanza_prefix, bucket_folder_prefix in get_backups_to_migrate(s3, bucket, cluster):
-            backup_folder = None
-            if match := CRUNCHYBRIDGE_BACKUP_PATTERN.match(bucket_folder_prefix.split("/")[-2]):
-                backup_folder = match.groups()[0]
-                if target and target != backup_folder:
+    if batch_manifest_dir and not dry_run:
+        check_settings(copy=True)
+    # Shared by every snapshot, so what's learned about S3's throttling carries over.
+    concurrency = concurrency or AdaptiveConcurrency(max_workers)
+    # Every request holds one of the controller's slots.
+    s3_resource, s3 = s3 or get_s3(None, None, max_connections=concurrency.max_limit)
+    concurrency.watch(s3)
+    catalog = open_catalog(catalog_path)
+    journal = None
+    # Only a resumable run needs the journal, which otherwise grows by a line per copy.
+    if (resume or journal_path) and not dry_run and not batch_manifest_dir:
+        journal = MigrationJournal(journal_path or f"migrate-{cluster}.journal")
+    try:
+        cache = ListingCache(s3, catalog=catalog)
+        for bucket in ["aspiredu-pgbackups", "aspiredu-pgbackups-au"]:
+            for stanza_prefix, bucket_folder_prefix in get_backups_to_migrate(
+                s3, bucket, cluster, catalog=catalog
+            ):
+                backup_folder = None
+                if match := CRUNCHYBRIDGE_BACKUP_PATTERN.match(bucket_folder_prefix.split("/")[-2]):
+                    backup_folder = match.groups()[0]
+                    if target and target != backup_folder:
+                        continue
+                if not backup_folder:
                     continue
-            if not backup_folder:
-                continue
-            files_to_copy = backup_files_to_copy(
-                s3, bucket, stanza_prefix, bucket_folder_prefix
-            ) + archive_files_to_copy(
-                s3, bucket, stanza_prefix.replace("/backup/", "/archive/"), bucket_folder_prefix
-            )
-            copy_files(
-                s3,
-                bucket,
-                files_to_copy,
-                backup_folder,
-                storage_class=storage_class,
-                dry_run=dry_run,
-            )
+                # Lazy, so copying starts with the first page of the listings.
+                files_to_copy = chain(
+                    backup_files_to_copy(
+                        s3,
+                        bucket,
+                        stanza_prefix,
+                        bucket_folder_prefix,
+                        catalog=catalog,
+                        cache=cache,
+                    ),
+                    archive_files_to_copy(
+                        s3,
+                        bucket,
+                        stanza_prefix.replace("/backup/", "/archive/"),
+                        bucket_folder_prefix,
+                        catalog=catalog,
+                        cache=cache,
+                    ),
+                )
+                if batch_manifest_dir and not dry_run:
+                    with phase("manifest"):
+                        write_copy_manifest(
+                            batch_manifest_dir,
+                            bucket,
+                            stanza_prefix.split("/")[1],
+                            files_to_copy,
+                            backup_folder,
+                            bucket_folder_prefix.split("/")[-2],
+                            storage_class,
+                        )
+                    continue
+                # The listings are read lazily, so this includes listing the snapshot's files.
+                with phase("copy"):
+                    copy_files(
+                        s3,
+                        bucket,
+                        files_to_copy,
+                        backup_folder,
+                        storage_class=storage_class,
+                        dry_run=dry_run,
+                        catalog=catalog,
+                        max_workers=max_workers,
+                        resume=resume,
+                        journal=journal,
+                        concurrency=concurrency,
+                    )
+    finally:
+        if journal:
+            journal.close()
+    concurrency.report("migrate")
 
 
 def main():
@@ -259,13 +527,48 @@ def main():
         required=False,
         help="(Optional) The backup to target (YYYYMMDD)",
     )
-    args = parser.parse_args()
-    migrate_backups(
-        cluster=args.cluster,
-        target=args.target,
-        storage_class=args.storage_class,
-        dry_run=args.dry_run,
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to plan from instead of listing S3.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=COPY_WORKERS,
+        help="(Optional) The number of copies to start with in flight. It adapts to S3's "
+        "throttling, up to 4 times this.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="(Optional) Skip objects that were already copied by a previous run.",
+        default=False,
+    )
+    parser.add_argument(
+        "--journal",
+        help="(Optional) The file completed copies are recorded in. Defaults to "
+        "migrate-{cluster}.journal with --resume, otherwise nothing is recorded.",
+    )
+    parser.add_argument(
+        "--batch-manifest-dir",
+        help="(Optional) Write S3 Batch Operations manifests and job specs to this "
+        "directory instead of copying the files.",
+    )
+    profile_argument(parser)
+    args = parser.parse_args()
+    with profiling("migrate_backups", enabled=args.profile):
+        migrate_backups(
+            cluster=args.cluster,
+            target=args.target,
+            storage_class=args.storage_class,
+            dry_run=args.dry_run,
+            catalog_path=args.catalog,
+            max_workers=args.workers,
+            resume=args.resume,
+            journal_path=args.journal,
+            batch_manifest_dir=args.batch_manifest_dir,
+        )
 
 
 if __name__ == "__main__":
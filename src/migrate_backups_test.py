@@ -0,0 +1,227 @@
+import io
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import time_machine
+
+from src.create_test_backups import realistic_objects
+from src.migrate_backups import (
+    ListingCache,
+    MigrationJournal,
+    WalIndex,
+    already_copied,
+    archive_files_to_copy,
+    backup_files_to_copy,
+    copy_files,
+    migrate_backups,
+    parse_manifest,
+)
+
+ARCHIVE = "crunchybridge/c1/archive/s1/"
+MANIFEST = b"""[backup]
+backup-archive-start="00000001000008210000001D"
+backup-archive-stop="000000010000082200000001"
+"""
+
+
+def wal(segment):
+    return f"{ARCHIVE}15-1/{segment[:16]}/{segment}-abcdef.lz4"
+
+
+class TestWalIndex:
+    def test_between(self):
+        index = WalIndex(
+            {"Key": key}
+            for key in [
+                f"{ARCHIVE}archive.info",
+                f"{ARCHIVE}15-1/00000002.history",
+                f"{ARCHIVE}15-1/0000000100000821/00000001000008210000001C.00000028.backup",
+                wal("000000010000082200000002"),
+                wal("00000001000008210000001C"),
+                wal("000000010000082200000001"),
+                wal("00000001000008210000001D"),
+                wal("0000000100000821000000FF"),
+            ]
+        )
+        assert len(index) == 5
+        assert index.between("00000001000008210000001D", "000000010000082200000001") == [
+            {"Key": wal("00000001000008210000001D")},
+            {"Key": wal("0000000100000821000000FF")},
+            {"Key": wal("000000010000082200000001")},
+        ]
+        assert index.between("000000010000083000000000", "000000010000083000000001") == []
+
+
+def test_archive_files_to_copy(mocker):
+    s3 = mocker.Mock()
+    s3.get_object.return_value = {"Body": io.BytesIO(MANIFEST)}
+    s3.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": wal("00000001000008210000001D")}]},
+        {"Contents": [{"Key": wal("000000010000082200000002")}]},
+    ]
+    assert list(archive_files_to_copy(s3, "b", ARCHIVE, "crunchybridge/c1/backup/s1/x/")) == [
+        {"Key": f"{ARCHIVE}archive.info"},
+        {"Key": f"{ARCHIVE}archive.info.copy"},
+        {"Key": wal("00000001000008210000001D")},
+    ]
+    # The whole stanza is listed with a single paginated call.
+    s3.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="b", PaginationConfig={"PageSize": 1000}, Prefix=ARCHIVE
+    )
+
+
+def test_backup_files_to_copy_is_lazy(mocker):
+    stanza = "crunchybridge/c1/backup/s1/"
+    s3 = mocker.Mock()
+    pages = {
+        f"{stanza}backup.history/": [{"Contents": [{"Key": f"{stanza}backup.history/1"}]}],
+        f"{stanza}x/": [
+            {"Contents": [{"Key": f"{stanza}x/1"}]},
+            {"Contents": [{"Key": f"{stanza}x/2"}]},
+        ],
+    }
+    s3.get_paginator.return_value.paginate.side_effect = lambda Prefix, **kwargs: iter(
+        pages[Prefix]
+    )
+    files = backup_files_to_copy(s3, "b", stanza, f"{stanza}x/")
+    assert [next(files)["Key"] for _ in range(3)] == [
+        f"{stanza}backup.info",
+        f"{stanza}backup.info.copy",
+        f"{stanza}backup.history/1",
+    ]
+    # The backup folder isn't listed until its files are needed.
+    assert s3.get_paginator.return_value.paginate.call_count == 1
+    assert [obj["Key"] for obj in files] == [f"{stanza}x/1", f"{stanza}x/2"]
+
+
+class TestListingCache:
+    def test_listings_are_reused(self, mocker):
+        s3 = mocker.Mock()
+        s3.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": wal("00000001000008210000001D")}]},
+        ]
+        cache = ListingCache(s3)
+        index = cache.wal_index("b", ARCHIVE)
+        assert cache.wal_index("b", ARCHIVE) is index
+        assert cache.objects("b", "history/") == [{"Key": wal("00000001000008210000001D")}]
+        assert s3.get_paginator.return_value.paginate.call_count == 2
+        assert cache.size == 2
+
+    def test_least_recently_used_is_evicted(self, mocker):
+        s3 = mocker.Mock()
+        s3.get_paginator.return_value.paginate.side_effect = lambda **kwargs: [
+            {"Contents": [{"Key": f'{kwargs["Prefix"]}{i}'} for i in range(2)]}
+        ]
+        cache = ListingCache(s3, max_objects=4)
+        first = cache.objects("b", "first/")
+        cache.objects("b", "second/")
+        # Using "first/" again makes "second/" the least recently used.
+        assert cache.objects("b", "first/") is first
+        cache.objects("b", "third/")
+        assert cache.size == 4
+        assert cache.objects("b", "first/") is first
+        cache.objects("b", "second/")
+        assert s3.get_paginator.return_value.paginate.call_count == 4
+
+
+def test_already_copied(tmp_path):
+    src = {"Key": "crunchybridge/c1/a", "Size": 10, "ETag": '"abc"'}
+    dest = {"Key": "crunchybridge/v2/c1/20230101/a", "Size": 10, "ETag": '"abc"'}
+    assert already_copied(src, dest)
+    assert not already_copied(src, None)
+    assert not already_copied({"Key": "crunchybridge/c1/a"}, dest)
+    assert not already_copied(src, {**dest, "Size": 5})
+
+    multipart = {**dest, "ETag": '"def-2"'}
+    assert not already_copied(src, multipart)
+    journal = MigrationJournal(str(tmp_path / "migrate.journal"))
+    journal.record(dest["Key"], '"def-2"')
+    journal.close()
+    assert already_copied(src, multipart, MigrationJournal(str(tmp_path / "migrate.journal")))
+
+
+def test_copy_files_resume(mocker, tmp_path):
+    s3 = mocker.Mock()
+    s3.get_paginator.return_value.paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": "crunchybridge/v2/c1/20230101/backup/s1/done", "Size": 1, "ETag": "1"}
+            ]
+        }
+    ]
+    s3.copy_object.return_value = {"CopyObjectResult": {"ETag": "2"}}
+    journal = MigrationJournal(str(tmp_path / "migrate.journal"))
+    copy_files(
+        s3,
+        "b",
+        [
+            {"Key": "crunchybridge/c1/backup/s1/done", "Size": 1, "ETag": "1"},
+            {"Key": "crunchybridge/c1/backup/s1/todo", "Size": 1, "ETag": "2"},
+        ],
+        "20230101",
+        "ONEZONE_IA",
+        resume=True,
+        journal=journal,
+    )
+    journal.close()
+    s3.copy_object.assert_called_once()
+    assert s3.copy_object.call_args.kwargs["Key"] == "crunchybridge/v2/c1/20230101/backup/s1/todo"
+    s3.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="b", PaginationConfig={"PageSize": 1000}, Prefix="crunchybridge/v2/c1/20230101/"
+    )
+    assert (tmp_path / "migrate.journal").read_text() == (
+        "crunchybridge/v2/c1/20230101/backup/s1/todo\t2\n"
+    )
+
+
+@time_machine.travel(datetime(2020, 1, 1, tzinfo=ZoneInfo("UTC")))
+def test_only_resumable_migrations_keep_a_journal(mocker, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mocker.patch("src.migrate_backups.get_backups_to_migrate", return_value=[])
+    s3 = (mocker.Mock(), mocker.Mock())
+    migrate_backups(cluster="c1", target=None, storage_class="ONEZONE_IA", s3=s3)
+    assert not (tmp_path / "migrate-c1.journal").exists()
+    migrate_backups(cluster="c1", target=None, storage_class="ONEZONE_IA", s3=s3, resume=True)
+    assert (tmp_path / "migrate-c1.journal").exists()
+
+
+def test_dry_runs_print_the_copies_instead_of_writing_a_manifest(mocker, tmp_path, capsys):
+    mocker.patch("src.batch_operations.BATCH_COPY_LAMBDA_ARN", "")
+    mocker.patch(
+        "src.migrate_backups.get_backups_to_migrate",
+        side_effect=lambda s3, bucket, cluster, catalog: (
+            [("crunchybridge/c1/backup/s1/", "crunchybridge/c1/backup/s1/20230107-010000F/")]
+            if bucket == "aspiredu-pgbackups"
+            else []
+        ),
+    )
+    mocker.patch(
+        "src.migrate_backups.backup_files_to_copy",
+        return_value=[{"Key": "crunchybridge/c1/backup/s1/20230107-010000F/a"}],
+    )
+    mocker.patch("src.migrate_backups.archive_files_to_copy", return_value=[])
+    migrate_backups(
+        cluster="c1",
+        target=None,
+        storage_class="ONEZONE_IA",
+        dry_run=True,
+        batch_manifest_dir=str(tmp_path / "manifests"),
+        s3=(mocker.Mock(), mocker.Mock()),
+    )
+    assert not (tmp_path / "manifests").exists()
+    assert "s3 copy crunchybridge/c1/backup/s1/20230107-010000F/a" in capsys.readouterr().out
+
+
+def test_realistic_test_data_is_migratable():
+    objects = list(
+        realistic_objects(
+            "c1", "s1", files_per_backup=2, wal_per_day=4, median_file_size=10, max_file_size=20
+        )
+    )
+    index = WalIndex({"Key": key, "Size": size} for key, size, _ in objects)
+    manifests = [body for key, _, body in objects if key.endswith("/backup.manifest")]
+    assert len(index) == 4 * len(manifests)
+    start, stop = parse_manifest(io.BytesIO(manifests[-1]))
+    # The backup needs the last three of the day's segments.
+    assert index.between(start, stop) == index.objects[-3:]
+    assert all(size <= 20 for key, size, _ in objects if "/pg_data/" in key)
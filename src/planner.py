@@ -0,0 +1,108 @@
+"""
+Predict the size and duration of a CrunchyCopy run before it starts.
+
+The plan combines:
+
+- The sizes of the objects to copy, listed from CrunchyBridge's bucket with
+  the backup token credentials.
+- The throughput of the cluster's previous runs, which CrunchyCopy records
+  in our bucket after each copy under ``run-history/``, outside of the
+  snapshots in ``crunchybridge/``.
+
+From those it recommends how large the staging volume needs to be. Files
+are staged one copy path at a time, so the volume only needs to hold the
+largest path.
+"""
+import json
+import math
+import os
+from statistics import median
+from typing import Iterable
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from src.catalog import list_objects
+
+# ENV Variables
+load_dotenv()
+
+RUN_HISTORY_PREFIX = os.getenv("RUN_HISTORY_PREFIX", "run-history/")
+
+GB = 1024**3
+# Assumed when a cluster has no run history.
+DEFAULT_THROUGHPUT = 50 * 1024**2
+# Keep this much of the staging volume free.
+STAGING_HEADROOM = 1.25
+# The number of previous runs to keep in the history.
+MAX_RUN_HISTORY = 20
+
+
+def source_usage(s3, bucket: str, prefix: str, relative_paths: Iterable[str]) -> dict:
+    """
+    Total the objects and bytes under each of the copy paths.
+
+    :param prefix: The key prefix the relative paths are appended to.
+    :param relative_paths: The paths from ``CrunchyCopy._get_copy_paths``. A
+                           path ending with ``/`` is a directory.
+    """
+    usage = {"objects": 0, "bytes": 0, "largest_path_bytes": 0}
+    for relative_path in relative_paths:
+        key = f"{prefix}{relative_path}"
+        path_bytes = 0
+        for obj in list_objects(s3, bucket, key):
+            # A file's prefix also matches files that start with its name.
+            if relative_path.endswith("/") or obj["Key"] == key:
+                usage["objects"] += 1
+                path_bytes += obj["Size"]
+        usage["bytes"] += path_bytes
+        usage["largest_path_bytes"] = max(usage["largest_path_bytes"], path_bytes)
+    return usage
+
+
+def run_history_key(cluster: str) -> str:
+    return f"{RUN_HISTORY_PREFIX}{cluster}.json"
+
+
+def load_run_history(s3, bucket: str, key: str) -> list[dict]:
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return []
+        raise
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def record_run(s3, bucket: str, key: str, run: dict):
+    """
+    Add a run to the history.
+
+    :param run: The ``target``, ``objects``, ``bytes`` and ``seconds`` of the run.
+    """
+    history = load_run_history(s3, bucket, key) + [run]
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(history[-MAX_RUN_HISTORY:]).encode("utf-8"),
+    )
+
+
+def estimate(usage: dict, history: list[dict]) -> dict:
+    """
+    Predict the duration of the copy and recommend the staging size.
+
+    :param usage: The totals from ``source_usage``.
+    :param history: The runs from ``load_run_history``.
+    """
+    throughputs = [run["bytes"] / run["seconds"] for run in history if run["seconds"] > 0]
+    throughput = median(throughputs) if throughputs else DEFAULT_THROUGHPUT
+    return {
+        **usage,
+        "throughput_bytes_per_second": int(throughput),
+        "throughput_from_history": bool(throughputs),
+        "predicted_seconds": math.ceil(usage["bytes"] / throughput),
+        "recommended_staging_gb": max(
+            1, math.ceil(usage["largest_path_bytes"] * STAGING_HEADROOM / GB)
+        ),
+    }
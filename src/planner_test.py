@@ -0,0 +1,56 @@
+import io
+import json
+
+from botocore.exceptions import ClientError
+
+from src.planner import GB, estimate, load_run_history, record_run, source_usage
+
+
+def test_source_usage(mocker):
+    s3 = mocker.Mock()
+    listings = {
+        "cb/s1/archive/s1/archive.info": [
+            {"Key": "cb/s1/archive/s1/archive.info", "Size": 1},
+            {"Key": "cb/s1/archive/s1/archive.info.copy", "Size": 1},
+        ],
+        "cb/s1/backup/s1/20230101-010000F/": [
+            {"Key": "cb/s1/backup/s1/20230101-010000F/a", "Size": 10},
+            {"Key": "cb/s1/backup/s1/20230101-010000F/b", "Size": 20},
+        ],
+    }
+    s3.get_paginator.return_value.paginate.side_effect = lambda **kwargs: [
+        {"Contents": listings[kwargs["Prefix"]]}
+    ]
+    assert source_usage(
+        s3, "crunchy", "cb/s1", ["/archive/s1/archive.info", "/backup/s1/20230101-010000F/"]
+    ) == {"objects": 3, "bytes": 31, "largest_path_bytes": 30}
+
+
+def test_estimate():
+    usage = {"objects": 1000, "bytes": 100 * GB, "largest_path_bytes": 90 * GB}
+    plan = estimate(usage, [])
+    assert not plan["throughput_from_history"]
+    assert plan["recommended_staging_gb"] == 113
+
+    history = [
+        {"bytes": 100 * GB, "seconds": 1000},
+        {"bytes": 100 * GB, "seconds": 2000},
+        {"bytes": 100 * GB, "seconds": 0},
+    ]
+    plan = estimate(usage, history)
+    assert plan["throughput_from_history"]
+    assert plan["predicted_seconds"] == 1334
+
+
+def test_run_history(mocker):
+    s3 = mocker.Mock()
+    s3.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+    assert load_run_history(s3, "b", "history.json") == []
+
+    record_run(s3, "b", "history.json", {"bytes": 1, "seconds": 1})
+    body = s3.put_object.call_args.kwargs["Body"]
+    assert json.loads(body) == [{"bytes": 1, "seconds": 1}]
+
+    s3.get_object.side_effect = None
+    s3.get_object.return_value = {"Body": io.BytesIO(body)}
+    assert load_run_history(s3, "b", "history.json") == [{"bytes": 1, "seconds": 1}]
@@ -0,0 +1,238 @@
+"""
+Opt-in profiling of a run, to find its hot spots after the fact.
+
+Pass ``--profile`` to any of the CLIs, or set the ``PROFILE`` env variable,
+and the run records, for each of its phases (listing, downloading, copying
+and so on):
+
+- How long it took.
+- A CPU profile sampled from the stacks of every thread every
+  ``PROFILE_INTERVAL`` seconds. The copy, download and delete work runs in
+  thread pools, which cProfile can't see from the main thread.
+- The peak memory allocated, and the lines holding the most memory at its
+  end, from ``tracemalloc``.
+
+The reports are written to ``PROFILE_DIR``, next to the logs:
+
+    {name}-{started}.json       The summary of each phase.
+    {name}-{started}.collapsed  The sampled stacks in the collapsed format
+                                read by flamegraph.pl and speedscope.
+
+When Sentry is set up, the run is a transaction with a span for each phase
+and the reports are attached to it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+# ENV Variables
+load_dotenv()
+
+PROFILE = os.getenv("PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles/")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+# The number of functions and allocating lines reported for each phase.
+TOP = 20
+# The phase of anything sampled outside of a phase.
+UNPHASED = "other"
+
+# The running Profiler, so phases can be marked without passing it around.
+_active = None
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> list[str]:
+    """The names of the frame's functions, outermost first."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class Profiler:
+    def __init__(self, name: str, directory: str = PROFILE_DIR, interval: float = PROFILE_INTERVAL):
+        """
+        :param name: The name of the run, used for the report files and Sentry transaction.
+        :param directory: The directory to write the reports to.
+        :param interval: The seconds between stack samples.
+        """
+        self.name = name
+        self.directory = directory
+        self.interval = interval
+        self.started = datetime.now(timezone.utc)
+        self.phases = defaultdict(
+            lambda: {"calls": 0, "seconds": 0.0, "peak_bytes": 0, "top_allocations": []}
+        )
+        # The stacks sampled in each phase and the number of times each was seen.
+        self.samples = defaultdict(Counter)
+        # The phases entered and not yet exited, each with its peak so far.
+        self._stack = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    @property
+    def current_phase(self) -> str:
+        return "/".join(phase["name"] for phase in self._stack) or UNPHASED
+
+    def start(self):
+        self._thread = threading.get_ident()
+        tracemalloc.start()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        tracemalloc.stop()
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            phase = self.current_phase
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self.samples[phase][";".join(_stack(frame))] += 1
+
+    def _update_peaks(self):
+        """Carry the peak since the last reset into every open phase."""
+        _, peak = tracemalloc.get_traced_memory()
+        for phase in self._stack:
+            phase["peak_bytes"] = max(phase["peak_bytes"], peak)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure a phase of the run. Phases can be nested, such as ``copy/upload``,
+        and a phase entered more than once is totalled.
+
+        Only the thread that started the profiler marks phases. Those entered
+        from other threads, such as a backfill's concurrent copies, are counted
+        in the phase around them.
+        """
+        if threading.get_ident() != self._thread:
+            yield
+            return
+        self._update_peaks()
+        tracemalloc.reset_peak()
+        self._stack.append({"name": name, "peak_bytes": 0})
+        key = self.current_phase
+        start = time.perf_counter()
+        with sentry_sdk.start_span(op="phase", name=key) as span:
+            try:
+                yield
+            finally:
+                self._update_peaks()
+                peak_bytes = self._stack.pop()["peak_bytes"]
+                span.set_data("peak_bytes", peak_bytes)
+                phase = self.phases[key]
+                phase["calls"] += 1
+                phase["seconds"] += time.perf_counter() - start
+                phase["peak_bytes"] = max(phase["peak_bytes"], peak_bytes)
+                phase["top_allocations"] = [
+                    {"line": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                    for stat in tracemalloc.take_snapshot().statistics("lineno")[:TOP]
+                ]
+
+    def summary(self) -> dict:
+        phases = {}
+        for name in sorted(set(self.phases) | set(self.samples)):
+            samples = self.samples[name]
+            own = Counter()
+            cumulative = Counter()
+            for stack, count in samples.items():
+                functions = stack.split(";")
+                own[functions[-1]] += count
+                for function in set(functions):
+                    cumulative[function] += count
+            phases[name] = {
+                **self.phases.get(name, {}),
+                "samples": sum(samples.values()),
+                "top_self": own.most_common(TOP),
+                "top_cumulative": cumulative.most_common(TOP),
+            }
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(),
+            "interval_seconds": self.interval,
+            "phases": phases,
+        }
+
+    def write(self) -> list[str]:
+        """
+        Write the reports.
+
+        :return list[str]: The paths written.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{self.name}-{self.started:%Y%m%dT%H%M%S}")
+        with open(f"{base}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(f"{base}.collapsed", "w") as f:
+            for phase, samples in sorted(self.samples.items()):
+                for stack, count in samples.most_common():
+                    f.write(f"{phase};{stack} {count}\n")
+        return [f"{base}.json", f"{base}.collapsed"]
+
+
+def phase(name: str):
+    """Measure a phase of the run when it's being profiled, see ``Profiler.phase``."""
+    return _active.phase(name) if _active else nullcontext()
+
+
+@contextmanager
+def profiling(name: str, enabled: bool = PROFILE, directory: str = PROFILE_DIR):
+    """
+    Profile the run when enabled, writing the reports and attaching them to
+    the run's Sentry transaction when it's done.
+    """
+    global _active
+    if not enabled:
+        yield None
+        return
+    profiler = Profiler(name, directory=directory)
+    with sentry_sdk.start_transaction(op="cli", name=name):
+        _active = profiler
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            _active = None
+            paths = profiler.write()
+            print(f"Profile written to {', '.join(paths)}")
+            scope = sentry_sdk.get_current_scope()
+            scope.set_context(
+                "profile",
+                {
+                    key: {"seconds": phase["seconds"], "peak_bytes": phase["peak_bytes"]}
+                    for key, phase in profiler.phases.items()
+                },
+            )
+            for path in paths:
+                scope.add_attachment(path=path, add_to_transactions=True)
+
+
+def profile_argument(parser):
+    """Add the ``--profile`` option to a CLI's parser."""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=PROFILE,
+        help=f"(Optional) Record a CPU and memory profile of each phase to {PROFILE_DIR}. "
+        "Defaults to the PROFILE env variable.",
+    )
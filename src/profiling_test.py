@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+
+from src import profiling
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_phase_is_a_no_op_when_not_profiling():
+    with profiling.phase("copy"):
+        pass
+    assert profiling._active is None
+
+
+def test_profiling_writes_a_report_per_phase(tmp_path):
+    with profiling.profiling("copy", enabled=True, directory=str(tmp_path)) as profiler:
+        with profiling.phase("download"):
+            # Work in another thread, like the download pool, is sampled too.
+            worker = threading.Thread(target=busy, args=(0.2,))
+            worker.start()
+            worker.join()
+        with profiling.phase("upload"):
+            data = [bytes(1024) for _ in range(1024)]
+            with profiling.phase("catalog"):
+                busy(0.05)
+            del data
+    assert profiling._active is None
+
+    summary = json.loads(
+        (tmp_path / f"{profiler.name}-{profiler.started:%Y%m%dT%H%M%S}.json").read_text()
+    )
+    phases = summary["phases"]
+    assert {"download", "upload", "upload/catalog"} <= set(phases)
+    assert phases["download"]["seconds"] >= 0.2
+    assert phases["download"]["samples"] > 0
+    assert any("busy" in function for function, _ in phases["download"]["top_self"])
+    # The upload's peak includes the megabyte held while its nested phase ran.
+    assert phases["upload"]["peak_bytes"] >= 1024**2
+    assert phases["upload/catalog"]["peak_bytes"] >= 1024**2
+
+    collapsed = list(tmp_path.glob("*.collapsed"))[0].read_text().splitlines()
+    assert any(line.startswith("download;") and "busy" in line for line in collapsed)
+
+
+def test_phases_entered_more_than_once_are_totalled(tmp_path):
+    profiler = profiling.Profiler("migrate", directory=str(tmp_path))
+    profiler.start()
+    try:
+        for _ in range(3):
+            with profiler.phase("copy"):
+                pass
+    finally:
+        profiler.stop()
+    assert profiler.phases["copy"]["calls"] == 3
@@ -0,0 +1,267 @@
+"""
+Rehydrate a snapshot from Glacier or Deep Archive so it can be downloaded.
+
+Snapshots are uploaded with ``STORAGE_CLASS=DEEP_ARCHIVE``, so every object
+needs a ``restore_object`` request, and then a wait of hours, before it can
+be read. This issues the restore requests concurrently at a limited rate,
+then polls the objects with a concurrent ``head_object`` sweep until they're
+all available, reporting progress as it goes.
+
+Objects are appended to ``--ready-file`` as soon as they're available, so a
+download can start on the first objects rather than waiting for the last.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import sentry_sdk
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from src.catalog import CATALOG_PATH, open_catalog
+from src.crunchy_copy import AU_BACKENDS
+from src.restore import snapshot_objects
+from src.s3 import get_s3
+from src.transfer import run_concurrently
+
+# ENV Variables
+load_dotenv()
+
+ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
+ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+ARCHIVED_STORAGE_CLASSES = {"GLACIER", "DEEP_ARCHIVE"}
+TIERS = ["Standard", "Bulk", "Expedited"]
+# Deep Archive doesn't offer expedited restores.
+DEEP_ARCHIVE_TIERS = ["Standard", "Bulk"]
+
+
+class RateLimiter:
+    """Space out calls from any number of threads to at most ``rate`` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def is_restored(head: dict) -> bool:
+    """
+    Determine if an archived object's restore has finished from its head_object response.
+
+    The Restore header looks like ``ongoing-request="false", expiry-date="..."``
+    once it's done.
+    """
+    return 'ongoing-request="false"' in head.get("Restore", "")
+
+
+class Rehydrator:
+    def __init__(self, s3, bucket: str, tier: str, days: int, rate: float, max_workers: int):
+        """
+        :param tier: The restore tier, Standard, Bulk or Expedited.
+        :param days: How many days the restored copies stay available.
+        :param rate: The most restore requests to make per second.
+        :param max_workers: The number of requests to make at the same time.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.tier = tier
+        self.days = days
+        self.max_workers = max_workers
+        self._limiter = RateLimiter(rate)
+
+    def request(self, obj: dict) -> str:
+        """
+        Request the restore of an object.
+
+        :return str: "requested", "in-progress" or "available" if it didn't need restoring.
+        """
+        if obj.get("StorageClass") not in ARCHIVED_STORAGE_CLASSES:
+            return "available"
+        tier = self.tier
+        if obj["StorageClass"] == "DEEP_ARCHIVE" and tier not in DEEP_ARCHIVE_TIERS:
+            tier = "Standard"
+        self._limiter.wait()
+        try:
+            self.s3.restore_object(
+                Bucket=self.bucket,
+                Key=obj["Key"],
+                RestoreRequest={"Days": self.days, "GlacierJobParameters": {"Tier": tier}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "RestoreAlreadyInProgress":
+                return "in-progress"
+            raise
+        return "requested"
+
+    def is_available(self, obj: dict) -> bool:
+        if obj.get("StorageClass") not in ARCHIVED_STORAGE_CLASSES:
+            return True
+        return is_restored(self.s3.head_object(Bucket=self.bucket, Key=obj["Key"]))
+
+    def request_all(self, objects: Iterable[dict]) -> dict:
+        """
+        Request the restore of every object.
+
+        :return dict: The number of objects for each outcome of ``request``.
+        """
+        counts = {"requested": 0, "in-progress": 0, "available": 0}
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            for i, (_, outcome) in enumerate(
+                run_concurrently(pool, self.request, objects, self.max_workers * 2), start=1
+            ):
+                counts[outcome] += 1
+                if i % 1000 == 0:
+                    print(f"Requested {i} restores: {counts}")
+        return counts
+
+    def poll(self, objects: list[dict], interval: float) -> Iterator[dict]:
+        """
+        Sweep the objects with head_object until they're all available,
+        yielding each as soon as it is.
+        """
+        pending = objects
+        while True:
+            still_pending = []
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                for obj, available in run_concurrently(
+                    pool, self.is_available, pending, self.max_workers * 2
+                ):
+                    if available:
+                        yield obj
+                    else:
+                        still_pending.append(obj)
+            print(f"{len(objects) - len(still_pending)} / {len(objects)} objects available")
+            if not still_pending:
+                return
+            pending = still_pending
+            time.sleep(interval)
+
+
+def rehydrate(
+    cluster: str,
+    target: str,
+    tier: str = "Bulk",
+    days: int = 7,
+    rate: float = 100,
+    max_workers: int = 32,
+    wait: bool = True,
+    poll_interval: float = 15 * 60,
+    ready_file: Optional[str] = None,
+    catalog_path: Optional[str] = None,
+):
+    bucket_name = "aspiredu-pgbackups" if cluster not in AU_BACKENDS else "aspiredu-pgbackups-au"
+    s3_resource, s3 = get_s3(
+        ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY, max_connections=max_workers * 2
+    )
+    catalog = open_catalog(catalog_path)
+    objects = list(snapshot_objects(s3, bucket_name, cluster, target, catalog=catalog))
+    rehydrator = Rehydrator(s3, bucket_name, tier, days, rate, max_workers)
+    print(f"Requesting the restore of {len(objects)} objects ({tier} tier)")
+    print(rehydrator.request_all(objects))
+    if not wait:
+        return
+
+    ready = open(ready_file, "a") if ready_file else None
+    try:
+        for obj in rehydrator.poll(objects, interval=poll_interval):
+            if ready:
+                ready.write(f"{obj['Key']}\n")
+                ready.flush()
+    finally:
+        if ready:
+            ready.close()
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="CrunchyBridge Backup Rehydrate",
+        description="Restores a snapshot's objects from Glacier or Deep Archive",
+    )
+    parser.add_argument("-c", "--cluster", required=True, help="The name of the database cluster.")
+    parser.add_argument("-t", "--target", required=True, help="The snapshot (YYYYMMDD).")
+    parser.add_argument(
+        "--tier",
+        choices=TIERS,
+        default="Bulk",
+        help="(Optional) The restore tier. Deep Archive objects use Standard for Expedited.",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=7,
+        help="(Optional) How many days the restored objects stay available.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=100,
+        help="(Optional) The most restore requests to make per second.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="(Optional) The number of requests to make at the same time.",
+    )
+    parser.add_argument(
+        "--no-wait",
+        dest="wait",
+        action="store_false",
+        help="(Optional) Only request the restores, don't wait for them to finish.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=15 * 60,
+        help="(Optional) The seconds between checks of the restores' progress.",
+    )
+    parser.add_argument(
+        "--ready-file",
+        help="(Optional) Append the keys of objects to this file as they become available.",
+    )
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to plan from instead of listing S3.",
+    )
+    args = parser.parse_args()
+    rehydrate(
+        args.cluster,
+        args.target,
+        tier=args.tier,
+        days=args.days,
+        rate=args.rate,
+        max_workers=args.workers,
+        wait=args.wait,
+        poll_interval=args.poll_interval,
+        ready_file=args.ready_file,
+        catalog_path=args.catalog,
+    )
+
+
+if __name__ == "__main__":
+    main()
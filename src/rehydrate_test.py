@@ -0,0 +1,67 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from src.rehydrate import Rehydrator, is_restored
+
+
+def test_is_restored():
+    assert not is_restored({})
+    assert not is_restored({"Restore": 'ongoing-request="true"'})
+    assert is_restored(
+        {"Restore": 'ongoing-request="false", expiry-date="Fri, 21 Dec 2012 00:00:00 GMT"'}
+    )
+
+
+def test_request_all(mocker):
+    s3 = mocker.Mock()
+
+    def restore_object(Bucket, Key, RestoreRequest):
+        if Key == "b":
+            raise ClientError({"Error": {"Code": "RestoreAlreadyInProgress"}}, "RestoreObject")
+
+    s3.restore_object.side_effect = restore_object
+    objects = [
+        {"Key": "a", "StorageClass": "DEEP_ARCHIVE"},
+        {"Key": "b", "StorageClass": "GLACIER"},
+        {"Key": "c", "StorageClass": "STANDARD"},
+    ]
+    rehydrator = Rehydrator(s3, "bucket", "Expedited", days=3, rate=0, max_workers=2)
+
+    assert rehydrator.request_all(objects) == {"requested": 1, "in-progress": 1, "available": 1}
+    tiers = {
+        call.kwargs["Key"]: call.kwargs["RestoreRequest"]["GlacierJobParameters"]["Tier"]
+        for call in s3.restore_object.call_args_list
+    }
+    # Deep Archive doesn't offer expedited restores.
+    assert tiers == {"a": "Standard", "b": "Expedited"}
+
+
+def test_request_raises_other_errors(mocker):
+    s3 = mocker.Mock()
+    s3.restore_object.side_effect = ClientError(
+        {"Error": {"Code": "AccessDenied"}}, "RestoreObject"
+    )
+    rehydrator = Rehydrator(s3, "bucket", "Bulk", days=3, rate=0, max_workers=1)
+    with pytest.raises(ClientError):
+        rehydrator.request({"Key": "a", "StorageClass": "DEEP_ARCHIVE"})
+
+
+def test_poll(mocker):
+    sleep = mocker.patch("src.rehydrate.time.sleep")
+    s3 = mocker.Mock()
+    heads = {"a": iter(['ongoing-request="false"']), "b": iter(["", 'ongoing-request="false"'])}
+    s3.head_object.side_effect = lambda Bucket, Key: {"Restore": next(heads[Key])}
+    objects = [
+        {"Key": "a", "StorageClass": "DEEP_ARCHIVE"},
+        {"Key": "b", "StorageClass": "DEEP_ARCHIVE"},
+        {"Key": "c", "StorageClass": "STANDARD"},
+    ]
+    rehydrator = Rehydrator(s3, "bucket", "Bulk", days=3, rate=0, max_workers=2)
+
+    ready = [obj["Key"] for obj in rehydrator.poll(objects, interval=60)]
+
+    assert sorted(ready[:2]) == ["a", "c"]
+    assert ready[2:] == ["b"]
+    sleep.assert_called_once_with(60)
+    # Only the pending object is checked again.
+    assert s3.head_object.call_count == 3
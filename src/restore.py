@@ -0,0 +1,196 @@
+"""
+Rebuild a pgBackRest repository from one of our v2 snapshots.
+
+A snapshot at ``crunchybridge/v2/{cluster}/{target}/`` holds the stanza's
+files in the same structure as CrunchyBridge's repository (see
+``CrunchyCopy._get_copy_paths``), so restoring is a download into:
+
+    {repo_path}/
+    ├─ archive/
+    │   └─ backup_stanza/
+    │      └─ archive.info
+    └─ backup/
+       └─ backup_stanza/
+          ├─ backup.history/
+          ├─ backup.info
+          ├─ backup.info.copy
+          └─ 20230101-010000F/
+
+which ``pgbackrest restore --repo1-path={repo_path}`` can then restore from.
+
+The download time is our recovery time, so the files are fetched
+concurrently, largest first so that the biggest files aren't left running
+alone at the end, with large files split into parallel ranged GETs.
+
+Snapshots stored in DEEP_ARCHIVE must be rehydrated before they can be
+downloaded.
+"""
+import argparse
+import os
+import shutil
+from datetime import datetime
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+from src.catalog import CATALOG_PATH, list_objects, open_catalog
+from src.crunchy_copy import AU_BACKENDS, S3_BACKUP_DEST_PREFIX, summarize
+from src.download import DOWNLOAD_WORKERS, Download, Downloader
+from src.s3 import get_s3
+from src.snapshot_catalog import catalog_key, load_snapshot_catalog
+
+# ENV Variables
+load_dotenv()
+
+ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
+ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+
+def snapshot_prefix(cluster: str, target: str) -> str:
+    return f"{S3_BACKUP_DEST_PREFIX}{cluster}/{target}/"
+
+
+def snapshot_objects(s3, bucket: str, cluster: str, target: str, catalog=None):
+    """
+    Stream the snapshot's objects from the catalog CrunchyCopy stored with it,
+    falling back to the local catalog or listing the snapshot.
+    """
+    prefix = snapshot_prefix(cluster, target)
+    objects = load_snapshot_catalog(s3, bucket, catalog_key(cluster, target), prefix)
+    if objects is None:
+        objects = list_objects(s3, bucket, prefix, catalog=catalog)
+    return objects
+
+
+def restore_downloads(objects, bucket: str, prefix: str, repo_path: str) -> list[Download]:
+    """
+    Map the snapshot's objects to their path in the repository, largest first.
+    """
+    downloads = [
+        Download(
+            bucket,
+            obj["Key"],
+            obj["Size"],
+            os.path.join(repo_path, obj["Key"].removeprefix(prefix)),
+        )
+        for obj in objects
+        if not obj["Key"].endswith("/")
+    ]
+    downloads.sort(key=lambda download: download.size, reverse=True)
+    return downloads
+
+
+def fill_in_info_copies(repo_path: str):
+    """
+    pgBackRest keeps a ``.copy`` of each info file. Recreate any that weren't
+    stored in the snapshot from the original.
+    """
+    for root, _, files in os.walk(repo_path):
+        for file in files:
+            if file in ("archive.info", "backup.info") and f"{file}.copy" not in files:
+                shutil.copyfile(os.path.join(root, file), os.path.join(root, f"{file}.copy"))
+
+
+def restore(
+    cluster: str,
+    target: str,
+    repo_path: str,
+    max_workers: int = DOWNLOAD_WORKERS,
+    catalog_path: str = None,
+    dry_run: bool = False,
+):
+    bucket_name = "aspiredu-pgbackups" if cluster not in AU_BACKENDS else "aspiredu-pgbackups-au"
+    # Each worker downloading an object may also have a part download in flight.
+    s3_resource, s3 = get_s3(
+        ASPIRE_AWS_ACCESS_KEY_ID, ASPIRE_AWS_SECRET_ACCESS_KEY, max_connections=max_workers * 2
+    )
+    catalog = open_catalog(catalog_path)
+    prefix = snapshot_prefix(cluster, target)
+    downloads = restore_downloads(
+        snapshot_objects(s3, bucket_name, cluster, target, catalog=catalog),
+        bucket_name,
+        prefix,
+        repo_path,
+    )
+    if not downloads:
+        raise ValueError(f"There is no snapshot at {bucket_name}/{prefix}")
+    total_bytes = sum(download.size for download in downloads)
+    print(f"Restoring {len(downloads)} files ({total_bytes} bytes) to {repo_path}")
+    if dry_run:
+        for download in downloads:
+            print(f"s3 get {download.key} {download.path} ({download.size} bytes)")
+        return
+
+    start = datetime.utcnow()
+    downloaded_bytes = 0
+    with Downloader(s3, max_workers=max_workers) as downloader:
+        for i, (download, size) in enumerate(downloader.download_all(downloads), start=1):
+            downloaded_bytes += size
+            print(f"{i} / {len(downloads)} files, {downloaded_bytes} / {total_bytes} bytes")
+    fill_in_info_copies(repo_path)
+    summarize(start, datetime.utcnow())
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="CrunchyBridge Backup Restore",
+        description="Rebuilds a pgBackRest repository from one of AspirEDU's snapshots",
+    )
+    parser.add_argument(
+        "-c",
+        "--cluster",
+        required=True,
+        help="The name of the database cluster to restore.",
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        required=True,
+        help="The snapshot to restore (YYYYMMDD).",
+    )
+    parser.add_argument(
+        "--repo-path",
+        required=True,
+        help="The local directory to build the pgBackRest repository in.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help="(Optional) The number of files to download at the same time.",
+    )
+    parser.add_argument(
+        "--catalog",
+        default=CATALOG_PATH,
+        help="(Optional) The path to the SQLite catalog to plan from instead of listing S3.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="(Optional) Print the files that would be downloaded.",
+    )
+    args = parser.parse_args()
+    restore(
+        args.cluster,
+        args.target,
+        args.repo_path,
+        max_workers=args.workers,
+        catalog_path=args.catalog,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
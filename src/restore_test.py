@@ -0,0 +1,30 @@
+from src.restore import fill_in_info_copies, restore_downloads
+
+
+def test_restore_downloads(tmp_path):
+    prefix = "crunchybridge/v2/c1/20230107/"
+    downloads = restore_downloads(
+        [
+            {"Key": f"{prefix}backup/s1/backup.info", "Size": 1},
+            {"Key": f"{prefix}backup/s1/20230107-010000F/pg_data/base/1", "Size": 100},
+            {"Key": f"{prefix}archive/s1/archive.info", "Size": 2},
+        ],
+        "b",
+        prefix,
+        str(tmp_path),
+    )
+    assert [(download.key.removeprefix(prefix), download.path) for download in downloads] == [
+        (
+            "backup/s1/20230107-010000F/pg_data/base/1",
+            str(tmp_path / "backup/s1/20230107-010000F/pg_data/base/1"),
+        ),
+        ("archive/s1/archive.info", str(tmp_path / "archive/s1/archive.info")),
+        ("backup/s1/backup.info", str(tmp_path / "backup/s1/backup.info")),
+    ]
+
+
+def test_fill_in_info_copies(tmp_path):
+    (tmp_path / "backup" / "s1").mkdir(parents=True)
+    (tmp_path / "backup" / "s1" / "backup.info").write_text("info")
+    fill_in_info_copies(str(tmp_path))
+    assert (tmp_path / "backup" / "s1" / "backup.info.copy").read_text() == "info"
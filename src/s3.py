@@ -1,10 +1,26 @@
+import os
+
 import boto3
+from botocore.config import Config
 
 
-def get_s3(access_key_id, secret_access_key, session_token=None):
+def get_s3(
+    access_key_id, secret_access_key, session_token=None, endpoint_url=None, max_connections=None
+):
+    """
+    :param endpoint_url: (Optional) Use a local S3 stand-in, such as MinIO, for testing.
+                         Defaults to the S3_ENDPOINT_URL env variable.
+    :param max_connections: (Optional) The size of the client's connection pool.
+                            Set this to at least the number of threads sharing the client.
+    """
+    endpoint_url = endpoint_url or os.getenv("S3_ENDPOINT_URL")
+    config = Config(max_pool_connections=max_connections) if max_connections else None
     session = boto3.session.Session(
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key,
         aws_session_token=session_token,
     )
-    return session.resource("s3"), session.client("s3")
+    return (
+        session.resource("s3", endpoint_url=endpoint_url, config=config),
+        session.client("s3", endpoint_url=endpoint_url, config=config),
+    )
@@ -0,0 +1,213 @@
+"""
+A compressed catalog of each v2 snapshot, stored beside the snapshots.
+
+Once CrunchyCopy finishes, the only record of what a snapshot holds is the
+objects themselves, so a restore has to LIST
+``crunchybridge/v2/{cluster}/{target}/`` again. Instead CrunchyCopy writes:
+
+    snapshot-catalogs/{cluster}/{target}.tsv.gz
+    snapshot-catalogs/{cluster}/index.json
+
+They're kept outside of ``crunchybridge/`` so they aren't mistaken for a
+cluster's backups by the tools that walk it.
+
+``restore`` and ``rehydrate`` read the catalogs. ``audit`` and
+``delete_backups`` still list S3: an audit checks what the bucket actually
+holds, and a delete must not leave behind objects a catalog doesn't know of.
+
+The catalog is a gzipped TSV of each object's key, relative to the snapshot,
+with its size, ETag, SHA-256 and storage class. The index lists the
+cluster's snapshots with their totals. Both are stored in STANDARD so they
+can be read without rehydrating anything.
+
+The ETag is computed locally as S3 computes it for an unencrypted or SSE-S3
+upload: the MD5 of the file, or for a multipart upload the MD5 of the parts'
+MD5s with the number of parts, using boto3's default transfer settings.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+from typing import Iterator, Optional
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from s3transfer.utils import ChunksizeAdjuster
+
+# ENV Variables
+load_dotenv()
+
+SNAPSHOT_CATALOG_PREFIX = os.getenv("SNAPSHOT_CATALOG_PREFIX", "snapshot-catalogs/")
+
+FIELDS = ["key", "size", "etag", "sha256", "storage_class"]
+# The settings upload_file uses when it isn't passed a Config.
+UPLOAD_TRANSFER_CONFIG = TransferConfig()
+# Files are hashed in chunks of this size.
+CHUNK_SIZE = 1024**2
+
+
+def catalog_key(cluster: str, target: str) -> str:
+    return f"{SNAPSHOT_CATALOG_PREFIX}{cluster}/{target}.tsv.gz"
+
+
+def index_key(cluster: str) -> str:
+    return f"{SNAPSHOT_CATALOG_PREFIX}{cluster}/index.json"
+
+
+class UploadDigests:
+    """
+    Compute the ETag S3 gives a file when it's uploaded with ``config``, and its
+    SHA-256, from the file's bytes in order. The downloads feed it as they
+    write, so the files don't have to be read again to be catalogued.
+    """
+
+    def __init__(self, size: int, config: TransferConfig = UPLOAD_TRANSFER_CONFIG):
+        self.size = size
+        self.multipart = size >= config.multipart_threshold
+        self.part_size = (
+            ChunksizeAdjuster().adjust_chunksize(config.multipart_chunksize, size)
+            if self.multipart
+            else size
+        )
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self._sha256 = hashlib.sha256()
+        self._part = hashlib.md5()
+        self._part_bytes = 0
+        self._part_digests = []
+
+    def update(self, data: bytes):
+        self.bytes += len(data)
+        self._sha256.update(data)
+        if not self.multipart:
+            self._part.update(data)
+            return
+        view = memoryview(data)
+        while view:
+            taken = min(len(view), self.part_size - self._part_bytes)
+            self._part.update(view[:taken])
+            self._part_bytes += taken
+            view = view[taken:]
+            if self._part_bytes == self.part_size:
+                self._part_digests.append(self._part.digest())
+                self._part = hashlib.md5()
+                self._part_bytes = 0
+
+    def digests(self) -> (str, str):
+        """
+        :return (str, str): The ETag, including its quotes, and the hex SHA-256.
+        """
+        if not self.multipart:
+            return f'"{self._part.hexdigest()}"', self._sha256.hexdigest()
+        part_digests = self._part_digests + ([self._part.digest()] if self._part_bytes else [])
+        etag = hashlib.md5(b"".join(part_digests)).hexdigest()
+        return f'"{etag}-{len(part_digests)}"', self._sha256.hexdigest()
+
+
+def file_digests(path: str, size: int, config: TransferConfig = UPLOAD_TRANSFER_CONFIG):
+    """
+    Compute the ETag S3 gives the file when it's uploaded with ``config``, and
+    its SHA-256, for the files that weren't digested as they were downloaded.
+
+    :return (str, str): The ETag, including its quotes, and the hex SHA-256.
+    """
+    digests = UploadDigests(size, config)
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digests.update(chunk)
+    return digests.digests()
+
+
+class SnapshotCatalogWriter:
+    """Stream a snapshot's catalog to a local gzipped TSV as its files are uploaded."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.objects = 0
+        self.bytes = 0
+        self._file = gzip.open(path, "wt", newline="")
+        self._writer = csv.writer(self._file, delimiter="\t")
+        self._writer.writerow(FIELDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def add(self, key: str, size: int, etag: str, sha256: str, storage_class: str):
+        """
+        :param key: The object's key relative to the snapshot prefix.
+        """
+        self._writer.writerow([key, size, etag, sha256, storage_class])
+        self.objects += 1
+        self.bytes += size
+
+
+def record_snapshot(s3, bucket: str, key: str, snapshot: dict):
+    """
+    Add the snapshot to the cluster's index, replacing any earlier entry for its target.
+
+    :param snapshot: The ``target``, ``catalog`` key, ``objects`` and ``bytes``
+                     of the snapshot.
+    """
+    snapshots = [
+        existing
+        for existing in load_snapshot_index(s3, bucket, key)
+        if existing["target"] != snapshot["target"]
+    ]
+    snapshots.append(snapshot)
+    snapshots.sort(key=lambda existing: existing["target"])
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(snapshots).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def load_snapshot_index(s3, bucket: str, key: str) -> list[dict]:
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return []
+        raise
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def load_snapshot_catalog(s3, bucket: str, key: str, prefix: str) -> Optional[Iterator[dict]]:
+    """
+    Stream a snapshot's objects from its catalog, in the shape returned by ``list_objects``.
+
+    :param prefix: The snapshot's prefix, prepended to each relative key.
+    :return: The objects, or None if the snapshot has no catalog.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return _read_catalog(response["Body"], prefix)
+
+
+def _read_catalog(body, prefix: str) -> Iterator[dict]:
+    with gzip.GzipFile(fileobj=body) as compressed:
+        reader = csv.DictReader(io.TextIOWrapper(compressed, newline=""), delimiter="\t")
+        for row in reader:
+            yield {
+                "Key": f"{prefix}{row['key']}",
+                "Size": int(row["size"]),
+                "ETag": row["etag"],
+                "ChecksumSHA256": row["sha256"],
+                "StorageClass": row["storage_class"],
+            }
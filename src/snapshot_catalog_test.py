@@ -0,0 +1,96 @@
+import hashlib
+import io
+import json
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from src.catalog import parse_key
+from src.snapshot_catalog import (
+    SnapshotCatalogWriter,
+    UploadDigests,
+    catalog_key,
+    file_digests,
+    index_key,
+    load_snapshot_catalog,
+    record_snapshot,
+)
+
+
+def test_file_digests(tmp_path):
+    data = bytes(range(256)) * 45_000
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    small = tmp_path / "small"
+    small.write_bytes(data[:1000])
+    assert file_digests(str(small), 1000) == (
+        f'"{hashlib.md5(data[:1000]).hexdigest()}"',
+        hashlib.sha256(data[:1000]).hexdigest(),
+    )
+
+    # Uploaded in parts of S3's 5 MB minimum.
+    config = TransferConfig(multipart_threshold=8 * 1024**2, multipart_chunksize=1)
+    part_size = 5 * 1024**2
+    parts = [data[slice(first, first + part_size)] for first in range(0, len(data), part_size)]
+    etag = hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts)).hexdigest()
+    assert file_digests(str(path), len(data), config) == (f'"{etag}-3"', sha256)
+
+    # Fed in chunks that don't line up with the parts, as a download writes them.
+    digests = UploadDigests(len(data), config)
+    digests.update(b"stale")
+    digests.reset()
+    chunk_size = 3_000_000
+    for first in range(0, len(data), chunk_size):
+        digests.update(data[slice(first, first + chunk_size)])
+    assert digests.digests() == (f'"{etag}-3"', sha256)
+
+
+def test_load_snapshot_catalog(mocker, tmp_path):
+    path = str(tmp_path / "catalog.tsv.gz")
+    with SnapshotCatalogWriter(path) as writer:
+        writer.add("backup/s1/backup.info", 10, '"abc"', "123", "DEEP_ARCHIVE")
+        writer.add("backup/s1/20230107-010000F/pg_data/1", 20, '"def-2"', "456", "DEEP_ARCHIVE")
+    assert (writer.objects, writer.bytes) == (2, 30)
+
+    s3 = mocker.Mock()
+    with open(path, "rb") as f:
+        s3.get_object.return_value = {"Body": io.BytesIO(f.read())}
+    objects = load_snapshot_catalog(s3, "b", "catalog-key", "crunchybridge/v2/c1/20230107/")
+    assert list(objects) == [
+        {
+            "Key": "crunchybridge/v2/c1/20230107/backup/s1/backup.info",
+            "Size": 10,
+            "ETag": '"abc"',
+            "ChecksumSHA256": "123",
+            "StorageClass": "DEEP_ARCHIVE",
+        },
+        {
+            "Key": "crunchybridge/v2/c1/20230107/backup/s1/20230107-010000F/pg_data/1",
+            "Size": 20,
+            "ETag": '"def-2"',
+            "ChecksumSHA256": "456",
+            "StorageClass": "DEEP_ARCHIVE",
+        },
+    ]
+
+    s3.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+    assert load_snapshot_catalog(s3, "b", "catalog-key", "crunchybridge/v2/c1/20230107/") is None
+
+
+def test_record_snapshot(mocker):
+    s3 = mocker.Mock()
+    s3.get_object.return_value = {
+        "Body": io.BytesIO(
+            json.dumps([{"target": "20230107", "objects": 1}, {"target": "20230121"}]).encode()
+        )
+    }
+    record_snapshot(s3, "b", "index-key", {"target": "20230107", "objects": 2})
+    body = json.loads(s3.put_object.call_args.kwargs["Body"])
+    assert body == [{"target": "20230107", "objects": 2}, {"target": "20230121"}]
+
+
+def test_catalog_keys_are_outside_the_snapshots():
+    assert parse_key(catalog_key("aspireprod", "20230107")) == (None, None, None)
+    assert parse_key(index_key("aspireprod")) == (None, None, None)
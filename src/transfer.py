@@ -0,0 +1,192 @@
+"""
+Concurrent server-side copies within our S3 buckets.
+
+``copy_object`` can only copy objects up to 5 GB, which large relation files
+can exceed. Objects above ``MULTIPART_THRESHOLD`` are copied with a multipart
+upload instead, copying their parts in parallel with ``UploadPartCopy``. A
+multipart upload doesn't copy the source's metadata like ``copy_object`` does,
+so it's read with ``head_object`` and set on the upload.
+
+Every request is made within an ``AdaptiveConcurrency`` slot, so the number
+of requests in flight adapts to S3's throttling, see ``src.concurrency``.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from src.concurrency import AdaptiveConcurrency
+
+# ENV Variables
+COPY_WORKERS = int(os.getenv("S3_COPY_WORKERS", "16"))
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(512 * 1024**2)))
+MULTIPART_PART_SIZE = int(os.getenv("S3_MULTIPART_PART_SIZE", str(128 * 1024**2)))
+
+# S3's limits for multipart uploads.
+MIN_PART_SIZE = 5 * 1024**2
+MAX_PARTS = 10000
+
+# The attributes copy_object carries over from the source, which a multipart copy has to set.
+COPIED_ATTRIBUTES = (
+    "CacheControl",
+    "ContentDisposition",
+    "ContentEncoding",
+    "ContentLanguage",
+    "ContentType",
+    "Metadata",
+)
+
+_EXHAUSTED = object()
+
+
+class Copy(NamedTuple):
+    bucket: str
+    src: str
+    dest: str
+    # The size of the source object. When unknown it's copied with a single copy_object.
+    size: Optional[int]
+    extra_args: dict
+
+
+def part_ranges(size: int, part_size: int) -> Iterator[tuple[int, int]]:
+    """Yield the inclusive (first, last) byte of each part of an object."""
+    part_size = max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS))
+    for first in range(0, size, part_size):
+        yield first, min(first + part_size, size) - 1
+
+
+def run_concurrently(pool, func, items: Iterable, max_in_flight: int) -> Iterator[tuple]:
+    """
+    Run ``func`` on each item in the pool, yielding each item and its result as it completes.
+
+    Only ``max_in_flight`` items are submitted at a time, so ``items`` can be
+    a lazy iterable of any length. The first failure is raised after the
+    in-flight items finish.
+    """
+    in_flight = {}
+    items = iter(items)
+    exhausted = False
+    while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+            item = next(items, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                exhausted = True
+                break
+            in_flight[pool.submit(func, item)] = item
+        if not in_flight:
+            return
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = in_flight.pop(future)
+            if future.exception():
+                wait(in_flight)
+                raise future.exception()
+            yield item, future.result()
+
+
+class CopyExecutor:
+    def __init__(
+        self,
+        s3,
+        max_workers: int = COPY_WORKERS,
+        multipart_threshold: int = MULTIPART_THRESHOLD,
+        part_size: int = MULTIPART_PART_SIZE,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+    ):
+        """
+        :param s3: The s3 client.
+        :param max_workers: The number of requests to start with in flight.
+        :param multipart_threshold: Objects larger than this are copied in parts.
+        :param part_size: The size of each part of a multipart copy.
+        :param concurrency: (Optional) The controller to share with other executors.
+                            By default the executor gets its own, starting at ``max_workers``.
+        """
+        self.s3 = s3
+        self.concurrency = concurrency or AdaptiveConcurrency(max_workers)
+        # There are enough threads for the most requests the controller allows.
+        self.max_workers = self.concurrency.max_limit
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self._object_pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="copy")
+        # Parts get their own pool so an object waiting on its parts can't
+        # starve them of workers.
+        self._part_pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="copy-part")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self):
+        self._object_pool.shutdown()
+        self._part_pool.shutdown()
+
+    def copy(self, copy: Copy) -> str:
+        """
+        Copy a single object.
+
+        :return str: The ETag of the new object.
+        """
+        if copy.size is None or copy.size <= self.multipart_threshold:
+            response = self.concurrency.call(
+                self.s3.copy_object,
+                Bucket=copy.bucket,
+                CopySource={"Bucket": copy.bucket, "Key": copy.src},
+                Key=copy.dest,
+                **copy.extra_args,
+            )
+            return response["CopyObjectResult"]["ETag"]
+        return self._multipart_copy(copy)
+
+    def copy_all(self, copies: Iterable[Copy]) -> Iterator[tuple[Copy, str]]:
+        """
+        Copy the objects concurrently, yielding each copy and its ETag as it completes.
+
+        ``copies`` can be a lazy iterable of any length, see ``run_concurrently``.
+        """
+        return run_concurrently(self._object_pool, self.copy, copies, self.max_workers * 2)
+
+    def _multipart_copy(self, copy: Copy) -> str:
+        source = self.concurrency.call(self.s3.head_object, Bucket=copy.bucket, Key=copy.src)
+        attributes = {name: source[name] for name in COPIED_ATTRIBUTES if source.get(name)}
+        upload_id = self.concurrency.call(
+            self.s3.create_multipart_upload,
+            Bucket=copy.bucket,
+            Key=copy.dest,
+            **attributes,
+            **copy.extra_args,
+        )["UploadId"]
+        futures = []
+        try:
+            futures = [
+                self._part_pool.submit(
+                    self.concurrency.call,
+                    self.s3.upload_part_copy,
+                    Bucket=copy.bucket,
+                    Key=copy.dest,
+                    CopySource={"Bucket": copy.bucket, "Key": copy.src},
+                    CopySourceRange=f"bytes={first}-{last}",
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                )
+                for part_number, (first, last) in enumerate(
+                    part_ranges(copy.size, self.part_size), start=1
+                )
+            ]
+            parts = [
+                {"ETag": future.result()["CopyPartResult"]["ETag"], "PartNumber": part_number}
+                for part_number, future in enumerate(futures, start=1)
+            ]
+            response = self.concurrency.call(
+                self.s3.complete_multipart_upload,
+                Bucket=copy.bucket,
+                Key=copy.dest,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception:
+            for future in futures:
+                future.cancel()
+            self.s3.abort_multipart_upload(Bucket=copy.bucket, Key=copy.dest, UploadId=upload_id)
+            raise
+        return response["ETag"]
@@ -0,0 +1,84 @@
+import pytest
+
+from src.transfer import Copy, CopyExecutor, part_ranges
+
+MB = 1024**2
+
+
+def test_part_ranges():
+    assert list(part_ranges(12 * MB, 5 * MB)) == [
+        (0, 5 * MB - 1),
+        (5 * MB, 10 * MB - 1),
+        (10 * MB, 12 * MB - 1),
+    ]
+    # Parts are never smaller than S3's 5 MB minimum.
+    assert list(part_ranges(6 * MB, 1)) == [(0, 5 * MB - 1), (5 * MB, 6 * MB - 1)]
+    # Parts grow to stay within S3's 10,000 part limit.
+    assert len(list(part_ranges(100_000 * MB, 5 * MB))) == 10000
+
+
+@pytest.fixture
+def s3(mocker):
+    s3 = mocker.Mock()
+    s3.copy_object.return_value = {"CopyObjectResult": {"ETag": '"small"'}}
+    s3.head_object.return_value = {
+        "ContentLength": 10 * MB,
+        "ContentType": "application/octet-stream",
+        "Metadata": {"checksum": "abc"},
+    }
+    s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    s3.upload_part_copy.side_effect = lambda **kwargs: {
+        "CopyPartResult": {"ETag": f'"part-{kwargs["PartNumber"]}"'}
+    }
+    s3.complete_multipart_upload.return_value = {"ETag": '"large-2"'}
+    return s3
+
+
+def test_copy_all(mocker, s3):
+    extra_args = {"StorageClass": "ONEZONE_IA"}
+    copies = [
+        Copy("b", "small", "v2/small", 10, extra_args),
+        Copy("b", "unknown", "v2/unknown", None, extra_args),
+        Copy("b", "large", "v2/large", 10 * MB, extra_args),
+    ]
+    with CopyExecutor(s3, max_workers=2, multipart_threshold=5 * MB, part_size=5 * MB) as executor:
+        results = {copy.dest: etag for copy, etag in executor.copy_all(copies)}
+
+    assert results == {"v2/small": '"small"', "v2/unknown": '"small"', "v2/large": '"large-2"'}
+    s3.copy_object.assert_any_call(
+        Bucket="b",
+        CopySource={"Bucket": "b", "Key": "small"},
+        Key="v2/small",
+        StorageClass="ONEZONE_IA",
+    )
+    # The source's metadata is carried over, as copy_object does.
+    s3.head_object.assert_called_once_with(Bucket="b", Key="large")
+    s3.create_multipart_upload.assert_called_once_with(
+        Bucket="b",
+        Key="v2/large",
+        ContentType="application/octet-stream",
+        Metadata={"checksum": "abc"},
+        StorageClass="ONEZONE_IA",
+    )
+    assert sorted(
+        call.kwargs["CopySourceRange"] for call in s3.upload_part_copy.call_args_list
+    ) == [f"bytes=0-{5 * MB - 1}", f"bytes={5 * MB}-{10 * MB - 1}"]
+    s3.complete_multipart_upload.assert_called_once_with(
+        Bucket="b",
+        Key="v2/large",
+        UploadId="upload-1",
+        MultipartUpload={
+            "Parts": [{"ETag": '"part-1"', "PartNumber": 1}, {"ETag": '"part-2"', "PartNumber": 2}]
+        },
+    )
+
+
+def test_multipart_copy_aborts_on_failure(s3):
+    s3.upload_part_copy.side_effect = ValueError("SlowDown")
+    with CopyExecutor(s3, max_workers=2, multipart_threshold=5 * MB, part_size=5 * MB) as executor:
+        with pytest.raises(ValueError):
+            list(executor.copy_all([Copy("b", "large", "v2/large", 10 * MB, {})]))
+    s3.abort_multipart_upload.assert_called_once_with(
+        Bucket="b", Key="v2/large", UploadId="upload-1"
+    )
+    assert not s3.complete_multipart_upload.called
@@ -0,0 +1,313 @@
+"""
+A long-running worker that takes copy, migrate and delete jobs from a queue.
+
+Running each backup as its own process pays for Python start up and new S3
+and CrunchyBridge API connections every time. The worker keeps its clients
+and connection pools warm and runs the queued jobs back to back, a few at a
+time, on one host.
+
+The queue is a SQLite spool, so jobs can be added from other processes:
+
+    python -m src.worker enqueue copy --cluster aspireprod --target 20230107
+    python -m src.worker enqueue migrate --cluster aspireprod --target 20230107
+    python -m src.worker enqueue delete --bucket aspiredu-pgbackups
+    python -m src.worker serve --concurrency 2
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Optional
+
+import sentry_sdk
+from dotenv import load_dotenv
+
+from src.concurrency import AdaptiveConcurrency
+from src.crunchy_copy import AU_BACKENDS, CrunchyCopy, validate_target
+from src.delete_backups import DELETE_WORKERS, enforce_retention_policy
+from src.migrate_backups import migrate_backups
+from src.s3 import get_s3
+from src.transfer import COPY_WORKERS
+
+# ENV Variables
+load_dotenv()
+
+ASPIRE_AWS_ACCESS_KEY_ID = os.getenv("ASPIRE_AWS_ACCESS_KEY_ID")
+ASPIRE_AWS_SECRET_ACCESS_KEY = os.getenv("ASPIRE_AWS_SECRET_ACCESS_KEY")
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    arguments TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, id);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        # Autocommit, with explicit transactions where a read and write must be atomic.
+        self.connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def enqueue(self, kind: str, **arguments) -> int:
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (kind, arguments, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(arguments), _now()),
+            )
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[dict]:
+        """Mark the oldest queued job as running and return it."""
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute(
+                "SELECT id, kind, arguments FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, _now(), row[0]),
+                )
+            self.connection.execute("COMMIT")
+        if not row:
+            return None
+        return {"id": row[0], "kind": row[1], "arguments": json.loads(row[2])}
+
+    def finish(self, job_id: int, error: Optional[str] = None):
+        with self._lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error else DONE, error, _now(), job_id),
+            )
+
+    def requeue_running(self) -> int:
+        """Requeue the jobs that were running when a previous worker stopped."""
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                (QUEUED, RUNNING),
+            )
+        return cursor.rowcount
+
+    def status(self, job_id: int) -> Optional[str]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, concurrency: int = 2, copy_workers: int = COPY_WORKERS):
+        """
+        :param queue: The queue to take jobs from.
+        :param concurrency: The number of jobs to run at the same time.
+        :param copy_workers: The number of requests migrate jobs start with in flight.
+        """
+        self.queue = queue
+        self.concurrency = concurrency
+        self.copy_workers = copy_workers
+        # The jobs share the request limits, so they back off together when S3 throttles.
+        self.copy_concurrency = AdaptiveConcurrency(copy_workers)
+        self.delete_concurrency = AdaptiveConcurrency(DELETE_WORKERS)
+        # Shared by every job, keeping their pools warm. Only the clients make requests,
+        # since boto3's clients are thread-safe and its resources aren't.
+        self.aspire_s3 = get_s3(
+            ASPIRE_AWS_ACCESS_KEY_ID,
+            ASPIRE_AWS_SECRET_ACCESS_KEY,
+            max_connections=self.delete_concurrency.max_limit,
+        )
+        self.default_s3 = get_s3(None, None, max_connections=self.copy_concurrency.max_limit)
+        # Jobs of the same kind for a cluster share its download directory or
+        # migration journal, so they take turns.
+        self._cluster_locks = defaultdict(threading.Lock)
+        self._cluster_locks_lock = threading.Lock()
+        self.handlers = {
+            "copy": self.run_copy,
+            "migrate": self.run_migrate,
+            "delete": self.run_delete,
+        }
+
+    def run_copy(self, cluster: str, target: Optional[str] = None, dry_run: bool = False):
+        bucket_name = (
+            "aspiredu-pgbackups" if cluster not in AU_BACKENDS else "aspiredu-pgbackups-au"
+        )
+        with CrunchyCopy(
+            bucket_name,
+            cluster,
+            backup_target=validate_target(target),
+            dry_run=dry_run,
+            s3=self.aspire_s3,
+        ) as crunchy_copy:
+            crunchy_copy.process()
+
+    def run_migrate(self, **arguments):
+        migrate_backups(
+            **{"storage_class": "ONEZONE_IA", "target": None, **arguments},
+            max_workers=self.copy_workers,
+            s3=self.default_s3,
+            concurrency=self.copy_concurrency,
+        )
+
+    def run_delete(self, bucket: str, **arguments):
+        enforce_retention_policy(
+            bucket, **arguments, s3=self.aspire_s3, concurrency=self.delete_concurrency
+        )
+
+    def _cluster_lock(self, job: dict):
+        cluster = job["arguments"].get("cluster")
+        if not cluster:
+            return nullcontext()
+        with self._cluster_locks_lock:
+            return self._cluster_locks[(job["kind"], cluster)]
+
+    def run(self, job: dict):
+        with self._cluster_lock(job):
+            self._run(job)
+
+    def _run(self, job: dict):
+        print(f"Starting job {job['id']}: {job['kind']} {job['arguments']}")
+        error = None
+        with sentry_sdk.start_transaction(op="job", name=job["kind"]):
+            try:
+                self.handlers[job["kind"]](**job["arguments"])
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                error = traceback.format_exc()
+                print(f"Job {job['id']} failed:\n{error}")
+        self.queue.finish(job["id"], error=error)
+        print(f"Finished job {job['id']}")
+
+    def serve(self, poll_interval: float = 5, exit_when_empty: bool = False):
+        """
+        Run jobs as they're queued.
+
+        :param poll_interval: The seconds to wait between checks of an empty queue.
+        :param exit_when_empty: Stop once the queue is empty and no jobs are running.
+
+        Only one worker should serve a queue, since jobs left running by a
+        previous worker are requeued when it starts.
+        """
+        requeued = self.queue.requeue_running()
+        if requeued:
+            print(f"Requeued {requeued} interrupted jobs")
+        running = set()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="job") as pool:
+            while True:
+                while len(running) < self.concurrency and (job := self.queue.claim()):
+                    running.add(pool.submit(self.run, job))
+                if not running:
+                    if exit_when_empty:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                _, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+
+
+def main():
+    # Optionally set up Sentry Integration
+    if SENTRY_DSN:
+        sentry_sdk.init(
+            dsn=SENTRY_DSN,
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0,
+        )
+
+    # Parse Arguments
+    parser = argparse.ArgumentParser(
+        prog="S3 Database Backup Worker",
+        description="Runs copy, migrate and delete jobs from a queue",
+    )
+    parser.add_argument(
+        "--queue",
+        default=JOB_QUEUE_PATH,
+        help="(Optional) The path to the SQLite job queue. Defaults to JOB_QUEUE_PATH.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the queued jobs.")
+    serve_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="(Optional) The number of jobs to run at the same time.",
+    )
+    serve_parser.add_argument(
+        "--copy-workers",
+        type=int,
+        default=COPY_WORKERS,
+        help="(Optional) The number of requests migrate jobs start with in flight.",
+    )
+    serve_parser.add_argument(
+        "--exit-when-empty",
+        action="store_true",
+        help="(Optional) Stop once every queued job has run.",
+    )
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add a job to the queue.")
+    enqueue_parser.add_argument("kind", choices=["copy", "migrate", "delete"])
+    enqueue_parser.add_argument("--cluster", help="The name of the database cluster.")
+    enqueue_parser.add_argument("--target", help="(Optional) The backup to target (YYYYMMDD).")
+    enqueue_parser.add_argument("--bucket", help="The name of the bucket for delete jobs.")
+    enqueue_parser.add_argument(
+        "--dry-run", action="store_true", help="(Optional) Print rather than change anything."
+    )
+
+    args = parser.parse_args()
+    queue = JobQueue(args.queue)
+    if args.command == "serve":
+        Worker(queue, concurrency=args.concurrency, copy_workers=args.copy_workers).serve(
+            exit_when_empty=args.exit_when_empty
+        )
+    else:
+        if args.kind == "delete":
+            if not args.bucket:
+                parser.error("--bucket is required for delete jobs")
+            arguments = {"bucket": args.bucket, "cluster": args.cluster}
+        else:
+            if not args.cluster:
+                parser.error(f"--cluster is required for {args.kind} jobs")
+            arguments = {"cluster": args.cluster, "target": args.target}
+        job_id = queue.enqueue(args.kind, dry_run=args.dry_run, **arguments)
+        print(f"Queued job {job_id}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
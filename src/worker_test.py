@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from src.worker import DONE, FAILED, QUEUED, RUNNING, JobQueue, Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_job_queue(queue):
+    first = queue.enqueue("copy", cluster="c1", target="20230107")
+    second = queue.enqueue("delete", bucket="b")
+    assert queue.claim() == {
+        "id": first,
+        "kind": "copy",
+        "arguments": {"cluster": "c1", "target": "20230107"},
+    }
+    assert queue.status(first) == RUNNING
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+
+    queue.finish(first)
+    assert queue.status(first) == DONE
+    assert queue.requeue_running() == 1
+    assert queue.status(second) == QUEUED
+
+
+def test_worker_serve(mocker, queue):
+    worker = Worker(queue, concurrency=2)
+    mocker.patch.dict(
+        worker.handlers,
+        {
+            "copy": mocker.Mock(),
+            "delete": mocker.Mock(side_effect=ValueError("boom")),
+        },
+    )
+    copy_jobs = [queue.enqueue("copy", cluster=f"c{i}") for i in range(3)]
+    delete_job = queue.enqueue("delete", bucket="b")
+
+    worker.serve(poll_interval=0.01, exit_when_empty=True)
+
+    assert [queue.status(job_id) for job_id in copy_jobs] == [DONE, DONE, DONE]
+    assert queue.status(delete_job) == FAILED
+    assert sorted(call.kwargs["cluster"] for call in worker.handlers["copy"].call_args_list) == [
+        "c0",
+        "c1",
+        "c2",
+    ]
+
+
+def test_worker_runs_a_clusters_jobs_one_at_a_time(mocker, queue):
+    worker = Worker(queue, concurrency=3)
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def copy(cluster, **kwargs):
+        with lock:
+            if cluster in running:
+                overlaps.append(cluster)
+            running.add(cluster)
+        time.sleep(0.05)
+        with lock:
+            running.discard(cluster)
+
+    mocker.patch.dict(worker.handlers, {"copy": copy})
+    jobs = [queue.enqueue("copy", cluster=cluster) for cluster in ["c1", "c1", "c2"]]
+
+    worker.serve(poll_interval=0.01, exit_when_empty=True)
+
+    assert [queue.status(job_id) for job_id in jobs] == [DONE, DONE, DONE]
+    assert overlaps == []